@@ -12,6 +12,7 @@ create table if not exists RESULT (
     HOTEL_GEOCODED_FLAG boolean default false,
     HOTEL_PAGE_MISSING_FLAG boolean default false,
     REVIEWS_SCRAPED_FLAG boolean default false,
+    FINGERPRINT int,
     SCRAPED_TIMESTAMP timestamp default current_timestamp,
     INSERT_UPDATE_TIMESTAMP timestamp default current_timestamp
 );
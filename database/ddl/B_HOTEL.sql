@@ -46,6 +46,7 @@ create table if not exists HOTEL (
     REVIEWS_2_POOR int,
     REVIEWS_1_TERRIBLE int,
     REVIEWS_KEYWORDS varchar,
+    FINGERPRINT int,
     SCRAPED_TIMESTAMP timestamp default current_timestamp,
     INSERT_UPDATE_TIMESTAMP timestamp default current_timestamp
 );
@@ -7,7 +7,7 @@ create table if not exists REVIEW (
     TITLE varchar,
     TEXT varchar,
     RATING int,
-    MONTH_OF_REVIEW varchar,
+    MONTH_OF_REVIEW int,
     YEAR_OF_REVIEW int,
     MONTH_OF_STAY int,
     YEAR_OF_STAY int,
@@ -19,7 +19,8 @@ create table if not exists REVIEW (
     RESPONSE_DATE varchar,
     RESPONSE_LANGUAGE varchar,
     USER_ID int,
-    HOTEL_ID int,    s
+    HOTEL_ID int,
+    FINGERPRINT int,
     SCRAPED_TIMESTAMP timestamp default current_timestamp,
     INSERT_UPDATE_TIMESTAMP timestamp default current_timestamp
 );
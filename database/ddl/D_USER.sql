@@ -9,6 +9,7 @@ create table if not exists USER (
     CONTRIBUTIONS int,
     HELPFUL_VOTES int,
     LOCATION varchar,
+    FINGERPRINT int,
     SCRAPED_TIMESTAMP timestamp default current_timestamp,
     INSERT_UPDATE_TIMESTAMP timestamp default current_timestamp
 );
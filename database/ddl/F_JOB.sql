@@ -0,0 +1,27 @@
+-- drop table if exists JOB
+-- ;
+
+create table if not exists JOB (
+    ID integer primary key,
+    KIND varchar,
+    HOTEL_ID int,
+    URL varchar,
+    STATE varchar default 'pending',
+    PRIORITY int default 0,
+    ATTEMPTS int default 0,
+    LEASE_OWNER varchar,
+    LEASE_EXPIRY float,
+    INSERT_UPDATE_TIMESTAMP timestamp default current_timestamp
+);
+
+-- one job per kind and url
+create unique index if not exists JOB_KIND_URL_IDX on JOB (KIND, URL);
+
+-- claims read only pending jobs, in priority order
+create index if not exists JOB_PENDING_IDX on JOB (KIND, PRIORITY desc, ID) where STATE = 'pending';
+
+-- expired leases are found by expiry, among leased jobs only
+create index if not exists JOB_LEASED_IDX on JOB (KIND, LEASE_EXPIRY) where STATE = 'leased';
+
+-- jobs of a hotel, to know when all its review pages are done
+create index if not exists JOB_HOTEL_IDX on JOB (KIND, HOTEL_ID);
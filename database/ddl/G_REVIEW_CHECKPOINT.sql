@@ -0,0 +1,11 @@
+-- drop table if exists REVIEW_CHECKPOINT
+-- ;
+
+create table if not exists REVIEW_CHECKPOINT (
+    HOTEL_ID int,
+    PAGE_NUMBER int,
+    REVIEW_OFFSET int,
+    REVIEWS int,
+    CHECKPOINT_TIMESTAMP timestamp default current_timestamp,
+    primary key (HOTEL_ID, PAGE_NUMBER)
+);
@@ -0,0 +1,27 @@
+-- drop table if exists RESULT_HISTORY
+-- ;
+
+create table if not exists RESULT_HISTORY (
+    HISTORY_ID integer primary key,
+    ID int,
+    RATING float,
+    REVIEWS int,
+    RANK int,
+    PLANNED_FLAG boolean default false,
+    SNAPSHOT_TIMESTAMP timestamp default current_timestamp
+);
+
+-- latest snapshots of each hotel, for the refresh planner
+create index if not exists RESULT_HISTORY_ID_IDX on RESULT_HISTORY (ID, HISTORY_ID);
+
+-- a snapshot for each new result, and for each change of the listing columns of a known result
+create trigger if not exists RESULT_HISTORY_INSERT_TRG after insert on RESULT
+begin
+    insert into RESULT_HISTORY (ID, RATING, REVIEWS, RANK) values (new.ID, new.RATING, new.REVIEWS, new.RANK);
+end;
+
+create trigger if not exists RESULT_HISTORY_UPDATE_TRG after update of RATING, REVIEWS, RANK on RESULT
+when old.RATING is not new.RATING or old.REVIEWS is not new.REVIEWS or old.RANK is not new.RANK
+begin
+    insert into RESULT_HISTORY (ID, RATING, REVIEWS, RANK) values (new.ID, new.RATING, new.REVIEWS, new.RANK);
+end;
@@ -0,0 +1,11 @@
+-- drop table if exists LANGUAGE_CACHE
+-- ;
+
+create table if not exists LANGUAGE_CACHE (
+    TEXT_HASH int primary key,
+    LANGUAGE varchar,
+    INSERT_UPDATE_TIMESTAMP timestamp default current_timestamp
+);
+
+-- reviews waiting for the language detection stage
+create index if not exists REVIEW_LANGUAGE_PENDING_IDX on REVIEW (ID) where LANGUAGE is null or RESPONSE_LANGUAGE is null;
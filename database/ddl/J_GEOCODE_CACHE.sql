@@ -0,0 +1,12 @@
+-- drop table if exists GEOCODE_CACHE
+-- ;
+
+create table if not exists GEOCODE_CACHE (
+    ADDRESS_KEY varchar primary key,
+    QUERY_ADDRESS varchar,
+    LATITUDE float,
+    LONGITUDE float,
+    ALTITUDE float,
+    SOURCE varchar,
+    INSERT_UPDATE_TIMESTAMP timestamp default current_timestamp
+);
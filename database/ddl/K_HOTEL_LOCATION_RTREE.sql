@@ -0,0 +1,48 @@
+-- drop table if exists HOTEL_LOCATION_RTREE
+-- ;
+
+-- one point per hotel: the best MapQuest location (rank 0) if any, otherwise the HOTEL coordinates.
+-- Bounds are 32 bit floats rounded outwards, exact coordinates are kept in the auxiliary columns
+create virtual table if not exists HOTEL_LOCATION_RTREE using rtree (
+    ID,
+    MIN_LATITUDE, MAX_LATITUDE,
+    MIN_LONGITUDE, MAX_LONGITUDE,
+    +LATITUDE,
+    +LONGITUDE
+);
+
+-- located hotels, to build the index. Not found (-1) and missing (999) coordinates are left out
+create view if not exists HOTEL_LOCATION as
+select HOTEL_ID as ID, LATITUDE, LONGITUDE from HOTEL_MAPQUEST_LOCATION
+where RANK=0 and LATITUDE between -90 and 90 and LONGITUDE between -180 and 180 and not (LATITUDE=-1 and LONGITUDE=-1)
+union all
+select ID, LATITUDE, LONGITUDE from HOTEL
+where LATITUDE between -90 and 90 and LONGITUDE between -180 and 180 and not (LATITUDE=-1 and LONGITUDE=-1)
+and ID not in (select HOTEL_ID from HOTEL_MAPQUEST_LOCATION where RANK=0 and LATITUDE between -90 and 90 and LONGITUDE between -180 and 180 and not (LATITUDE=-1 and LONGITUDE=-1));
+
+-- MapQuest locations replace the HOTEL coordinates. Old locations are deleted before a new geocoding: back to the HOTEL coordinates
+create trigger if not exists HOTEL_LOCATION_MAPQUEST_INSERT_TRG after insert on HOTEL_MAPQUEST_LOCATION
+when new.RANK=0 and new.LATITUDE between -90 and 90 and new.LONGITUDE between -180 and 180 and not (new.LATITUDE=-1 and new.LONGITUDE=-1)
+begin
+    insert or replace into HOTEL_LOCATION_RTREE values (new.HOTEL_ID, new.LATITUDE, new.LATITUDE, new.LONGITUDE, new.LONGITUDE, new.LATITUDE, new.LONGITUDE);
+end;
+
+create trigger if not exists HOTEL_LOCATION_MAPQUEST_DELETE_TRG after delete on HOTEL_MAPQUEST_LOCATION
+when old.RANK=0
+begin
+    delete from HOTEL_LOCATION_RTREE where ID=old.HOTEL_ID;
+    insert or replace into HOTEL_LOCATION_RTREE select ID, LATITUDE, LATITUDE, LONGITUDE, LONGITUDE, LATITUDE, LONGITUDE from HOTEL_LOCATION where ID=old.HOTEL_ID;
+end;
+
+-- HOTEL coordinates, for hotels without a MapQuest location
+create trigger if not exists HOTEL_LOCATION_HOTEL_INSERT_TRG after insert on HOTEL
+begin
+    insert or replace into HOTEL_LOCATION_RTREE select ID, LATITUDE, LATITUDE, LONGITUDE, LONGITUDE, LATITUDE, LONGITUDE from HOTEL_LOCATION where ID=new.ID;
+end;
+
+create trigger if not exists HOTEL_LOCATION_HOTEL_UPDATE_TRG after update of LATITUDE, LONGITUDE on HOTEL
+when old.LATITUDE is not new.LATITUDE or old.LONGITUDE is not new.LONGITUDE
+begin
+    delete from HOTEL_LOCATION_RTREE where ID=new.ID;
+    insert or replace into HOTEL_LOCATION_RTREE select ID, LATITUDE, LATITUDE, LONGITUDE, LONGITUDE, LATITUDE, LONGITUDE from HOTEL_LOCATION where ID=new.ID;
+end;
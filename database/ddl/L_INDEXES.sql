@@ -0,0 +1,79 @@
+-- drop table if exists HOTEL_REVIEW_STATS
+-- ;
+
+-- lookups of the reviews of a hotel, and of a user
+create index if not exists REVIEW_HOTEL_ID_IDX on REVIEW (HOTEL_ID);
+create index if not exists REVIEW_USER_ID_IDX on REVIEW (USER_ID);
+
+-- flag combinations the iterators enqueue from, only the matching rows are indexed
+create index if not exists RESULT_HOTEL_PENDING_IDX on RESULT (ID) where REVIEWS>0 and HOTEL_SCRAPED_FLAG=0; -- hotel
+create index if not exists RESULT_REVIEWS_PENDING_IDX on RESULT (ID) where HOTEL_SCRAPED_FLAG=1 and REVIEWS_SCRAPED_FLAG=0 and HOTEL_PAGE_MISSING_FLAG=0; -- review
+create index if not exists RESULT_REVIEWS_SCRAPED_IDX on RESULT (ID, REVIEWS) where HOTEL_SCRAPED_FLAG=1 and REVIEWS_SCRAPED_FLAG=1 and HOTEL_PAGE_MISSING_FLAG=0; -- review refresh
+create index if not exists RESULT_GEOCODE_PENDING_IDX on RESULT (ID) where HOTEL_GEOCODED_FLAG=0 and HOTEL_SCRAPED_FLAG=1; -- hotel geocoder
+
+-- reviews of each hotel in the db, kept by the triggers below
+create table if not exists HOTEL_REVIEW_STATS (
+    HOTEL_ID int primary key,
+    REVIEWS int default 0,
+    RATED_REVIEWS int default 0,
+    RATING_SUM int default 0,
+    LAST_REVIEW_DATE varchar,
+    INSERT_UPDATE_TIMESTAMP timestamp default current_timestamp
+);
+
+-- REVIEW rows are upserted: insert or replace deletes the old row without firing the delete trigger (recursive triggers are off)
+create trigger if not exists HOTEL_REVIEW_STATS_INSERT_TRG after insert on REVIEW
+begin
+    insert into HOTEL_REVIEW_STATS (HOTEL_ID, REVIEWS, RATED_REVIEWS, RATING_SUM, LAST_REVIEW_DATE)
+    values (
+        new.HOTEL_ID, 1,
+        new.RATING between 1 and 5,
+        case when new.RATING between 1 and 5 then new.RATING else 0 end,
+        case when new.YEAR_OF_REVIEW>0 and cast(new.MONTH_OF_REVIEW as int) between 1 and 12 then printf('%04d-%02d', new.YEAR_OF_REVIEW, cast(new.MONTH_OF_REVIEW as int)) end
+    )
+    on conflict (HOTEL_ID) do update set
+        REVIEWS=REVIEWS+1,
+        RATED_REVIEWS=RATED_REVIEWS+excluded.RATED_REVIEWS,
+        RATING_SUM=RATING_SUM+excluded.RATING_SUM,
+        LAST_REVIEW_DATE=coalesce(max(LAST_REVIEW_DATE, excluded.LAST_REVIEW_DATE), LAST_REVIEW_DATE, excluded.LAST_REVIEW_DATE),
+        INSERT_UPDATE_TIMESTAMP=current_timestamp;
+end;
+
+-- the last review date is read again from the reviews of the hotel: deletes and changed dates are rare
+create trigger if not exists HOTEL_REVIEW_STATS_DELETE_TRG after delete on REVIEW
+begin
+    update HOTEL_REVIEW_STATS set
+        REVIEWS=REVIEWS-1,
+        RATED_REVIEWS=RATED_REVIEWS-(old.RATING between 1 and 5),
+        RATING_SUM=RATING_SUM-(case when old.RATING between 1 and 5 then old.RATING else 0 end),
+        LAST_REVIEW_DATE=(
+            select max(printf('%04d-%02d', YEAR_OF_REVIEW, cast(MONTH_OF_REVIEW as int))) from REVIEW
+            where HOTEL_ID=old.HOTEL_ID and YEAR_OF_REVIEW>0 and cast(MONTH_OF_REVIEW as int) between 1 and 12
+        ),
+        INSERT_UPDATE_TIMESTAMP=current_timestamp
+    where HOTEL_ID=old.HOTEL_ID;
+end;
+
+-- re-scraped reviews with the same values don't fire it
+create trigger if not exists HOTEL_REVIEW_STATS_UPDATE_TRG after update of HOTEL_ID, RATING, YEAR_OF_REVIEW, MONTH_OF_REVIEW on REVIEW
+when old.HOTEL_ID is not new.HOTEL_ID or old.RATING is not new.RATING or old.YEAR_OF_REVIEW is not new.YEAR_OF_REVIEW or old.MONTH_OF_REVIEW is not new.MONTH_OF_REVIEW
+begin
+    update HOTEL_REVIEW_STATS set
+        REVIEWS=REVIEWS-1,
+        RATED_REVIEWS=RATED_REVIEWS-(old.RATING between 1 and 5),
+        RATING_SUM=RATING_SUM-(case when old.RATING between 1 and 5 then old.RATING else 0 end)
+    where HOTEL_ID=old.HOTEL_ID;
+    insert into HOTEL_REVIEW_STATS (HOTEL_ID, REVIEWS, RATED_REVIEWS, RATING_SUM)
+    values (new.HOTEL_ID, 1, new.RATING between 1 and 5, case when new.RATING between 1 and 5 then new.RATING else 0 end)
+    on conflict (HOTEL_ID) do update set
+        REVIEWS=REVIEWS+1,
+        RATED_REVIEWS=RATED_REVIEWS+excluded.RATED_REVIEWS,
+        RATING_SUM=RATING_SUM+excluded.RATING_SUM;
+    update HOTEL_REVIEW_STATS set
+        LAST_REVIEW_DATE=(
+            select max(printf('%04d-%02d', YEAR_OF_REVIEW, cast(MONTH_OF_REVIEW as int))) from REVIEW
+            where HOTEL_ID=HOTEL_REVIEW_STATS.HOTEL_ID and YEAR_OF_REVIEW>0 and cast(MONTH_OF_REVIEW as int) between 1 and 12
+        ),
+        INSERT_UPDATE_TIMESTAMP=current_timestamp
+    where HOTEL_ID in (old.HOTEL_ID, new.HOTEL_ID);
+end;
@@ -10,9 +10,52 @@ DB_FOLDER_PATH = current_dir.parent / 'database'
 DDL_FOLDER_PATH = current_dir.parent / 'database' / 'ddl'
 LOG_FOLDER_PATH = current_dir.parent / 'logs'
 BROWSER_FOLDER_PATH = current_dir.parent / 'browser'
+ARCHIVE_FOLDER_PATH = current_dir.parent / 'archive'
 API_KEYS_FILE_PATH = current_dir / 'keys.py'
 
 # flags
 DEBUG_MODE = False
 
+# rate limits, shared by all workers
+RATE_LIMITED_DOMAIN_LIST = ['www.tripadvisor.com']
+REQUESTS_PER_MINUTE = 20
+REQUESTS_BURST = 3 # page loads allowed back to back, after an idle time
+MAX_BACKOFF = 16 # max slow down of the rate, after errors or throttling
+THROTTLED_TITLE_LIST = ['429', 'too many requests', 'access denied', 'captcha'] # page titles of throttling pages, lowercase
+
+# refresh planner: priority of a changed hotel, in new reviews. Rank moves below the minimum are listing noise
+REFRESH_RATING_WEIGHT = 100 # a 0.5 rating change weighs as 50 new reviews
+REFRESH_RANK_WEIGHT = 0.1 # a 50 places rank move weighs as 5 new reviews
+REFRESH_MIN_RANK_CHANGE = 10
+
+# geocoding
+GEOCODER_MIN_INTERVAL = 1 # seconds between calls to the remote geocoder (Nominatim usage policy), cached addresses don't wait
+
+# mapquest geocoding (HotelGeocoder)
+MAPQUEST_BASE_URL = 'https://www.mapquestapi.com'
+MAPQUEST_REQUESTS_PER_MINUTE = 120 # batch requests, up to MAPQUEST_BATCH_SIZE addresses each
+MAPQUEST_BATCH_SIZE = 100 # max locations of the batch endpoint
+MAPQUEST_CONCURRENCY = 4 # requests in flight
+
+# db connections (db_connection.py)
+DB_BUSY_TIMEOUT = 60 # seconds a connection waits on a locked db before failing
+DB_SYNCHRONOUS = 'NORMAL' # in WAL mode, commits are not synced: a power loss can lose the last commits, never corrupt the db
+DB_CACHE_SIZE_MB = 64 # page cache of each connection
+DB_MMAP_SIZE_MB = 256 # db file memory mapped for reads
+DB_MAX_GROUP = 64 # flushes committed together by the writer
+DB_WRITE_BEHIND_ROWS = 1000 # statements held by an iterator before committing them
+DB_DURABILITY_WINDOW = 2 # seconds an iterator holds statements before committing them, at most (checked at the end of each page)
+
+# light browser profile: requests blocked through devtools (wildcard patterns). Pages are read as text only
+BLOCKED_URL_PATTERN_LIST = [
+    # images, media, fonts
+    '*.jpg', '*.jpeg', '*.png', '*.gif', '*.webp', '*.avif', '*.svg', '*.ico',
+    '*.mp4', '*.webm', '*.mp3', '*.m3u8',
+    '*.woff', '*.woff2', '*.ttf', '*.otf',
+    # third party hosts: ads, analytics, maps tiles
+    '*doubleclick.net*', '*googlesyndication.com*', '*googletagmanager.com*', '*google-analytics.com*',
+    '*facebook.net*', '*facebook.com/tr*', '*criteo.com*', '*criteo.net*', '*adsrvr.org*', '*amazon-adsystem.com*',
+    '*scorecardresearch.com*', '*quantserve.com*', '*hotjar.com*', '*bing.com/action*', '*maps.googleapis.com*', '*maps.gstatic.com*'
+]
+
 # print(DATABASE_PATH / 'test.db')
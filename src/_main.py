@@ -1,9 +1,69 @@
+import argparse
+import os
 from base_iterator import BaseIterator
 from result_iterator import ResultIterator
 from hotel_iterator import HotelIterator
 from review_iterator import ReviewIterator
+from worker_pool import run_worker_pool
+from pipeline import run_pipeline
+from rate_limiter import RateLimiter
+from reparse import run_reparse
+from refresh_planner import run_refresh_plan
+from language_detection import run_language_detection
+from geocoding_stage import run_geocoding
+from spatial_index import run_spatial_index
+from migration import run_migration
+from _config import REQUESTS_PER_MINUTE, REQUESTS_BURST
 
 
+iterator_dict = {
+    'result': ResultIterator,
+    'hotel': HotelIterator,
+    'review': ReviewIterator
+}
+
 if __name__ == '__main__':
-    bi = ReviewIterator(test=False, log_file_name='review_iterator.log', db_name='hotel.db', db_connection=True, browser_driver=True)
-    bi.run()
+    parser = argparse.ArgumentParser(description='Run an iterator, reparse the archived pages, plan a refresh of the changed hotels, detect review languages, geocode hotels, rebuild the spatial index of the hotels, or migrate the db (indexes and review stats)')
+    parser.add_argument('command', nargs='?', choices=list(iterator_dict.keys()) + ['reparse', 'plan', 'languages', 'geocode', 'spatial', 'migrate'], default='review')
+    parser.add_argument('--workers', type=int, default=1, help='number of browser workers, claiming hotels (or listing pages) from the shared job queue')
+    parser.add_argument('--requests-per-minute', type=float, default=REQUESTS_PER_MINUTE, help='page loads per minute on the site, across all workers')
+    parser.add_argument('--burst', type=int, default=REQUESTS_BURST, help='page loads allowed back to back, after an idle time')
+    parser.add_argument('--archive-pages', action='store_true', help='save the raw pages in the page archive')
+    parser.add_argument('--incremental', action='store_true', help='review only: refresh scraped hotels with new reviews, newest first, until the known ones')
+    parser.add_argument('--refresh', action='store_true', help='result only: read the whole listing, also pages without new results, to snapshot it for the refresh planner')
+    parser.add_argument('--light-profile', action='store_true', help='headless browser, blocking images, media, fonts and third party hosts')
+    parser.add_argument('--pipeline', action='store_true', help='run fetch, parse and write as separate stages, with --workers fetchers and --processes parsers')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='parse processes, for reparse and pipeline. Detection processes, for languages')
+    parser.add_argument('--rebuild', action='store_true', help='migrate only: count again the reviews of each hotel')
+    parser.add_argument('--test', action='store_true', help='log to console and use test.db')
+    args = parser.parse_args()
+    log_file_name = f'{args.command}_iterator.log' if args.command in iterator_dict else f'{args.command}.log'
+    db_name = 'test.db' if args.test else 'hotel.db'
+    iterator_kwargs = {'archive_pages': args.archive_pages, 'light_profile': args.light_profile}
+    if args.incremental:
+        iterator_kwargs['incremental'] = True
+    if args.refresh:
+        iterator_kwargs['refresh'] = True
+    if args.command == 'reparse':
+        run_reparse(processes=args.processes, test=args.test, log_file_name=log_file_name, db_name=db_name)
+    elif args.command == 'languages':
+        run_language_detection(processes=args.processes, test=args.test, log_file_name=log_file_name, db_name=db_name)
+    elif args.command == 'geocode':
+        run_geocoding(test=args.test, log_file_name=log_file_name, db_name=db_name)
+    elif args.command == 'migrate':
+        run_migration(test=args.test, log_file_name=log_file_name, db_name=db_name, rebuild=args.rebuild)
+    elif args.command == 'spatial':
+        run_spatial_index(test=args.test, log_file_name=log_file_name, db_name=db_name)
+    elif args.command == 'plan':
+        run_refresh_plan(test=args.test, log_file_name=log_file_name, db_name=db_name)
+    elif args.refresh and args.command != 'result':
+        parser.error('--refresh is supported by the result iterator only')
+    elif args.incremental and (args.command != 'review' or args.pipeline):
+        parser.error('--incremental is supported by the review iterator only, without --pipeline')
+    elif args.pipeline:
+        run_pipeline(iterator_dict[args.command], fetchers=args.workers, parsers=args.processes, requests_per_minute=args.requests_per_minute, burst=args.burst, test=args.test, log_file_name=log_file_name, db_name=db_name, iterator_kwargs=iterator_kwargs)
+    elif args.workers > 1: # result pages are scraped concurrently by offset
+        run_worker_pool(iterator_dict[args.command], workers=args.workers, requests_per_minute=args.requests_per_minute, burst=args.burst, test=args.test, log_file_name=log_file_name, db_name=db_name, iterator_kwargs=iterator_kwargs)
+    else:
+        bi = iterator_dict[args.command](test=args.test, log_file_name=log_file_name, db_name=db_name, db_connection=True, browser_driver=True, rate_limiter=RateLimiter(args.requests_per_minute, args.burst), **iterator_kwargs)
+        bi.run()
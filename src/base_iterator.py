@@ -1,27 +1,31 @@
 import logging
-import time
-import random
-import sqlite3
-import hashlib
 from selenium import webdriver
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By 
-from _config import LOG_FOLDER_PATH, DB_FOLDER_PATH, BROWSER_FOLDER_PATH
+from _config import DB_FOLDER_PATH, BROWSER_FOLDER_PATH, BLOCKED_URL_PATTERN_LIST, THROTTLED_TITLE_LIST, DB_WRITE_BEHIND_ROWS, DB_DURABILITY_WINDOW
+from db_connection import get_connection, WriterThread
+from db_writer import WriteBehindDbWriter
+from page_archive import PageArchive
+from run_utils import set_logging, get_hashed_id
 
 
 class BaseIterator:
     """ Base class for all iterators """
-    def __init__(self, test=True, log_file_name='test.log', db_name='test.db', db_connection=True, browser_driver=True):
-        if test:
-            logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s') # log to console
-        else:
-            logging.basicConfig(filename=LOG_FOLDER_PATH/log_file_name, filemode='a', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')  # log to file
+    def __init__(self, test=True, log_file_name='test.log', db_name='test.db', db_connection=True, browser_driver=True, worker_id=None, db_writer=None, rate_limiter=None, archive_pages=False, light_profile=False):
+        self._set_logging(test, log_file_name)
         logging.info('Started initialization')
         logging.info(f'Test: {test}')
         self.db_name = db_name
+        self.worker_id = worker_id # set when running in a worker pool, isolates the browser user data
         self.connection = None
         self.cursor = None
+        self.db_writer = db_writer # passed when running in a worker pool, otherwise created when run
+        self.writer_thread = None
+        self.job_queue = None
+        self.rate_limiter = rate_limiter
+        self.page_archive = PageArchive() if archive_pages else None # raw pages, to parse them again offline
+        self.light_profile = light_profile # headless browser, not loading images, media, fonts and third party hosts
         self.driver = None
         self.url = None
         self._get_cursor() if db_connection else None
@@ -33,28 +37,71 @@ class BaseIterator:
     # connection methods
     
     def _get_cursor(self):
-        """ Get cursor to db """
+        """
+        Get a read only cursor to the db: rows are written by the writer only. Tables are set up before,
+        through a short lived write connection
+        """
         try:
-            self.connection = sqlite3.connect(DB_FOLDER_PATH/self.db_name)
+            setup_connection = get_connection(DB_FOLDER_PATH/self.db_name)
+            try:
+                self._setup_tables(setup_connection)
+                setup_connection.commit()
+            finally:
+                setup_connection.close()
+            self.connection = get_connection(DB_FOLDER_PATH/self.db_name, read_only=True)
             self.cursor = self.connection.cursor()
             logging.info('Got cursor')
         except Exception as e:
             logging.error('Error getting cursor')
             logging.exception('An error occurred')
         return
+
+    def _get_db_writer(self):
+        """
+        Get the writer of the rows, through a write-behind buffer: the writer thread of the process, unless a pool writer is passed.
+        Only when run, fetchers don't write rows
+        """
+        if self.db_writer is None:
+            self.writer_thread = WriterThread(DB_FOLDER_PATH/self.db_name)
+            self.writer_thread.start()
+            self.db_writer = self.writer_thread.get_db_writer()
+        self.db_writer = WriteBehindDbWriter(self.db_writer, max_rows=DB_WRITE_BEHIND_ROWS, max_seconds=DB_DURABILITY_WINDOW)
+        logging.info('Got db writer')
+        return
     
+    def _get_chrome_options(self):
+        """ Options of the browser. With the light profile, browser is headless and doesn't load images """
+        chrome_options = webdriver.ChromeOptions()
+        user_data_dir = 'user_data' if self.worker_id is None else f'user_data_{self.worker_id}' # each worker has its own browser profile
+        chrome_options.add_argument(f'--user-data-dir={BROWSER_FOLDER_PATH}/{user_data_dir}')
+        chrome_options.add_argument('--disable-blink-features=AutomationControlled') 
+        chrome_options.add_experimental_option('excludeSwitches', ['enable-automation']) # remove "Chrome is being controlled by an automated software"
+        chrome_options.add_experimental_option('useAutomationExtension', False) 
+        # chrome_options.add_argument('Mozilla/5.0 (iPhone; CPU iPhone OS 12_4_8 like Mac OS X) AppleWebKit/534.2 (KHTML, like Gecko) FxiOS/17.5h1393.0 Mobile/09X753 Safari/534.2')
+        # chrome_options.add_argument('--incognito')
+        if self.light_profile:
+            chrome_options.add_argument('--headless=new')
+            chrome_options.add_argument('--window-size=1920,1080') # same layout as the headed browser
+            chrome_options.add_argument('--blink-settings=imagesEnabled=false')
+        return chrome_options
+
+    def _set_light_profile(self):
+        """
+        Block the requests not needed to read the pages, through devtools: images, media, fonts and third party hosts.
+        Also emulate focus: the price widget loads only in a focused window, and a headless window is never focused
+        """
+        self.driver.execute_cdp_cmd('Network.enable', {})
+        self.driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_URL_PATTERN_LIST})
+        self.driver.execute_cdp_cmd('Emulation.setFocusEmulationEnabled', {'enabled': True})
+        logging.info('Set light profile')
+        return
+
     def _get_driver(self):
         """ Return a driver to use selenium """
         try:
-            chrome_options = webdriver.ChromeOptions()
-            chrome_options.add_argument(f'--user-data-dir={BROWSER_FOLDER_PATH}/user_data')
-            chrome_options.add_argument('--disable-blink-features=AutomationControlled') 
-            chrome_options.add_experimental_option('excludeSwitches', ['enable-automation']) # remove "Chrome is being controlled by an automated software"
-            chrome_options.add_experimental_option('useAutomationExtension', False) 
-            # chrome_options.add_argument('Mozilla/5.0 (iPhone; CPU iPhone OS 12_4_8 like Mac OS X) AppleWebKit/534.2 (KHTML, like Gecko) FxiOS/17.5h1393.0 Mobile/09X753 Safari/534.2')
-            # chrome_options.add_argument('--incognito')
-            self.driver = webdriver.Chrome(options=chrome_options)
+            self.driver = webdriver.Chrome(options=self._get_chrome_options())
             self.driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})") 
+            self._set_light_profile() if self.light_profile else None
             # time.sleep(1000)
             logging.info('Got driver')
         except Exception as e:
@@ -66,19 +113,14 @@ class BaseIterator:
     # utility methods
     
     @staticmethod
-    def _get_hashed_id(string):
-        hash_value = hashlib.sha256(string.encode()).hexdigest() # Calculate the SHA-256 hash of the string
-        hash_int = int(hash_value, 16) # Convert the hexadecimal hash value to an integer
-        truncated_hash = hash_int % (10 ** 18) # Truncate the integer to 20 digits. It has sufficient collision resistance for this use case
-        return truncated_hash
-    
-    @staticmethod
-    def _wait_humanly(min_time=4, max_time=6):
-        """ Wait a random time between min_time and max_time seconds """
-        time_to_sleep = random.uniform(min_time, max_time)
-        logging.info(f'Waiting {time_to_sleep} seconds')
-        time.sleep(time_to_sleep)
+    def _set_logging(test=True, log_file_name='test.log'):
+        """ Log to console if test, to file otherwise """
+        set_logging(test, log_file_name)
         return
+
+    @staticmethod
+    def _get_hashed_id(string):
+        return get_hashed_id(string)
     
     @staticmethod
     def _reset_dict(dict_to_reset):
@@ -90,16 +132,76 @@ class BaseIterator:
     
     # page methods
 
+    def _wait_rate_limit(self):
+        """ Wait for the shared rate limiter before loading a page. No limit if no rate limiter is set """
+        if self.rate_limiter is not None:
+            self.rate_limiter.wait(self.url)
+        return
+
+    def _report_page_load(self, error=False):
+        """ Tell the rate limiter how a page load went. Errors and throttling pages slow down all the workers """
+        if self.rate_limiter is None:
+            return
+        if error:
+            self.rate_limiter.report_error(self.url)
+        elif any(marker in self.driver.title.lower() for marker in THROTTLED_TITLE_LIST):
+            logging.error(f'Throttled by the site: {self.driver.title}')
+            self.rate_limiter.report_error(self.url, throttled=True)
+        else:
+            self.rate_limiter.report_success(self.url)
+        return
+
     def _get_page(self):
         """ Load the page """
         try:
+            self._wait_rate_limit()
             self.driver.get(self.url)
+            self._report_page_load()
             logging.info(f'Got page: {self.url}')
         except Exception as e:
+            self._report_page_load(error=True)
             logging.error('Error getting page')
             logging.exception('An error occurred')
         return
 
+    def _archive_page(self, page_type, hotel_id=-1, page_number=-1):
+        """ Save the current page source in the archive, if archiving is enabled """
+        if self.page_archive is not None:
+            url = self.driver.current_url
+            self.page_archive.save(self._get_hashed_id(url), url, page_type, self.driver.page_source, hotel_id=hotel_id, page_number=page_number)
+        return
+
+    def _put_snapshot(self, page_queue, page_type, hotel_id=-1, page_number=-1):
+        """ Put the current page source in the pipeline page queue. Blocks while the queue is full, slowing down the fetchers """
+        self._archive_page(page_type, hotel_id=hotel_id, page_number=page_number)
+        page_queue.put({
+            'page_type': page_type,
+            'url': self.driver.current_url,
+            'hotel_id': hotel_id,
+            'page_number': page_number,
+            'job_id': getattr(self, 'job_id', None),
+            'owner': self.job_queue.owner if self.job_queue is not None else None,
+            'lease_token': self.job_queue.lease_token if self.job_queue is not None else None,
+            'page_source': self.driver.page_source
+        })
+        logging.info(f'Put page in pipeline: {page_type}, {self.driver.current_url}')
+        return
+
+    def _put_job_done(self, page_queue, hotel_id, pages, reviews_number=None):
+        """ Tell the pipeline writer that all the pages of the current job are fetched, to update the flag and complete the job once written """
+        page_queue.put({
+            'page_type': 'job_done',
+            'kind': self.job_queue.kind,
+            'job_id': self.job_id,
+            'owner': self.job_queue.owner,
+            'lease_token': self.job_queue.lease_token,
+            'hotel_id': hotel_id,
+            'pages': pages,
+            'reviews_number': reviews_number
+        })
+        logging.info(f'Put job done in pipeline: {self.job_id}, {pages} pages')
+        return
+
     # to do: rename to _wait_and_return_element() or similar. Use everywhere in the code, in place of EC?
     def _check_page(self, class_to_check): # looks for specific classes to check if the page is loaded
         """ Check if the page is loaded, based on the presence of a class """
@@ -132,40 +234,23 @@ class BaseIterator:
             return
         
     def _insert_replace_row(self, table, column_value_dict, commit=True):
-        """ Insert or replace a row in the db """
+        """ Insert or replace a row in the db. Row is buffered in the writer, and written when committing """
         try:
-            columns = ', '.join(column_value_dict.keys())
-            # replace None values with -1 for integer columns and 'NULL' for text columns
-            for key, value in column_value_dict.items():
-                if value is None:
-                    if self.cursor.execute(f'pragma table_info({table})').fetchall()[list(column_value_dict.keys()).index(key)][2] == 'INTEGER':
-                        column_value_dict[key] = -1
-                    else:
-                        column_value_dict[key] = 'NA'
-            # replace True and False values with 1 and 0
-            for key, value in column_value_dict.items():
-                if value == True:
-                    column_value_dict[key] = 1
-                elif value == False:
-                    column_value_dict[key] = 0
-            values = ', '.join(['"'+str(value).replace('"','""')+'"' for value in column_value_dict.values()])
-            query = f'insert or replace into {table} ({columns}) values ({values});'
-            self.cursor.execute(query)
+            self.db_writer.insert_replace_row(table, column_value_dict)
             if commit:
-                self.connection.commit()
+                self.db_writer.flush()
             logging.info(f'Inserted or replaced row in db')
         except Exception as e:
             logging.error('Error inserting or replacing row in db')
             logging.error(f'Columns and values: {column_value_dict}')
-            logging.error(f'Query: {query}')
             logging.exception('An error occurred')
         return
     
-    def _update_flag(self, table, column, value, condition='1=0'): # default condition to avoid updating all rows
+    def _update_flag(self, table, column, value, condition='1=0'): # default condition to avoid updating all rows
         """ Update a flag in the db """
         try:
-            self.cursor.execute(f'update {table} set {column}={value} where {condition};')
-            self.connection.commit()
+            self.db_writer.update_flag(table, column, value, condition)
+            self.db_writer.flush()
             logging.info(f'Updated flag in db')
         except Exception as e:
             logging.error('Error updating flag in db')
@@ -178,21 +263,60 @@ class BaseIterator:
     def run(self):
         """ Run the iterator. Calls subclass that has to be implemented by the subclass """
         try:
+            self._get_db_writer()
             self._subclass_run()
         except Exception as e:
             logging.error('Error in run')
             logging.exception('An error occurred')
         finally:
-            logging.info('Quitting')
-            self._wait_humanly()
-            self.driver.quit()
-            self.connection.close()
+            self._flush_writes()
+            self._quit()
+        return
+
+    def fetch(self, page_queue):
+        """ Run the iterator in fetch only mode, for the pipeline: pages are put in page_queue, parsed and written by the other stages """
+        try:
+            self._subclass_fetch(page_queue)
+        except Exception as e:
+            logging.error('Error in fetch')
+            logging.exception('An error occurred')
+        finally:
+            self._flush_writes()
+            self._quit()
+        return
+
+    def _flush_writes(self):
+        """ Commit the buffered rows and run their after commit actions, before the job queues are closed """
+        try:
+            self.db_writer.flush(force=True) if isinstance(self.db_writer, WriteBehindDbWriter) else None
+        except Exception as e:
+            logging.error('Error committing buffered rows')
+            logging.exception('An error occurred')
+        return
+
+    def _quit(self):
+        """ Quit driver and close connections """
+        logging.info('Quitting')
+        self.driver.quit()
+        self.job_queue.close() if self.job_queue is not None else None
+        self.page_archive.close() if self.page_archive is not None else None
+        self.writer_thread.stop() if self.writer_thread is not None else None
+        self.connection.close()
         return
     
+    def _setup_tables(self, connection):
+        """ Placeholder method for subclasses to create or migrate the tables they need, with the write connection passed """
+        return
+
     def _subclass_run(self):
         """ 
         Placeholder method for subclasses to implement its specific tasks.
         Each subclass implements the method to iterate through specific pages and scrape data
         """
         raise NotImplementedError('Subclasses must implement _subclass_run method')
-        return
\ No newline at end of file
+        return
+
+    def _subclass_fetch(self, page_queue):
+        """ Placeholder method for subclasses to implement, iterating the same pages as _subclass_run without scraping them """
+        raise NotImplementedError('Subclasses must implement _subclass_fetch method')
+        return
@@ -0,0 +1,407 @@
+import argparse
+import json
+import logging
+import random
+import statistics
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+from db_writer import DbWriter
+
+
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s') # benchmarks print their own results
+DDL_FOLDER_PATH = Path(__file__).resolve().parent.parent / 'database' / 'ddl'
+
+
+
+# synthetic data
+
+def _get_benchmark_connection(folder, ddl_file_list):
+    """ Create a fresh db in folder, with the tables of the given ddl files """
+    connection = sqlite3.connect(Path(folder) / 'benchmark.db')
+    for ddl_file in ddl_file_list:
+        connection.executescript((DDL_FOLDER_PATH / ddl_file).read_text())
+    connection.commit()
+    return connection
+
+def _get_synthetic_reviews(reviews_number, seed=0):
+    """ Generate (review_dict, user_dict) couples shaped like the ones of ReviewIterator """
+    rng = random.Random(seed)
+    for i in range(reviews_number):
+        user_url = f'https://www.tripadvisor.com/Profile/user{rng.randint(0, reviews_number // 3)}'
+        has_response = rng.random() < 0.4
+        review_dict = {
+            'id': i,
+            'url': f'https://www.tripadvisor.com/ShowUserReviews-g187791-d{i // 1000}-r{i}.html',
+            'title': f'Title of review {i}',
+            'text': 'Lorem ipsum dolor sit amet "quoted" ' * rng.randint(2, 20),
+            'rating': str(rng.randint(1, 5)),
+            'month_of_review': rng.randint(1, 12),
+            'year_of_review': str(rng.randint(2005, 2024)),
+            'month_of_stay': rng.randint(1, 12),
+            'year_of_stay': str(rng.randint(2005, 2024)),
+            'likes': str(rng.randint(0, 10)),
+            'pics_flag': rng.random() < 0.2,
+            'language': 'en',
+            'response_from': 'Manager' if has_response else None,
+            'response_text': 'Thank you for your review ' * 5 if has_response else None,
+            'response_date': 'March 3, 2024' if has_response else None,
+            'response_language': 'en' if has_response else None,
+            'user_id': hash(user_url) % (10 ** 18),
+            'hotel_id': i // 1000
+        }
+        user_dict = {
+            'id': review_dict['user_id'],
+            'url': user_url,
+            'name': user_url.split('Profile/')[-1],
+            'name_shown': f'User {i}',
+            'contributions': str(rng.randint(1, 500)),
+            'helpful_votes': str(rng.randint(0, 100)) if rng.random() < 0.7 else None,
+            'location': 'Rome, Italy' if rng.random() < 0.6 else None
+        }
+        yield review_dict, user_dict
+
+
+
+# reference implementations, as they were before the optimizations
+
+def _legacy_insert_replace_row(connection, cursor, table, column_value_dict, commit=True):
+    """ Previous BaseIterator._insert_replace_row: quoted literals, pragma table_info for each None value """
+    columns = ', '.join(column_value_dict.keys())
+    for key, value in column_value_dict.items():
+        if value is None:
+            if cursor.execute(f'pragma table_info({table})').fetchall()[list(column_value_dict.keys()).index(key)][2] == 'INTEGER':
+                column_value_dict[key] = -1
+            else:
+                column_value_dict[key] = 'NA'
+    for key, value in column_value_dict.items():
+        if value == True:
+            column_value_dict[key] = 1
+        elif value == False:
+            column_value_dict[key] = 0
+    values = ', '.join(['"'+str(value).replace('"','""')+'"' for value in column_value_dict.values()])
+    cursor.execute(f'insert or replace into {table} ({columns}) values ({values});')
+    if commit:
+        connection.commit()
+    return
+
+def _legacy_scrape_hotel_page(driver):
+    """ Previous HotelIterator._scrape_hotel_page: one driver call for each element, many selectors queried twice """
+    hotel_dict = {}
+    amenities_dict, qualities_dict, additional_info_dict, keypoints_dict, distribution_dict, keywords_list = {}, {}, {}, {}, {}, []
+    price_range_min, price_range_max = None, None
+    hotel_dict['name'] = driver.find_element('class name', 'WMndO.f').text
+    hotel_dict['address'] = driver.find_element('class name', 'FhOgt.H3.f.u.fRLPH').text
+    hotel_dict['rating'] = driver.find_element('class name', 'kJyXc.P').text
+    hotel_dict['reviews'] = driver.find_elements('class name', 'biGQs._P.pZUbB.KxBGd')[1].text.split(' ')[0].replace(',','')
+    hotel_dict['category_rank'] = driver.find_elements('class name', 'biGQs._P.pZUbB.KxBGd')[2].text.replace('#', '').replace(',','')
+    hotel_dict['star_rating'] = driver.find_element('class name', 'JXZuC.d.H0').get_attribute('textContent').split(' ')[0] if driver.find_elements('class name', 'JXZuC.d.H0') != [] else None
+    for nearby_things in driver.find_elements('class name', 'CllfH'):
+        if 'Restaurants' in nearby_things.text:
+            hotel_dict['nearby_restaurants'] = nearby_things.text.split(' ')[0].replace(',','')
+        elif 'Attractions' in nearby_things.text:
+            hotel_dict['nearby_attractions'] = nearby_things.text.split(' ')[0].replace(',','')
+    hotel_dict['walkers_score'] = driver.find_element('class name', 'UQxjK.H-').text if driver.find_elements('class name', 'UQxjK.H-') != [] else None
+    hotel_dict['pictures'] = driver.find_element('class name', 'GuzzA').text.split('(')[-1].replace(')','').replace(',','') if driver.find_elements('class name', 'GuzzA') != [] else 0
+    hotel_dict['average_night_price'] = driver.find_element('class name', 'biGQs._P.pZUbB.fOtGX').text.split('$')[-1].split(' ')[0].replace(',','') if driver.find_elements('class name', 'biGQs._P.pZUbB.fOtGX') != [] else -1
+    hotel_dict['reviews_summary'] = driver.find_element('class name', 'biGQs._P.pZUbB.ncFvv.KxBGd').text if driver.find_elements('class name', 'biGQs._P.pZUbB.ncFvv.KxBGd') != [] else 'No reviews summary'
+    # hotel description
+    if driver.find_elements('class name', '_T.FKffI.TPznB.Ci.ajMTa.Ps.Z.BB.bmUTE') != []: # desc with "Read more" button
+        hotel_dict['description'] = driver.find_element('class name', '_T.FKffI.TPznB.Ci.ajMTa.Ps.Z.BB.bmUTE').find_element('class name', 'fIrGe._T').text
+    elif driver.find_elements('class name', '_T.FKffI.TPznB.Ci.ajMTa.Ps.Z.BB') != []: # desc without "Read more" button
+        hotel_dict['description'] = driver.find_element('class name', '_T.FKffI.TPznB.Ci.ajMTa.Ps.Z.BB').text
+    else:
+        hotel_dict['description'] = 'No description'
+    # amenities
+    amenities_titles_list = [] # get amenities titles
+    for amenity_title in driver.find_elements('class name', 'vqEpQ.S5.b.Pf.ME'):
+        amenity_title_text = amenity_title.text
+        amenities_titles_list.append(amenity_title_text)
+    amenities_box_list = [] # get amenities list, corresponding to each title
+    for amenities_box in driver.find_elements('class name', 'Jevoh.K'):
+        amenities_list = []
+        for amenity in amenities_box.find_elements('class name', 'gFttI.f.ME.Ci.H3._c'):
+            amenity_text = amenity.get_attribute('textContent')
+            amenities_list.append(amenity_text)
+        amenities_box_list.append(amenities_list)
+    for i in range(len(amenities_titles_list)): # make a dict coupling previous 2 lists
+        if i < len(amenities_box_list):
+            amenities_dict[amenities_titles_list[i]] = amenities_box_list[i] 
+    hotel_dict['property_amenities'] = ','.join(amenities_dict['Property amenities']) if 'Property amenities' in amenities_dict else 'NA'
+    hotel_dict['room_features'] = ','.join(amenities_dict['Room features']) if 'Room features' in amenities_dict else 'NA'
+    hotel_dict['room_types'] = ','.join(amenities_dict['Room types']) if 'Room types' in amenities_dict else 'NA'
+    # hotel qualities: Location, Cleanliness, Service, Value
+    for quality in driver.find_elements('class name', 'RZjkd'):
+        quality_name = quality.find_element('class name', 'o').text
+        quality_rating = quality.find_element('class name', 'biGQs._P.fiohW.biKBZ.osNWb').text
+        qualities_dict[quality_name] = quality_rating
+    hotel_dict['location_rating'] = qualities_dict['Location'] if 'Location' in qualities_dict else -1
+    hotel_dict['cleanliness_rating'] = qualities_dict['Cleanliness'] if 'Cleanliness' in qualities_dict else -1
+    hotel_dict['service_rating'] = qualities_dict['Service'] if 'Service' in qualities_dict else -1
+    hotel_dict['value_rating'] = qualities_dict['Value'] if 'Value' in qualities_dict else -1
+    # additional info 
+    additional_info_titles_list = [] # additional info titles
+    for additional_info_title in driver.find_elements('class name', 'mpDVe.Ci.b'):
+        additional_info_title_text = additional_info_title.text
+        additional_info_titles_list.append(additional_info_title_text)
+    additional_info_list = [] # additional info
+    for additional_info in driver.find_elements('class name', 'IhqAp.Ci'):
+        additional_info_text = additional_info.get_attribute('textContent')
+        additional_info_list.append(additional_info_text)
+    for i in range(len(additional_info_titles_list)): # make a dict coupling previous 2 lists
+        additional_info_dict[additional_info_titles_list[i]] = additional_info_list[i]
+    if 'PRICE RANGE' in additional_info_dict: # price range extremes
+        additional_info_dict['PRICE RANGE'] = additional_info_dict['PRICE RANGE'].replace(' (Based on Average Rates for a Standard Room) ','')
+        price_range_min = additional_info_dict['PRICE RANGE'].split(' - ')[0].replace('$','').replace(',','')
+        price_range_max = additional_info_dict['PRICE RANGE'].split(' - ')[1].replace('$','').replace(',','')
+        del additional_info_dict['PRICE RANGE']
+    hotel_dict['also_known_as'] = additional_info_dict['ALSO KNOWN AS'] if 'ALSO KNOWN AS' in additional_info_dict else 'NA'
+    hotel_dict['formerly_known_as'] = additional_info_dict['FORMERLY KNOWN AS'] if 'FORMERLY KNOWN AS' in additional_info_dict else 'NA'
+    hotel_dict['city_location'] = additional_info_dict['LOCATION'] if 'LOCATION' in additional_info_dict else 'NA'
+    hotel_dict['number_of_rooms'] = additional_info_dict['NUMBER OF ROOMS'] if 'NUMBER OF ROOMS' in additional_info_dict else -1
+    hotel_dict['price_range_min'] = price_range_min if price_range_min is not None else -1
+    hotel_dict['price_range_max'] = price_range_max if price_range_max is not None else -1
+    # hotel reviews keypoints
+    key_points = driver.find_elements('class name', 'zQDwR.f.Pe.PX.Pr.PJ.u._S.hJoAg')
+    if key_points != []:
+        for point in key_points:
+            point_name = point.find_element('class name', 'biGQs._P.pZUbB.qWPrE.hmDzD').text
+            point_grade = point.find_element('class name', 'biGQs._P.kdCdj.ncFvv.fOtGX').text
+            keypoints_dict[point_name] = point_grade
+    hotel_dict['reviews_keypoint_location'] = keypoints_dict['Location'] if 'Location' in keypoints_dict else 'NA'
+    hotel_dict['reviews_keypoint_atmosphere'] = keypoints_dict['Atmosphere'] if 'Atmosphere' in keypoints_dict else 'NA'
+    hotel_dict['reviews_keypoint_rooms'] = keypoints_dict['Rooms'] if 'Rooms' in keypoints_dict else 'NA'
+    hotel_dict['reviews_keypoint_value'] = keypoints_dict['Value'] if 'Value' in keypoints_dict else 'NA'
+    hotel_dict['reviews_keypoint_cleanliness'] = keypoints_dict['Cleanliness'] if 'Cleanliness' in keypoints_dict else 'NA'
+    hotel_dict['reviews_keypoint_service'] = keypoints_dict['Service'] if 'Service' in keypoints_dict else 'NA'
+    hotel_dict['reviews_keypoint_amenities'] = keypoints_dict['Amenities'] if 'Amenities' in keypoints_dict else 'NA'
+    # reviews keywords 
+    keywords = driver.find_elements('class name', 'OKHdJ.z.Pc.PQ.Pp.PD.W._S.Gn.Rd._M.qWPrE.biKBZ.PQFNM.wSSLS')
+    if keywords != []:
+        for keyword in keywords:
+            keywords_list.append(keyword.text)
+        keywords_list.remove('All reviews') # remove 'All reviews' from list
+    hotel_dict['reviews_keywords'] = ','.join([keyword for keyword in keywords_list]) if keywords_list != [] else 'NA'
+    # reviews distribution
+    reviews_amounts = driver.find_elements('class name', 'QErCz')
+    for i, review_amount in enumerate(reviews_amounts):
+        distribution_dict[5-i] = review_amount.text.replace(',','')
+    hotel_dict['reviews_5_excellent'] = distribution_dict[5]
+    hotel_dict['reviews_4_very_good'] = distribution_dict[4]
+    hotel_dict['reviews_3_average'] = distribution_dict[3]
+    hotel_dict['reviews_2_poor'] = distribution_dict[2]
+    hotel_dict['reviews_1_terrible'] = distribution_dict[1]
+    return hotel_dict
+
+
+
+# benchmarks
+
+def benchmark_db_writer(reviews_number=100000, page_size=10):
+    """ Rows per second writing reviews and users, committing once per review page, before and after DbWriter """
+    with tempfile.TemporaryDirectory() as folder:
+        connection = _get_benchmark_connection(folder, ['C_REVIEW.sql', 'D_USER.sql'])
+        cursor = connection.cursor()
+        start = time.perf_counter()
+        for i, (review_dict, user_dict) in enumerate(_get_synthetic_reviews(reviews_number)):
+            _legacy_insert_replace_row(connection, cursor, 'REVIEW', review_dict, commit=False)
+            _legacy_insert_replace_row(connection, cursor, 'USER', user_dict, commit=False)
+            if (i + 1) % page_size == 0:
+                connection.commit()
+        connection.commit()
+        legacy_seconds = time.perf_counter() - start
+        connection.close()
+    with tempfile.TemporaryDirectory() as folder:
+        connection = _get_benchmark_connection(folder, ['C_REVIEW.sql', 'D_USER.sql'])
+        db_writer = DbWriter(connection)
+        start = time.perf_counter()
+        for i, (review_dict, user_dict) in enumerate(_get_synthetic_reviews(reviews_number)):
+            db_writer.insert_replace_row('REVIEW', review_dict)
+            db_writer.insert_replace_row('USER', user_dict)
+            if (i + 1) % page_size == 0:
+                db_writer.flush()
+        db_writer.flush()
+        writer_seconds = time.perf_counter() - start
+        connection.close()
+    rows_number = reviews_number * 2 # a review row and a user row for each review
+    print(f'db_writer: {reviews_number} reviews ({rows_number} rows), commit every {page_size} reviews')
+    print(f'  legacy _insert_replace_row: {legacy_seconds:.2f} s, {rows_number / legacy_seconds:,.0f} rows/s')
+    print(f'  DbWriter:                   {writer_seconds:.2f} s, {rows_number / writer_seconds:,.0f} rows/s')
+    print(f'  speedup: {legacy_seconds / writer_seconds:.1f}x')
+    return
+
+
+
+def benchmark_hotel_extraction(pages_folder, repeat=3):
+    """ Parse latency per hotel page, on saved pages (.html files): one driver call per element versus one script call """
+    from selenium import webdriver # browser needed by this benchmark only
+    from page_scripts import HOTEL_PAGE_SCRIPT
+    from page_parsers import parse_hotel_document
+    page_path_list = sorted(Path(pages_folder).glob('*.html'))
+    chrome_options = webdriver.ChromeOptions()
+    chrome_options.add_argument('--headless=new')
+    driver = webdriver.Chrome(options=chrome_options)
+    legacy_seconds_list, script_seconds_list, different_pages = [], [], 0
+    try:
+        for page_path in page_path_list:
+            driver.get(page_path.resolve().as_uri())
+            for i in range(repeat):
+                start = time.perf_counter()
+                legacy_hotel_dict = _legacy_scrape_hotel_page(driver)
+                legacy_seconds_list.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                script_hotel_dict = parse_hotel_document(driver.execute_script(HOTEL_PAGE_SCRIPT))
+                script_seconds_list.append(time.perf_counter() - start)
+            if any(legacy_hotel_dict.get(key) != value for key, value in script_hotel_dict.items()):
+                different_pages += 1
+    finally:
+        driver.quit()
+    legacy_median, script_median = statistics.median(legacy_seconds_list), statistics.median(script_seconds_list)
+    print(f'hotel_extraction: {len(page_path_list)} saved pages, {repeat} runs each')
+    print(f'  legacy _scrape_hotel_page:  median {legacy_median * 1000:.0f} ms per page')
+    print(f'  HOTEL_PAGE_SCRIPT + parser: median {script_median * 1000:.0f} ms per page')
+    print(f'  speedup: {legacy_median / script_median:.1f}x, pages with different fields: {different_pages}')
+    return
+
+
+
+def _get_transferred_bytes(driver):
+    """ Bytes received since the last call, from the performance log of the driver (encoded sizes, as on the network) """
+    transferred_bytes = 0
+    for entry in driver.get_log('performance'):
+        message = json.loads(entry['message'])['message']
+        if message['method'] == 'Network.loadingFinished':
+            transferred_bytes += message['params']['encodedDataLength']
+    return transferred_bytes
+
+def benchmark_driver_profile(hotel_url, repeat=3):
+    """ Bytes transferred and page load time per page type, with the default browser profile and with the light profile """
+    from selenium import webdriver # browser needed by this benchmark only
+    from base_iterator import BaseIterator
+    from result_iterator import ResultIterator
+    from page_scripts import HOTEL_PAGE_SCRIPT
+    url_dict = {
+        'result': ResultIterator.url_template.format(0),
+        'hotel': hotel_url,
+        'review': hotel_url.replace('-Reviews-', '-Reviews-or10-') # second review page
+    }
+    print(f'driver_profile: {repeat} loads per page type')
+    for light_profile in [False, True]:
+        iterator = BaseIterator(db_connection=False, browser_driver=False, light_profile=light_profile)
+        chrome_options = iterator._get_chrome_options()
+        chrome_options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+        iterator.driver = webdriver.Chrome(options=chrome_options)
+        iterator._set_light_profile() if light_profile else None
+        try:
+            for page_type, url in url_dict.items():
+                seconds_list, bytes_list = [], []
+                for i in range(repeat):
+                    _get_transferred_bytes(iterator.driver) # discard previous entries
+                    start = time.perf_counter()
+                    iterator.driver.get(url) # returns on the load event
+                    seconds_list.append(time.perf_counter() - start)
+                    time.sleep(2) # late requests, as the price widget ones
+                    bytes_list.append(_get_transferred_bytes(iterator.driver))
+                price_found = iterator.driver.execute_script(HOTEL_PAGE_SCRIPT)['average_night_price'] is not None if page_type == 'hotel' else None
+                print(f'  {"light" if light_profile else "default"} profile, {page_type}: median {statistics.median(seconds_list):.2f} s load, {statistics.median(bytes_list) / 1024:,.0f} KiB transferred' + (f', price found: {price_found}' if price_found is not None else ''))
+        finally:
+            iterator.driver.quit()
+    return
+
+
+
+def _get_synthetic_locations(hotels_number, seed=0):
+    """ Generate HOTEL_MAPQUEST_LOCATION rows (hotel id, rank, latitude, longitude) around Rome, 5 ranks for each hotel """
+    rng = random.Random(seed)
+    for hotel_id in range(hotels_number):
+        for rank in range(5):
+            yield hotel_id * 10 + rank, hotel_id, rank, rng.uniform(41.75, 42.05), rng.uniform(12.30, 12.70)
+
+def benchmark_spatial_index(hotels_number=20000, queries_number=200, meters=1000, k=10):
+    """ Query latency for box, radius and nearest hotels: full scan of HOTEL_MAPQUEST_LOCATION versus the R-tree """
+    from spatial_index import SpatialIndex, haversine_distance, _get_bounding_box # db config needed by this benchmark only
+    rng = random.Random(1)
+    point_list = [(rng.uniform(41.80, 42.00), rng.uniform(12.35, 12.65)) for i in range(queries_number)]
+    with tempfile.TemporaryDirectory() as folder:
+        connection = _get_benchmark_connection(folder, ['B_HOTEL.sql', 'E_GEOCODE.sql'])
+        spatial_index = SpatialIndex(connection)
+        start = time.perf_counter()
+        connection.executemany('insert into HOTEL_MAPQUEST_LOCATION (ID, HOTEL_ID, RANK, LATITUDE, LONGITUDE) values (?, ?, ?, ?, ?);', _get_synthetic_locations(hotels_number))
+        connection.commit()
+        insert_seconds = time.perf_counter() - start
+        # full scan, as the analyses do now
+        def scan_box(box):
+            return connection.execute('select HOTEL_ID, LATITUDE, LONGITUDE from HOTEL_MAPQUEST_LOCATION where RANK=0 and LATITUDE between ? and ? and LONGITUDE between ? and ?;', box).fetchall()
+        def scan_within(latitude, longitude):
+            hotel_distance_list = [(hotel_id, haversine_distance(latitude, longitude, hotel_latitude, hotel_longitude)) for hotel_id, hotel_latitude, hotel_longitude in scan_box(_get_bounding_box(latitude, longitude, meters))]
+            return sorted([(hotel_id, distance) for hotel_id, distance in hotel_distance_list if distance <= meters], key=lambda hotel_distance: hotel_distance[1])
+        def scan_nearest(latitude, longitude):
+            location_list = connection.execute('select HOTEL_ID, LATITUDE, LONGITUDE from HOTEL_MAPQUEST_LOCATION where RANK=0;').fetchall()
+            return sorted([(hotel_id, haversine_distance(latitude, longitude, hotel_latitude, hotel_longitude)) for hotel_id, hotel_latitude, hotel_longitude in location_list], key=lambda hotel_distance: hotel_distance[1])[:k]
+        query_dict = {
+            'box': (lambda latitude, longitude: sorted(scan_box(_get_bounding_box(latitude, longitude, meters))), lambda latitude, longitude: sorted(spatial_index.get_hotels_in_box(*_get_bounding_box(latitude, longitude, meters)))),
+            'radius': (scan_within, lambda latitude, longitude: spatial_index.get_hotels_within(latitude, longitude, meters)),
+            'nearest': (scan_nearest, lambda latitude, longitude: spatial_index.get_nearest_hotels(latitude, longitude, k))
+        }
+        print(f'spatial_index: {hotels_number} hotels ({hotels_number * 5} locations, indexed on insert in {insert_seconds:.2f} s), {queries_number} queries, {meters} m radius, {k} nearest')
+        for query_name, (scan_query, index_query) in query_dict.items():
+            start = time.perf_counter()
+            scan_result_list = [scan_query(latitude, longitude) for latitude, longitude in point_list]
+            scan_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            index_result_list = [index_query(latitude, longitude) for latitude, longitude in point_list]
+            index_seconds = time.perf_counter() - start
+            different_queries = sum(scan_result != index_result for scan_result, index_result in zip(scan_result_list, index_result_list))
+            print(f'  {query_name}: full scan {scan_seconds / queries_number * 1000:.2f} ms, R-tree {index_seconds / queries_number * 1000:.2f} ms per query, speedup {scan_seconds / index_seconds:.1f}x, different results: {different_queries}')
+        connection.close()
+    return
+
+
+
+# hot queries of the stages, with the index each one must use
+query_plan_list = [
+    ('hotel jobs', 'select ID, URL from RESULT where reviews>0 and hotel_scraped_flag=0;', 'RESULT_HOTEL_PENDING_IDX'),
+    ('review jobs', 'select ID, URL from RESULT where hotel_scraped_flag=1 and reviews_scraped_flag=0 and hotel_page_missing_flag=0;', 'RESULT_REVIEWS_PENDING_IDX'),
+    ('hotels to geocode', 'select ID from RESULT where HOTEL_GEOCODED_FLAG=0 and HOTEL_SCRAPED_FLAG=1 order by ID;', 'RESULT_GEOCODE_PENDING_IDX'),
+    ('scraped reviews of a hotel', 'select REVIEWS from HOTEL_REVIEW_STATS where HOTEL_ID=1;', 'sqlite_autoindex_HOTEL_REVIEW_STATS_1'),
+    ('reviews of a hotel', 'select ID from REVIEW where HOTEL_ID=1;', 'REVIEW_HOTEL_ID_IDX'),
+    ('reviews of a user', 'select ID from REVIEW where USER_ID=1;', 'REVIEW_USER_ID_IDX')
+]
+
+def benchmark_query_plans():
+    """ Check with EXPLAIN QUERY PLAN that the hot queries use their index, after the migration. Full scans are reported """
+    from migration import migrate # db config needed by this benchmark only
+    with tempfile.TemporaryDirectory() as folder:
+        connection = _get_benchmark_connection(folder, ['A_RESULT.sql', 'C_REVIEW.sql'])
+        migrate(connection)
+        print(f'query_plans: {len(query_plan_list)} queries')
+        missing_indexes = 0
+        for query_name, query, index_name in query_plan_list:
+            plan = '; '.join(row[3] for row in connection.execute(f'explain query plan {query}'))
+            index_used_flag = f'INDEX {index_name}' in plan
+            missing_indexes += not index_used_flag
+            print(f'  {"ok  " if index_used_flag else "FAIL"} {query_name}: {plan}')
+        print(f'  queries not using their index: {missing_indexes}')
+        connection.close()
+    return
+
+
+
+benchmark_dict = {
+    'db_writer': lambda args: benchmark_db_writer(),
+    'hotel_extraction': lambda args: benchmark_hotel_extraction(args.pages_folder),
+    'driver_profile': lambda args: benchmark_driver_profile(args.hotel_url),
+    'spatial_index': lambda args: benchmark_spatial_index(),
+    'query_plans': lambda args: benchmark_query_plans()
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run benchmarks')
+    parser.add_argument('benchmark', choices=list(benchmark_dict.keys()) + ['all'])
+    parser.add_argument('--pages-folder', help='folder of saved hotel pages (.html), for page extraction benchmarks')
+    parser.add_argument('--hotel-url', help='url of a hotel page, for the driver profile benchmark')
+    args = parser.parse_args()
+    for name, benchmark in benchmark_dict.items():
+        if args.benchmark in (name, 'all'):
+            benchmark(args)
@@ -0,0 +1,69 @@
+import logging # settings inherited from the caller
+import queue
+import sqlite3
+import threading
+from pathlib import Path
+from db_writer import GroupCommitWriter, QueueDbWriter
+from _config import DB_BUSY_TIMEOUT, DB_SYNCHRONOUS, DB_CACHE_SIZE_MB, DB_MMAP_SIZE_MB, DB_MAX_GROUP
+
+
+# Connections to the db: scraping, geocoding and analysis run on the same hotel.db at the same time.
+# The db is in WAL mode: readers don't block the writer and the writer doesn't block readers, only writers wait on each other,
+# through the busy handler. In a process, rows are written by a single writer thread, committing the flushes of all threads together
+
+
+def get_connection(db_path, read_only=False, **kwargs):
+    """
+    Connection with WAL mode, tuned pragmas and a busy handler (waits DB_BUSY_TIMEOUT seconds on a locked db).
+    Read only connections can't write, for analyses. kwargs are passed to sqlite3.connect, like isolation_level
+    """
+    if read_only:
+        connection = sqlite3.connect(Path(db_path).resolve().as_uri() + '?mode=ro', uri=True, timeout=DB_BUSY_TIMEOUT, **kwargs)
+    else:
+        connection = sqlite3.connect(db_path, timeout=DB_BUSY_TIMEOUT, **kwargs)
+        connection.execute('pragma journal_mode=wal;') # kept in the db file, for the connections of the other processes too
+    connection.execute(f'pragma synchronous={DB_SYNCHRONOUS};')
+    connection.execute(f'pragma cache_size=-{DB_CACHE_SIZE_MB * 1024};') # negative, in KiB
+    connection.execute(f'pragma mmap_size={DB_MMAP_SIZE_MB * 1024 * 1024};')
+    return connection
+
+
+class WriterThread:
+    """ Single writer thread of a process, with its own connection. Threads write through their own QueueDbWriter, from get_db_writer """
+
+    def __init__(self, db_path, max_group=DB_MAX_GROUP):
+        self.db_path = db_path
+        self.max_group = max_group
+        self.row_queue = queue.Queue()
+        self.ack_queue_list = []
+        self.thread = None
+        return
+
+    def _run(self):
+        connection = get_connection(self.db_path)
+        try:
+            GroupCommitWriter(connection, self.row_queue, self.ack_queue_list, max_group=self.max_group).run()
+        except Exception as e:
+            logging.error('Error in writer thread, stopping it')
+            logging.exception('An error occurred')
+        finally:
+            connection.close()
+        return
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='db_writer', daemon=True)
+        self.thread.start()
+        logging.info(f'Started writer thread: {self.db_path}')
+        return
+
+    def get_db_writer(self):
+        """ Writer for a thread of the process. Its flushes are committed by the writer thread """
+        self.ack_queue_list.append(queue.Queue())
+        return QueueDbWriter(len(self.ack_queue_list) - 1, self.row_queue, self.ack_queue_list[-1])
+
+    def stop(self):
+        """ Write what's queued, then stop the thread """
+        self.row_queue.put(None)
+        self.thread.join()
+        logging.info('Stopped writer thread')
+        return
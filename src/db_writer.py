@@ -0,0 +1,420 @@
+import logging # settings inherited from the caller
+import hashlib
+import queue
+import time
+from collections import OrderedDict
+from field_schema import NULL_VALUE_DICT, get_field_type
+
+
+class DbWriter:
+    """
+    Buffered writer for the db. Column types are read once per table, for the tables outside the field schema. Values are coerced in python
+    and buffered rows are written with executemany and bound parameters, so sqlite reuses the prepared statement.
+    Tables with a FINGERPRINT column are upserted only if the row changed: a row equal to the one in the db costs no write.
+    Fingerprints of the rows of cached_table_list are also kept in memory, so the rows written again and again (users, once per review) are not even sent to sqlite.
+    The cache only knows the writes of this writer: if another writer changes a cached row, a write equal to the cached fingerprint
+    would be skipped and the other change kept. So cached fingerprints are trusted for fingerprint_cache_seconds after their commit,
+    then the row is sent to sqlite again, that compares it to the fingerprint in the db
+    """
+    numeric_type_list = ['INT', 'REAL', 'FLOA', 'DOUB', 'NUM', 'DEC'] # sqlite affinity rules, numeric declared types
+    cached_table_list = ['USER']
+
+    def __init__(self, connection, batch_size=1000, fingerprint_cache_size=100000, fingerprint_cache_seconds=600):
+        self.connection = connection
+        self.cursor = connection.cursor()
+        self.batch_size = batch_size
+        self.table_columns_dict = {} # table -> {column: declared type}, loaded once per table
+        self.pending_list = [] # [table, query, params_list], in order of arrival
+        self.pending_rows = 0
+        self.fingerprint_cache = OrderedDict() # (table, key value) -> (fingerprint of the committed row, commit time), least recently written first
+        self.fingerprint_cache_size = fingerprint_cache_size
+        self.fingerprint_cache_seconds = fingerprint_cache_seconds
+        self.pending_fingerprint_list = [] # cached once committed
+        self.change_dict = {} # table -> [rows written, rows changed], committed only
+        self.pending_change_dict = {}
+        return
+
+
+    # schema methods
+
+    def _get_table_columns(self, table):
+        """ Get columns and declared types of a table. Pragma is run only the first time """
+        if table not in self.table_columns_dict:
+            self.table_columns_dict[table] = {row[1].lower(): row[2].upper() for row in self.cursor.execute(f'pragma table_info({table})').fetchall()}
+            logging.info(f'Loaded columns of table {table}')
+        return self.table_columns_dict[table]
+
+    @staticmethod
+    def _get_null_value(column_type):
+        """ Value replacing None in a column outside the field schema, by the same policy: -1 for numeric columns, 'NA' for text columns """
+        if any(numeric_type in column_type for numeric_type in DbWriter.numeric_type_list):
+            return NULL_VALUE_DICT[int]
+        return NULL_VALUE_DICT[str]
+
+    @staticmethod
+    def _get_fingerprint(column_list, values):
+        """ Fingerprint of the content of a row, as a signed 64 bit int. Column order doesn't matter """
+        content = repr(sorted(zip([column.lower() for column in column_list], values), key=lambda column_value: column_value[0]))
+        return int.from_bytes(hashlib.blake2b(content.encode('utf-8'), digest_size=8).digest(), 'big', signed=True)
+
+    def _coerce_row(self, table, column_value_dict):
+        """ Return the tuple of values to bind. None replaced by the null value of the field type in the schema, or of the column type, booleans by 1 and 0 """
+        values = []
+        for key, value in column_value_dict.items():
+            if value is None:
+                field_type = get_field_type(table, key)
+                value = NULL_VALUE_DICT[field_type] if field_type is not None else self._get_null_value(self._get_table_columns(table).get(key.lower(), ''))
+            elif isinstance(value, bool):
+                value = int(value)
+            values.append(value)
+        return tuple(values)
+
+
+    # buffer methods
+
+    def _append(self, table, query, params):
+        """
+        Append a statement to the buffer. Consecutive statements on the same query are grouped in one executemany,
+        unless another statement on the same table came in between (order on a table is preserved)
+        """
+        for pending in reversed(self.pending_list):
+            if pending[1] == query:
+                pending[2].append(params)
+                break
+            if pending[0] == table:
+                self.pending_list.append([table, query, [params]])
+                break
+        else:
+            self.pending_list.append([table, query, [params]])
+        self.pending_rows += 1
+        if self.pending_rows >= self.batch_size: # bound buffer memory, rows are written but not committed
+            self._execute_pending()
+        return
+
+    def _execute_pending(self):
+        """ Execute buffered statements, without committing. Rows changed by inserts and upserts are counted """
+        for table, query, params_list in self.pending_list:
+            self.cursor.executemany(query, params_list)
+            if query.startswith('insert'):
+                self._count_rows(table, len(params_list), self.cursor.rowcount)
+        logging.info(f'Executed {self.pending_rows} buffered rows')
+        self.pending_list = []
+        self.pending_rows = 0
+        return
+
+    def _count_rows(self, table, rows, changed_rows):
+        change = self.pending_change_dict.setdefault(table, [0, 0])
+        change[0] += rows
+        change[1] += changed_rows
+        return
+
+    def _clear_pending(self):
+        self.pending_list = []
+        self.pending_rows = 0
+        self.pending_fingerprint_list = []
+        self.pending_change_dict = {}
+        return
+
+    def _commit_pending(self):
+        """ After a commit: count the committed rows, and cache the fingerprints of the committed rows """
+        for table, (rows, changed_rows) in self.pending_change_dict.items():
+            change = self.change_dict.setdefault(table, [0, 0])
+            change[0] += rows
+            change[1] += changed_rows
+        commit_time = time.monotonic()
+        for cache_key, fingerprint in self.pending_fingerprint_list:
+            self.fingerprint_cache[cache_key] = (fingerprint, commit_time)
+            self.fingerprint_cache.move_to_end(cache_key)
+            if len(self.fingerprint_cache) > self.fingerprint_cache_size:
+                self.fingerprint_cache.popitem(last=False)
+        self.pending_fingerprint_list = []
+        self.pending_change_dict = {}
+        return
+
+    def _append_row(self, table, column_value_dict, key, query):
+        """
+        Buffer the write of a row with query, an insert or replace or an upsert. On tables with a fingerprint,
+        the row is upserted instead, only if changed: rows of cached tables already written with the same content are skipped
+        """
+        values = self._coerce_row(table, column_value_dict)
+        if 'fingerprint' not in self._get_table_columns(table):
+            self._append(table, query, values)
+            return
+        column_list = list(column_value_dict.keys())
+        fingerprint = self._get_fingerprint(column_list, values)
+        if table.upper() in self.cached_table_list:
+            cache_key = (table.upper(), column_value_dict.get(key))
+            cached_fingerprint, commit_time = self.fingerprint_cache.get(cache_key, (None, None))
+            if cached_fingerprint == fingerprint and time.monotonic() - commit_time < self.fingerprint_cache_seconds:
+                self.fingerprint_cache.move_to_end(cache_key)
+                self._count_rows(table, 1, 0)
+                return
+            self.pending_fingerprint_list.append((cache_key, fingerprint))
+        self._append(table, self._get_fingerprint_upsert_query(table, column_list, key), values + (fingerprint,))
+        return
+
+    def _get_fingerprint_upsert_query(self, table, column_list, key):
+        """ Upsert of the given columns and the fingerprint, updating the row only if its fingerprint changed. Other columns are kept """
+        columns = ', '.join(column_list + ['fingerprint'])
+        placeholders = ', '.join(['?'] * (len(column_list) + 1))
+        update_list = [f'{column}=excluded.{column}' for column in column_list + ['fingerprint'] if column.lower() != key.lower()]
+        if 'insert_update_timestamp' in self._get_table_columns(table):
+            update_list.append('insert_update_timestamp=current_timestamp')
+        return f'insert into {table} ({columns}) values ({placeholders}) on conflict ({key}) do update set {", ".join(update_list)} where {table}.fingerprint is not excluded.fingerprint;'
+
+    def get_change_summary(self):
+        """ Committed rows written and changed of each table, like 'USER 3/120' (rows not changed cost no write) """
+        return ', '.join([f'{table} {changed_rows}/{rows}' for table, (rows, changed_rows) in self.change_dict.items()]) or 'no rows'
+
+
+    # public methods
+
+    def insert_replace_row(self, table, column_value_dict):
+        """ Buffer an insert or replace of a row. On tables with a fingerprint, an upsert of the row if changed """
+        columns = ', '.join(column_value_dict.keys())
+        placeholders = ', '.join(['?'] * len(column_value_dict))
+        query = f'insert or replace into {table} ({columns}) values ({placeholders});'
+        self._append_row(table, column_value_dict, 'id', query)
+        return
+
+    def upsert_row(self, table, column_value_dict, key='id'):
+        """ Buffer an insert of a row. If the key exists, only the given columns are updated: the others (flags, coordinates) are kept """
+        columns = ', '.join(column_value_dict.keys())
+        placeholders = ', '.join(['?'] * len(column_value_dict))
+        updates = ', '.join([f'{column}=excluded.{column}' for column in column_value_dict.keys() if column != key])
+        query = f'insert into {table} ({columns}) values ({placeholders}) on conflict ({key}) do update set {updates};'
+        self._append_row(table, column_value_dict, key, query)
+        return
+
+    def update_flag(self, table, column, value, condition='1=0'): # default condition to avoid updating all rows
+        """ Buffer an update of a flag """
+        value = int(value) if isinstance(value, bool) else value
+        self._append(table, f'update {table} set {column}=? where {condition};', (value,))
+        return
+
+    def delete_rows(self, table, condition='1=0'): # default condition to avoid deleting all rows
+        """ Buffer a delete """
+        self._append(table, f'delete from {table} where {condition};', ())
+        return
+
+    def flush(self, commit=True):
+        """ Write all buffered statements and commit them in a single transaction """
+        try:
+            self._execute_pending()
+            if commit:
+                self.connection.commit()
+                self._commit_pending()
+                logging.info('Committed buffered rows')
+        except Exception as e:
+            logging.error('Error flushing buffered rows, rolling back')
+            self.rollback()
+            raise e
+        return
+
+    def rollback(self):
+        """ Discard the buffered statements, and the ones executed but not committed (buffer full), like after an error """
+        self.connection.rollback()
+        self._clear_pending()
+        return
+
+
+
+class QueueDbWriter:
+    """
+    DbWriter stand-in for pool workers and threads. Statements are kept locally and sent to the single db writer (process or thread)
+    on flush, where they are committed in a single transaction. Flush waits for the writer to acknowledge the commit
+    """
+
+    def __init__(self, worker_id, row_queue, ack_queue):
+        self.worker_id = worker_id
+        self.row_queue = row_queue
+        self.ack_queue = ack_queue
+        self.op_list = []
+        return
+
+    def insert_replace_row(self, table, column_value_dict):
+        """ Buffer an insert or replace of a row. Dict is copied, callers reuse it """
+        self.op_list.append(('insert_replace_row', table, dict(column_value_dict)))
+        return
+
+    def upsert_row(self, table, column_value_dict, key='id'):
+        """ Buffer an upsert of a row. Dict is copied, callers reuse it """
+        self.op_list.append(('upsert_row', table, dict(column_value_dict), key))
+        return
+
+    def update_flag(self, table, column, value, condition='1=0'): # default condition to avoid updating all rows
+        """ Buffer an update of a flag """
+        self.op_list.append(('update_flag', table, column, value, condition))
+        return
+
+    def delete_rows(self, table, condition='1=0'): # default condition to avoid deleting all rows
+        """ Buffer a delete """
+        self.op_list.append(('delete_rows', table, condition))
+        return
+
+    def flush(self, commit=True):
+        """ Send buffered statements to the writer and wait for the commit. Without commit, statements stay buffered """
+        if not commit or self.op_list == []:
+            return
+        self.row_queue.put((self.worker_id, self.op_list))
+        self.op_list = []
+        ack = self.ack_queue.get()
+        if ack is not True:
+            raise RuntimeError(f'Error in db writer: {ack}')
+        logging.info('Committed buffered rows through db writer')
+        return
+
+
+
+class WriteBehindDbWriter:
+    """
+    Write-behind buffer in front of a writer (DbWriter or QueueDbWriter), for the iterators. Flushes are held in memory,
+    and passed to the writer when the buffer holds max_rows statements or its first statement is older than max_seconds:
+    many pages and hotels are committed in one transaction. Statements keep their order, and a hotel's rows and flag are in the same
+    transaction. Actions that need the rows committed (completing a job, geocoding a hotel) are passed to after_commit, and run
+    once they are. If the process stops before, nothing is marked done: leased jobs are reclaimed and scraped again.
+    Keys of the rows not committed yet are kept, for the lookups of known rows (get_pending_key_set)
+    """
+
+    def __init__(self, db_writer, max_rows=1000, max_seconds=2):
+        self.db_writer = db_writer
+        self.max_rows = max_rows
+        self.max_seconds = max_seconds # durability window: rows written but not committed for at most this time
+        self.pending_rows = 0
+        self.first_pending_time = None
+        self.callback_list = []
+        self.pending_key_dict = {} # table -> keys of the rows not committed yet
+        return
+
+    def _add_pending(self, table=None, key_value=None):
+        self.pending_rows += 1
+        self.first_pending_time = time.monotonic() if self.first_pending_time is None else self.first_pending_time
+        if table is not None:
+            self.pending_key_dict.setdefault(table.upper(), set()).add(key_value)
+        return
+
+    def get_pending_key_set(self, table):
+        """ Keys of the rows of a table written but not committed yet """
+        return self.pending_key_dict.get(table.upper(), set())
+
+    def insert_replace_row(self, table, column_value_dict):
+        self.db_writer.insert_replace_row(table, column_value_dict)
+        self._add_pending(table, column_value_dict.get('id'))
+        return
+
+    def upsert_row(self, table, column_value_dict, key='id'):
+        self.db_writer.upsert_row(table, column_value_dict, key)
+        self._add_pending(table, column_value_dict.get(key))
+        return
+
+    def update_flag(self, table, column, value, condition='1=0'): # default condition to avoid updating all rows
+        self.db_writer.update_flag(table, column, value, condition)
+        self._add_pending()
+        return
+
+    def delete_rows(self, table, condition='1=0'): # default condition to avoid deleting all rows
+        self.db_writer.delete_rows(table, condition)
+        self._add_pending()
+        return
+
+    def after_commit(self, callback):
+        """ Run callback once the statements buffered so far are committed """
+        self.callback_list.append(callback)
+        self.first_pending_time = time.monotonic() if self.first_pending_time is None else self.first_pending_time
+        return
+
+    def flush(self, commit=True, force=False):
+        """
+        End of a unit of work (a page, a hotel). Statements are committed if the buffer is full or old enough, or if force.
+        Then the after commit actions are run. If the commit fails, they are dropped
+        """
+        if not commit or self.first_pending_time is None:
+            return
+        if not force and self.pending_rows < self.max_rows and time.monotonic() - self.first_pending_time < self.max_seconds:
+            return
+        callback_list = self.callback_list
+        self.callback_list, self.pending_rows, self.first_pending_time, self.pending_key_dict = [], 0, None, {} # callbacks can buffer and flush again
+        try:
+            self.db_writer.flush()
+        except Exception as e:
+            logging.error(f'Error committing buffered rows, dropping {len(callback_list)} after commit actions')
+            raise e
+        for callback in callback_list:
+            try:
+                callback()
+            except Exception as e:
+                logging.error('Error in after commit action')
+                logging.exception('An error occurred')
+        if force and self.first_pending_time is not None: # statements buffered by the actions
+            self.flush(force=True)
+        return
+
+
+
+class GroupCommitWriter:
+    """
+    Single writer of a db, for the QueueDbWriter clients of a pool (processes) or of a process (threads).
+    The flushes already queued when the writer is free are written in one transaction, up to max_group: one commit for many flushes.
+    If the group fails, its flushes are written again one at a time, so only the failing one is refused
+    """
+
+    def __init__(self, connection, row_queue, ack_queue_list, max_group=64):
+        self.connection = connection
+        self.db_writer = DbWriter(connection)
+        self.row_queue = row_queue
+        self.ack_queue_list = ack_queue_list
+        self.max_group = max_group
+        return
+
+    def _write(self, message_list):
+        """ Write the statements of the messages, and commit them together. On error nothing is left in the writer, for the next group """
+        try:
+            for worker_id, op_list in message_list:
+                for op in op_list:
+                    getattr(self.db_writer, op[0])(*op[1:]) # a full buffer executes its statements here
+        except Exception as e:
+            self.db_writer.rollback()
+            raise e
+        self.db_writer.flush()
+        return
+
+    def _write_group(self, message_list):
+        """ Write a group of messages and acknowledge each of them: True if committed, the error otherwise """
+        try:
+            self._write(message_list)
+            for worker_id, op_list in message_list:
+                self.ack_queue_list[worker_id].put(True)
+            logging.info(f'Committed group of {len(message_list)} flushes')
+            return
+        except Exception as e:
+            if len(message_list) == 1:
+                logging.error(f'Error writing rows of worker {message_list[0][0]}')
+                logging.exception('An error occurred')
+                self.ack_queue_list[message_list[0][0]].put(repr(e))
+                return
+            logging.error(f'Error writing group of {len(message_list)} flushes, writing them one at a time')
+        for message in message_list:
+            self._write_group([message])
+        return
+
+    def run(self, stop_messages=1):
+        """ Write groups until stop_messages None messages are received """
+        stopped = 0
+        while stopped < stop_messages:
+            message_list = []
+            message = self.row_queue.get()
+            while True:
+                if message is None:
+                    stopped += 1
+                else:
+                    message_list.append(message)
+                if len(message_list) >= self.max_group or stopped >= stop_messages:
+                    break
+                try:
+                    message = self.row_queue.get_nowait()
+                except queue.Empty:
+                    break
+            if message_list != []:
+                self._write_group(message_list)
+        logging.info(f'Stopped group commit writer. Changed rows: {self.db_writer.get_change_summary()}')
+        return
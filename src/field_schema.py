@@ -0,0 +1,74 @@
+import logging # settings inherited from the caller
+
+
+# Field schema of the scraped tables: the python type of each field. The parsers convert their rows with it once, at scrape time:
+# numbers come from the pages as strings ('1,234', '4.5') and are stored as numbers, so range scans, group bys and indexes compare numbers.
+# Missing values follow a single policy, NULL_VALUE_DICT: -1 for numbers and flags, 'NA' for text.
+# Fields filled by a later stage (coordinates, languages) and flags are not scraped, and stay out of the schema
+
+
+NULL_VALUE_DICT = {int: -1, float: -1, bool: -1, str: 'NA'}
+
+FIELD_SCHEMA_DICT = {
+    'RESULT': {
+        'id': int, 'url': str, 'rating': float, 'reviews': int, 'page': int, 'rank': int
+    },
+    'HOTEL': {
+        'id': int, 'url': str, 'name': str, 'address': str, 'description': str, 'rating': float, 'reviews': int,
+        'category_rank': str, 'star_rating': float, 'nearby_restaurants': int, 'nearby_attractions': int, 'walkers_score': int,
+        'pictures': int, 'average_night_price': int, 'price_range_min': int, 'price_range_max': int,
+        'property_amenities': str, 'room_features': str, 'room_types': str,
+        'location_rating': float, 'cleanliness_rating': float, 'service_rating': float, 'value_rating': float,
+        'also_known_as': str, 'formerly_known_as': str, 'city_location': str, 'number_of_rooms': int, 'reviews_summary': str,
+        'reviews_keypoint_location': str, 'reviews_keypoint_atmosphere': str, 'reviews_keypoint_rooms': str, 'reviews_keypoint_value': str,
+        'reviews_keypoint_cleanliness': str, 'reviews_keypoint_service': str, 'reviews_keypoint_amenities': str,
+        'reviews_5_excellent': int, 'reviews_4_very_good': int, 'reviews_3_average': int, 'reviews_2_poor': int, 'reviews_1_terrible': int,
+        'reviews_keywords': str
+    },
+    'REVIEW': {
+        'id': int, 'url': str, 'title': str, 'text': str, 'rating': int,
+        'month_of_review': int, 'year_of_review': int, 'month_of_stay': int, 'year_of_stay': int,
+        'likes': int, 'pics_flag': bool, 'response_from': str, 'response_text': str, 'response_date': str,
+        'user_id': int, 'hotel_id': int
+    },
+    'USER': {
+        'id': int, 'url': str, 'name': str, 'name_shown': str, 'contributions': int, 'helpful_votes': int, 'location': str
+    },
+}
+
+
+def get_field_type(table, field):
+    """ Type of a field of the schema, None if not in the schema """
+    return FIELD_SCHEMA_DICT.get(table.upper(), {}).get(field.lower())
+
+def convert_value(value, field_type):
+    """
+    Value as the type of its field. None, and values that are not a number in a numeric field, become the null value of the type.
+    Numbers are read from strings with thousands separators, integers also from decimals ('5.0')
+    """
+    if value is None or value in (NULL_VALUE_DICT[str], NULL_VALUE_DICT[int]): # null values of any type
+        return NULL_VALUE_DICT[field_type]
+    try:
+        if field_type is str:
+            return str(value)
+        if isinstance(value, str):
+            value = value.strip().replace(',', '')
+        if field_type is bool:
+            return bool(int(value))
+        if field_type is int:
+            try:
+                return int(value)
+            except ValueError:
+                return int(float(value))
+        return float(value)
+    except (TypeError, ValueError):
+        logging.error(f'Not a {field_type.__name__}: {value!r}, stored as null')
+        return NULL_VALUE_DICT[field_type]
+
+def convert_row(table, column_value_dict):
+    """ Row with the values of the fields in the schema converted to their type. Other fields are kept as they are """
+    converted_dict = {}
+    for key, value in column_value_dict.items():
+        field_type = get_field_type(table, key)
+        converted_dict[key] = convert_value(value, field_type) if field_type is not None else value
+    return converted_dict
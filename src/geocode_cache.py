@@ -0,0 +1,54 @@
+import logging # settings inherited from the caller
+import re
+from _config import DDL_FOLDER_PATH, GEOCODER_EXCEPTION_DICT
+
+
+def normalize_address(address):
+    """ Cache key of an address: lowercase, commas and repeated spaces collapsed """
+    return re.sub(r'[\s,]+', ' ', address.lower()).strip()
+
+
+class GeocodeCache:
+    """
+    Coordinates of the addresses already geocoded, on the GEOCODE_CACHE table, keyed by normalized address.
+    Shared by the geocoding stage and HotelGeocoder: an address is sent to a geocoder once.
+    Addresses the geocoders can't resolve are mapped to the address to query instead (GEOCODER_EXCEPTION_DICT).
+    Writes are left to the caller's transaction
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.connection.executescript((DDL_FOLDER_PATH / 'J_GEOCODE_CACHE.sql').read_text())
+        self.connection.create_function('NORMALIZE_ADDRESS', 1, normalize_address, deterministic=True) # to join addresses to the cache in sql
+        return
+
+    def seed_exceptions(self):
+        """ Map the scraped addresses of the hotels in GEOCODER_EXCEPTION_DICT to their address to query. Changed overrides reset the coordinates """
+        placeholders = ', '.join(['?'] * len(GEOCODER_EXCEPTION_DICT))
+        hotel_address_list = self.connection.execute(f'select ID, ADDRESS from HOTEL where ID in ({placeholders}) and ADDRESS is not null;', list(GEOCODER_EXCEPTION_DICT.keys())).fetchall()
+        self.connection.executemany("""
+            insert into GEOCODE_CACHE (ADDRESS_KEY, QUERY_ADDRESS) values (?, ?)
+            on conflict (ADDRESS_KEY) do update set
+                QUERY_ADDRESS=excluded.QUERY_ADDRESS, LATITUDE=null, LONGITUDE=null, ALTITUDE=null, SOURCE=null, INSERT_UPDATE_TIMESTAMP=current_timestamp
+            where QUERY_ADDRESS is not excluded.QUERY_ADDRESS;
+        """, [(normalize_address(address), GEOCODER_EXCEPTION_DICT[hotel_id]) for hotel_id, address in hotel_address_list])
+        logging.info(f'Seeded geocode cache with {len(hotel_address_list)} exception addresses')
+        return
+
+    def get_query_address(self, address):
+        """ Address to send to the geocoder: the exception one if any, otherwise the address itself """
+        row = self.connection.execute('select QUERY_ADDRESS from GEOCODE_CACHE where ADDRESS_KEY=?;', (normalize_address(address),)).fetchone()
+        return row[0] if row is not None and row[0] is not None else address
+
+    def get(self, address):
+        """ Cached (latitude, longitude, altitude) of an address, None if not geocoded yet """
+        return self.connection.execute('select LATITUDE, LONGITUDE, ALTITUDE from GEOCODE_CACHE where ADDRESS_KEY=? and LATITUDE is not null;', (normalize_address(address),)).fetchone()
+
+    def put(self, address, latitude, longitude, altitude, source):
+        """ Cache the coordinates of an address, keeping its address to query """
+        self.connection.execute("""
+            insert into GEOCODE_CACHE (ADDRESS_KEY, QUERY_ADDRESS, LATITUDE, LONGITUDE, ALTITUDE, SOURCE) values (?, ?, ?, ?, ?, ?)
+            on conflict (ADDRESS_KEY) do update set
+                LATITUDE=excluded.LATITUDE, LONGITUDE=excluded.LONGITUDE, ALTITUDE=excluded.ALTITUDE, SOURCE=excluded.SOURCE, INSERT_UPDATE_TIMESTAMP=current_timestamp;
+        """, (normalize_address(address), address, latitude, longitude, altitude, source))
+        return
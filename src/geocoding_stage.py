@@ -0,0 +1,129 @@
+import logging
+import queue
+import threading
+import time
+from geopy.geocoders import Nominatim
+from run_utils import set_logging
+from db_connection import get_connection
+from geocode_cache import GeocodeCache
+from spatial_index import SpatialIndex
+from _config import DB_FOLDER_PATH, GEOCODER_MIN_INTERVAL
+
+
+# Geocoding stage: hotels are written without coordinates, and geocoded here, off the scrape path.
+# HotelIterator submits each hotel after writing it; a thread resolves the addresses (from the geocode cache,
+# or from the geocoder, one call at a time) and fills HOTEL latitude, longitude and altitude in batches.
+# The geocoder is any object with a geopy like geocode(address) method, Nominatim by default
+
+
+class GeocodingStage:
+    """ Background thread filling the coordinates of the submitted hotels. Hotels not geocoded because of errors are left null """
+
+    def __init__(self, db_path, geocoder=None, min_interval=GEOCODER_MIN_INTERVAL, batch_size=50):
+        self.db_path = db_path
+        self.geocoder = geocoder if geocoder is not None else Nominatim(user_agent='hotel_locator_geocoder', timeout=30)
+        self.min_interval = min_interval
+        self.batch_size = batch_size
+        self.source = type(self.geocoder).__name__.lower()
+        self.hotel_queue = queue.Queue()
+        self.thread = None
+        self.last_call_time = 0
+        self.counter_dict = {'cached': 0, 'geocoded': 0, 'not_found': 0, 'failed': 0}
+        return
+
+    def _geocode_address(self, address):
+        """ Call the geocoder, no more than once every min_interval seconds. Return (latitude, longitude, altitude), -1 if not found """
+        time.sleep(max(0, self.last_call_time + self.min_interval - time.time()))
+        self.last_call_time = time.time()
+        location = self.geocoder.geocode(address)
+        if location is None:
+            return -1, -1, -1
+        return location.latitude, location.longitude, location.altitude
+
+    def _geocode_batch(self, connection, geocode_cache, hotel_list):
+        """ Resolve the coordinates of a batch of hotels, then write them and the cache in one transaction """
+        coordinates_list = []
+        for hotel_id, address in hotel_list:
+            try:
+                coordinates = geocode_cache.get(address)
+                if coordinates is not None:
+                    self.counter_dict['cached'] += 1
+                else:
+                    coordinates = self._geocode_address(geocode_cache.get_query_address(address))
+                    geocode_cache.put(address, *coordinates, self.source)
+                    self.counter_dict['geocoded' if coordinates[0] != -1 else 'not_found'] += 1
+                coordinates_list.append((*coordinates, hotel_id))
+            except Exception as e:
+                self.counter_dict['failed'] += 1
+                logging.error(f'Error geocoding hotel {hotel_id}: {address}')
+                logging.exception('An error occurred')
+        connection.executemany('update HOTEL set LATITUDE=?, LONGITUDE=?, ALTITUDE=? where ID=?;', coordinates_list)
+        connection.commit()
+        logging.info(f'Geocoded {len(coordinates_list)} hotels: {self.counter_dict}')
+        return
+
+    def _run(self):
+        """ Thread loop. Takes the hotels already queued, up to batch_size, and geocodes them. Stops at the None sentinel """
+        connection = get_connection(self.db_path) # own connection, sqlite connections are not shared between threads
+        try:
+            geocode_cache = GeocodeCache(connection)
+            geocode_cache.seed_exceptions()
+            SpatialIndex(connection) # triggers indexing the new coordinates
+            connection.commit()
+            stop = False
+            while not stop:
+                hotel_list = []
+                message = self.hotel_queue.get()
+                while message is not None:
+                    hotel_list.append(message)
+                    if len(hotel_list) >= self.batch_size:
+                        break
+                    try:
+                        message = self.hotel_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                stop = message is None
+                if hotel_list != []:
+                    self._geocode_batch(connection, geocode_cache, hotel_list)
+        except Exception as e:
+            logging.error('Error in geocoding stage, stopping it')
+            logging.exception('An error occurred')
+        finally:
+            connection.close()
+        return
+
+
+    # public methods
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='geocoding_stage', daemon=True)
+        self.thread.start()
+        logging.info(f'Started geocoding stage: {self.source}')
+        return
+
+    def submit(self, hotel_id, address):
+        """ Queue a hotel written to the db, without waiting for its coordinates """
+        self.hotel_queue.put((hotel_id, address))
+        return
+
+    def stop(self):
+        """ Wait for the queued hotels to be geocoded, then stop the thread """
+        self.hotel_queue.put(None)
+        self.thread.join()
+        logging.info(f'Stopped geocoding stage: {self.counter_dict}')
+        return
+
+
+def run_geocoding(test=True, log_file_name='geocoding.log', db_name='test.db', geocoder=None):
+    """ Geocode the hotels without coordinates, like the ones written by the pipeline or left by a stopped stage """
+    set_logging(test, log_file_name)
+    connection = get_connection(DB_FOLDER_PATH/db_name, read_only=True)
+    hotel_list = connection.execute('select ID, ADDRESS from HOTEL where LATITUDE is null and ADDRESS is not null;').fetchall()
+    connection.close()
+    logging.info(f'Hotels to geocode: {len(hotel_list)}')
+    geocoding_stage = GeocodingStage(DB_FOLDER_PATH/db_name, geocoder=geocoder)
+    geocoding_stage.start()
+    for hotel_id, address in hotel_list:
+        geocoding_stage.submit(hotel_id, address)
+    geocoding_stage.stop()
+    return
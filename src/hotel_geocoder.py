@@ -1,177 +1,180 @@
 import logging
-import time
-import sqlite3
-import hashlib
-import requests
+import itertools
 import json
-from keys import mapquest_key
-from hotel_geocoder_exceptions import exception_dict
-
+import requests
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from run_utils import set_logging, get_hashed_id
+from db_connection import get_connection
+from geocode_cache import GeocodeCache
+from rate_limiter import RateLimiter
+from spatial_index import SpatialIndex
+from _config import DB_FOLDER_PATH, MAPQUEST_API_KEY, MAPQUEST_BASE_URL, MAPQUEST_REQUESTS_PER_MINUTE, MAPQUEST_BATCH_SIZE, MAPQUEST_CONCURRENCY
 
-logging.basicConfig(filename='logs/hotel_geocoder.log', filemode='a', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s') 
-# logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s') 
 
-mapquest_endpoint = 'https://www.mapquestapi.com/geocoding/v1/address?key={}&inFormat=kvp&outFormat=json&location={}&thumbMaps=false'
+mapquest_batch_path = '/geocoding/v1/batch'
 
 
 class HotelGeocoder:
-    def __init__(self):
+    """
+    Geocoder of the scraped hotels with the MapQuest API. Addresses are sent in batches to the batch endpoint,
+    by a thread pool sharing one HTTP session (connections are reused) and one rate limiter.
+    Responses are written by the main thread, one transaction per batch: locations, raw responses, geocode cache and flags
+    """
+
+    def __init__(self, test=False, log_file_name='hotel_geocoder.log', db_name='hotel.db', base_url=MAPQUEST_BASE_URL, api_key=MAPQUEST_API_KEY, batch_size=MAPQUEST_BATCH_SIZE, concurrency=MAPQUEST_CONCURRENCY, requests_per_minute=MAPQUEST_REQUESTS_PER_MINUTE):
+        set_logging(test, log_file_name)
+        self.db_name = db_name
+        self.url = base_url + mapquest_batch_path
+        self.api_key = api_key
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.rate_limiter = RateLimiter(requests_per_minute, burst=concurrency, domain_list=[urlparse(base_url).netloc])
+        self.session = None
+        self.connection = None
+        self.cursor = None
+        self.geocode_cache = None
+        self.counter_dict = {'hotels': 0, 'locations': 0, 'failed_batches': 0}
         logging.info('Object instantiated')
-        self.continue_flag = True
-        self.hotel_id = None
-        self.hotel_address = None
-        self.rank = None
-        self.location = {}
-        self.mapquest_response_dict = {}
-        self.locations_list = []
+        return
 
-    @staticmethod
-    def _get_hashed_id(string):
-        # Calculate the SHA-256 hash of the string
-        hash_value = hashlib.sha256(string.encode()).hexdigest()
-        # Convert the hexadecimal hash value to an integer
-        hash_int = int(hash_value, 16)
-        # Truncate the integer to 20 digits. It has sufficient collision resistance for this use case
-        truncated_hash = hash_int % (10 ** 18)
-        return truncated_hash
-    
     def _get_cursor(self):
         """ Get cursor to db """
-        self.connection = sqlite3.connect('hotel.db', timeout=30) # increase timeout to run concurrently to scraping
+        self.connection = get_connection(DB_FOLDER_PATH/self.db_name) # waits on the scrapers commits, if any
         self.cursor = self.connection.cursor()
+        self.geocode_cache = GeocodeCache(self.connection) # shared with the geocoding stage of HotelIterator
+        self.geocode_cache.seed_exceptions()
+        SpatialIndex(self.connection) # triggers indexing the new locations
+        self.connection.commit()
         logging.info('Got cursor')
         return
-    
-    def _get_hotel_from_db(self):
-        """ Get hotel from db """
-        # get hotel that has not been geocoded
-        self.cursor.execute('select id from result where hotel_geocoded_flag=0 and hotel_scraped_flag=1 order by random() limit 1;')
-        self.hotel_id = self.cursor.fetchone()[0] if self.cursor.fetchone() is not None else None
-        if self.hotel_id is None:
-            self.continue_flag = False
-            logging.info('No more hotels to geocode')
-            return
-        else:
-            # get hotel address from hotel table
-            self.cursor.execute(f'select address from hotel where id={self.hotel_id};')
-            self.hotel_address = self.cursor.fetchone()[0]
-            logging.info(f'Got hotel from db')
-            logging.info(f'Hotel id: {self.hotel_id}')
-            logging.info(f'Hotel address: {self.hotel_address}')
-            if self.hotel_id in exception_dict:
-                self.hotel_address = exception_dict[self.hotel_id]
-                logging.info(f'Found hotel in exception_dict')
-                logging.info(f'New hotel address: {self.hotel_address}')
-            return
-
-    def _update_hotel_geocoded_flag(self):
-        """ Update hotel geocoded flag in db """
-        self.cursor.execute(f'update result set hotel_geocoded_flag=1 where id={self.hotel_id}')
-        self.connection.commit()
-        logging.info('Updated hotel geocoded flag')
+
+    def _get_session(self):
+        """ HTTP session shared by the threads, with a connection pool as large as the concurrency """
+        self.session = requests.Session()
+        self.session.mount(self.url.split('://')[0] + '://', HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency))
+        logging.info('Got session')
+        return
+
+    def _get_hotel_batches(self):
+        """
+        Stream the hotels to geocode in batches, as (hotel id, scraped address, address to query), from a single query.
+        Exception addresses come from the geocode cache in the same query. Own cursor, the main one writes the batches meanwhile
+        """
+        cursor = self.connection.execute("""
+            select RESULT.ID, HOTEL.ADDRESS, coalesce(GEOCODE_CACHE.QUERY_ADDRESS, HOTEL.ADDRESS) from RESULT
+            join HOTEL on HOTEL.ID=RESULT.ID
+            left join GEOCODE_CACHE on GEOCODE_CACHE.ADDRESS_KEY=NORMALIZE_ADDRESS(HOTEL.ADDRESS)
+            where RESULT.HOTEL_GEOCODED_FLAG=0 and RESULT.HOTEL_SCRAPED_FLAG=1
+            order by RESULT.ID;
+        """)
+        while True:
+            hotel_batch = cursor.fetchmany(self.batch_size)
+            if hotel_batch == []:
+                break
+            yield hotel_batch
+        cursor.close()
         return
 
-    def _get_mapquest_response(self):
-        """ Geocode hotel """
+
+    # api calls, run in the thread pool
+
+    def _get_mapquest_response(self, hotel_batch):
+        """ Geocode a batch of hotels with a single call. Return the results of the response, in the order of the batch """
         i = 0
-        url = mapquest_endpoint.format(mapquest_key, self.hotel_address)
-        while i < 3:
+        while True:
             try:
-                mapquest_response = requests.get(url, timeout=30)
+                self.rate_limiter.wait(self.url)
+                mapquest_response = self.session.post(
+                    self.url,
+                    params={'key': self.api_key},
+                    json={'locations': [query_address for hotel_id, address, query_address in hotel_batch], 'options': {'thumbMaps': False}},
+                    timeout=30
+                )
                 mapquest_response.raise_for_status()
-                self.mapquest_response_dict = mapquest_response.json()
-                break
-            except requests.exceptions.HTTPError as http_err:
-                logging.error(http_err)
-                logging.error('Non 200 response from API call')
-                logging.exception('An error occurred')
-                i += 1
-                continue
+                result_list = mapquest_response.json()['results']
+                if len(result_list) != len(hotel_batch):
+                    raise ValueError(f'Got {len(result_list)} results for {len(hotel_batch)} addresses')
+                self.rate_limiter.report_success(self.url)
+                return result_list
             except Exception as e:
-                logging.error(e)
-                logging.error('Error in API call')
-                logging.exception('An error occurred')
                 i += 1
-                continue
-        logging.info('Got mapquest response, parsed and stored it in a dict')
-        logging.info(self.mapquest_response_dict)
-        return
-    
-    def _get_locations_list(self):
-        """ Get locations list from mapquest response """
-        self.locations_list = self.mapquest_response_dict['results'][0]['locations']
-        logging.info('Got locations list')
-        return
-    
-    def _iterate_locations(self):
-        """ Iterate locations list """
-        for self.rank, self.location in enumerate(self.locations_list):
-            self._insert_replace_location()
-        logging.info('Iterated all locations')
-        return
-        
-    def _insert_replace_location(self):
-        """ Insert location in db """
-        self.cursor.execute(f"""
-            insert or replace into HOTEL_MAPQUEST_LOCATION (
-                id, hotel_id, rank, street, admin_area_6, admin_area_6_type, admin_area_5, admin_area_5_type, 
-                admin_area_4, admin_area_4_type, admin_area_3, admin_area_3_type, admin_area_1, admin_area_1_type, 
-                postal_code, geocode_quality_code, geocode_quality, drag_point, side_of_street, link_id, 
-                unknown_input, type, latitude, longitude, display_latitude, display_longitude, map_url
-            ) values (
-                {self._get_hashed_id(str(self.hotel_id) + str(self.rank))}, 
-                {self.hotel_id}, 
-                {self.rank}, 
-                "{self.location['street']}", 
-                "{self.location['adminArea6']}", 
-                "{self.location['adminArea6Type']}", 
-                "{self.location['adminArea5']}", 
-                "{self.location['adminArea5Type']}", 
-                "{self.location['adminArea4']}", 
-                "{self.location['adminArea4Type']}", 
-                "{self.location['adminArea3']}", 
-                "{self.location['adminArea3Type']}", 
-                "{self.location['adminArea1']}", 
-                "{self.location['adminArea1Type']}", 
-                "{self.location['postalCode']}", 
-                "{self.location['geocodeQualityCode']}", 
-                "{self.location['geocodeQuality']}", 
-                {self.location['dragPoint']}, 
-                "{self.location['sideOfStreet']}", 
-                "{self.location['linkId']}", 
-                "{self.location['unknownInput']}", 
-                "{self.location['type']}", 
-                {self.location['latLng']['lat']}, 
-                {self.location['latLng']['lng']}, 
-                {self.location['displayLatLng']['lat']}, 
-                {self.location['displayLatLng']['lng']}, 
-                "{self.location['mapUrl']}"
-            );
-        """)
-        self.connection.commit()
-        logging.info('Inserted location')
-        return
+                self.rate_limiter.report_error(self.url, throttled=isinstance(e, requests.exceptions.HTTPError) and e.response.status_code == 429)
+                logging.error(f'Error in API call, retry {i}')
+                logging.exception('An error occurred')
+                if i >= 3:
+                    raise e
 
-    def _insert_replace_mapquest_response(self):
-        """ Insert or replace mapquest response in db, to store the raw response in case we need to debug """
-        self.cursor.execute(f"""insert or replace into HOTEL_MAPQUEST_RESPONSE (hotel_id, response_raw) values ({self.hotel_id}, '{json.dumps(self.mapquest_response_dict).replace("'", "''")}');""")
-        self.connection.commit()
-        logging.info('Inserted or replaced mapquest response')
+
+    # db writes, run in the main thread
+
+    @staticmethod
+    def _get_location_row(hotel_id, rank, location):
+        """ Values of a HOTEL_MAPQUEST_LOCATION row, from a location of the response """
+        return (
+            get_hashed_id(str(hotel_id) + str(rank)), hotel_id, rank,
+            location['street'], location['adminArea6'], location['adminArea6Type'], location['adminArea5'], location['adminArea5Type'],
+            location['adminArea4'], location['adminArea4Type'], location['adminArea3'], location['adminArea3Type'], location['adminArea1'], location['adminArea1Type'],
+            location['postalCode'], location['geocodeQualityCode'], location['geocodeQuality'], location['dragPoint'], location['sideOfStreet'], location['linkId'],
+            location['unknownInput'], location['type'], location['latLng']['lat'], location['latLng']['lng'], location['displayLatLng']['lat'], location['displayLatLng']['lng'],
+            location['mapUrl']
+        )
+
+    def _write_batch(self, hotel_batch, result_list):
+        """ Write the locations and raw results of a batch, cache the best locations and set the flags, in one transaction """
+        location_row_list = []
+        for (hotel_id, address, query_address), result in zip(hotel_batch, result_list):
+            location_row_list.extend(self._get_location_row(hotel_id, rank, location) for rank, location in enumerate(result['locations']))
+            if result['locations'] != []: # best location, cached for the geocoding stage
+                self.geocode_cache.put(address, result['locations'][0]['latLng']['lat'], result['locations'][0]['latLng']['lng'], -1, 'mapquest')
+        hotel_id_list = [(hotel_id,) for hotel_id, address, query_address in hotel_batch]
+        try:
+            self.cursor.executemany('delete from HOTEL_MAPQUEST_LOCATION where HOTEL_ID=?;', hotel_id_list) # locations of a previous geocoding
+            self.cursor.executemany("""
+                insert or replace into HOTEL_MAPQUEST_LOCATION (
+                    id, hotel_id, rank, street, admin_area_6, admin_area_6_type, admin_area_5, admin_area_5_type,
+                    admin_area_4, admin_area_4_type, admin_area_3, admin_area_3_type, admin_area_1, admin_area_1_type,
+                    postal_code, geocode_quality_code, geocode_quality, drag_point, side_of_street, link_id,
+                    unknown_input, type, latitude, longitude, display_latitude, display_longitude, map_url
+                ) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+            """, location_row_list)
+            self.cursor.executemany('insert or replace into HOTEL_MAPQUEST_RESPONSE (hotel_id, response_raw) values (?, ?);', [
+                (hotel_id, json.dumps(result)) for (hotel_id, address, query_address), result in zip(hotel_batch, result_list)
+            ]) # raw result of each hotel, in case we need to debug
+            self.cursor.executemany('update RESULT set hotel_geocoded_flag=1 where id=?;', hotel_id_list)
+            self.connection.commit()
+        except Exception as e:
+            self.connection.rollback()
+            raise e
+        self.counter_dict['hotels'] += len(hotel_batch)
+        self.counter_dict['locations'] += len(location_row_list)
+        logging.info(f'Wrote batch of {len(hotel_batch)} hotels, {len(location_row_list)} locations')
         return
-    
+
     def _iterate_hotels(self):
-        """ Iterate hotels """
-        while True:
-            self._get_hotel_from_db()
-            if self.continue_flag == False:
-                break
-            self._get_mapquest_response()
-            self._get_locations_list()
-            self._iterate_locations()
-            self._insert_replace_mapquest_response()
-            self._update_hotel_geocoded_flag()
-            time.sleep(0.3)
-            logging.info('Done hotel, going to the next one')
+        """
+        Geocode all the hotels to geocode, batches in parallel. Batches are read from the db as requests complete,
+        keeping up to twice the concurrency in flight. Hotels of failed batches are left for the next run
+        """
+        hotel_batches = self._get_hotel_batches()
+        future_dict = {}
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            while True:
+                for hotel_batch in itertools.islice(hotel_batches, 2 * self.concurrency - len(future_dict)):
+                    future_dict[executor.submit(self._get_mapquest_response, hotel_batch)] = hotel_batch
+                if future_dict == {}:
+                    break
+                done_future_set, pending_future_set = wait(future_dict, return_when=FIRST_COMPLETED)
+                for future in done_future_set:
+                    hotel_batch = future_dict.pop(future)
+                    try:
+                        self._write_batch(hotel_batch, future.result())
+                    except Exception as e:
+                        self.counter_dict['failed_batches'] += 1
+                        logging.error('Error geocoding batch, skipping it')
+                        logging.exception('An error occurred')
+        logging.info(f'Geocoded hotels: {self.counter_dict}')
         return
 
 
@@ -179,6 +182,7 @@ class HotelGeocoder:
         """ Run the instance of the class """
         try:
             self._get_cursor()
+            self._get_session()
             self._iterate_hotels()
         except Exception as e:
             logging.error(e)
@@ -187,9 +191,10 @@ class HotelGeocoder:
             raise e
         finally:
             logging.info('Quitting')
-            self.connection.close()
+            self.session.close() if self.session is not None else None
+            self.connection.close() if self.connection is not None else None
         return
 
 if __name__ == '__main__':
     hg = HotelGeocoder()
-    hg.run()
\ No newline at end of file
+    hg.run()
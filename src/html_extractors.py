@@ -0,0 +1,154 @@
+import functools
+import re
+from urllib.parse import urljoin
+from lxml import etree, html as lxml_html
+
+
+# Extractors of archived page sources, with lxml. They return the same documents as the scripts in page_scripts,
+# so the same parsers of page_parsers apply. innerText is rebuilt from the tree by the rules of the browsers for the
+# elements found in the pages: collapsed spaces, line breaks at <br> and around blocks, hidden elements skipped
+
+BASE_URL = 'https://www.tripadvisor.com'
+BLOCK_TAG_SET = {
+    'address', 'article', 'aside', 'blockquote', 'dd', 'details', 'dialog', 'div', 'dl', 'dt', 'fieldset', 'figcaption', 'figure',
+    'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hgroup', 'hr', 'li', 'main', 'nav', 'ol', 'section', 'summary',
+    'table', 'tr', 'ul'
+} # one line break before and after, two for <p>
+HIDDEN_TAG_SET = {'script', 'style', 'template', 'noscript', 'head', 'title', 'meta', 'link'}
+
+
+# helpers
+
+@functools.lru_cache(maxsize=None)
+def _get_class_xpath(class_name):
+    """ Compiled xpath of the descendants having all the classes of a selenium class name, like 'WMndO.f' """
+    conditions = ' and '.join(f"contains(concat(' ', normalize-space(@class), ' '), ' {class_token} ')" for class_token in class_name.split('.'))
+    return etree.XPath(f'.//*[{conditions}]')
+
+def _all(class_name, root):
+    return _get_class_xpath(class_name)(root)
+
+def _one(class_name, root):
+    elements = _get_class_xpath(class_name)(root)
+    return elements[0] if elements != [] else None
+
+def _is_hidden(element):
+    return element.tag in HIDDEN_TAG_SET or element.get('hidden') is not None or 'display:none' in (element.get('style') or '').replace(' ', '')
+
+def _append_inner_text(element, item_list):
+    """ Append the texts of the element, with spaces collapsed, and its required line breaks (numbers) """
+    if element.tag == 'br':
+        item_list.append('\n')
+        return
+    breaks = 2 if element.tag == 'p' else 1 if element.tag in BLOCK_TAG_SET else 0
+    item_list.append(breaks)
+    item_list.append(re.sub(r'[ \t\n\r\f]+', ' ', element.text or ''))
+    for child in element:
+        if isinstance(child.tag, str) and not _is_hidden(child): # comments and processing instructions have their tail only
+            _append_inner_text(child, item_list)
+            if child.tag in ('td', 'th') and child.getnext() is not None:
+                item_list.append('\t')
+        item_list.append(re.sub(r'[ \t\n\r\f]+', ' ', child.tail or ''))
+    item_list.append(breaks)
+    return
+
+def _text(element):
+    """ innerText of the element, trimmed, as selenium .text """
+    item_list = []
+    _append_inner_text(element, item_list)
+    text_list, breaks = [], 0
+    for item in item_list: # runs of required line breaks count as the largest, and are dropped at the start and end
+        if isinstance(item, int):
+            breaks = max(breaks, item)
+        elif item.strip(' ') == '': # spaces between blocks are not rendered, they don't end a run of line breaks
+            text_list.append(item)
+        else:
+            text_list.append('\n' * breaks if text_list != [] else '')
+            text_list.append(item)
+            breaks = 0
+    text = re.sub(r' {2,}', ' ', ''.join(text_list)) # spaces collapsed across elements too
+    return re.sub(r' *\n *', '\n', text).strip() # spaces at the start and end of lines are not rendered
+
+def _text_content(element):
+    return element.text_content()
+
+def _first_text(class_name, root):
+    element = _one(class_name, root)
+    return _text(element) if element is not None else None
+
+def _first_text_content(class_name, root):
+    element = _one(class_name, root)
+    return _text_content(element) if element is not None else None
+
+def _first_attribute(class_name, attribute, root):
+    element = _one(class_name, root)
+    return element.get(attribute) if element is not None else None
+
+def _first_href(class_name, root):
+    """ Absolute url of the first element, as selenium get_attribute('href') """
+    href = _first_attribute(class_name, 'href', root)
+    return urljoin(BASE_URL, href) if href is not None else None
+
+
+# extractors
+
+def extract_hotel_document(page_source):
+    """ Same document as HOTEL_PAGE_SCRIPT """
+    root = lxml_html.fromstring(page_source)
+    description_box = _one('_T.FKffI.TPznB.Ci.ajMTa.Ps.Z.BB.bmUTE', root) # desc with "Read more" button
+    return {
+        'name': _first_text('WMndO.f', root),
+        'address': _first_text('FhOgt.H3.f.u.fRLPH', root),
+        'rating': _first_text('kJyXc.P', root),
+        'header': [_text(element) for element in _all('biGQs._P.pZUbB.KxBGd', root)],
+        'star_rating': _first_text_content('JXZuC.d.H0', root),
+        'nearby': [_text(element) for element in _all('CllfH', root)],
+        'walkers_score': _first_text('UQxjK.H-', root),
+        'pictures': _first_text('GuzzA', root),
+        'average_night_price': _first_text('biGQs._P.pZUbB.fOtGX', root),
+        'reviews_summary': _first_text('biGQs._P.pZUbB.ncFvv.KxBGd', root),
+        'description_read_more': _first_text('fIrGe._T', description_box) if description_box is not None else None,
+        'description': _first_text('_T.FKffI.TPznB.Ci.ajMTa.Ps.Z.BB', root), # desc without "Read more" button
+        'amenities_titles': [_text(element) for element in _all('vqEpQ.S5.b.Pf.ME', root)],
+        'amenities_boxes': [[_text_content(amenity) for amenity in _all('gFttI.f.ME.Ci.H3._c', box)] for box in _all('Jevoh.K', root)],
+        'qualities': [[_first_text('o', quality), _first_text('biGQs._P.fiohW.biKBZ.osNWb', quality)] for quality in _all('RZjkd', root)],
+        'additional_info_titles': [_text(element) for element in _all('mpDVe.Ci.b', root)],
+        'additional_info': [_text_content(element) for element in _all('IhqAp.Ci', root)],
+        'keypoints': [[_first_text('biGQs._P.pZUbB.qWPrE.hmDzD', point), _first_text('biGQs._P.kdCdj.ncFvv.fOtGX', point)] for point in _all('zQDwR.f.Pe.PX.Pr.PJ.u._S.hJoAg', root)],
+        'keywords': [_text(element) for element in _all('OKHdJ.z.Pc.PQ.Pp.PD.W._S.Gn.Rd._M.qWPrE.biKBZ.PQFNM.wSSLS', root)],
+        'distribution': [_text(element) for element in _all('QErCz', root)]
+    }
+
+def extract_review_cards(page_source):
+    """ Same cards as REVIEW_PAGE_SCRIPT """
+    root = lxml_html.fromstring(page_source)
+    card_list = []
+    for card in _all('azLzJ.MI.Gi.z.Z.BB.kYVoW', root):
+        review_link_box = _one('joSMp.MI._S.b.S6.H5.Cj._a', card)
+        card_list.append({
+            'url': _first_href('BMQDV._F.Gv.wSSLS.SwZTJ', review_link_box) if review_link_box is not None else None,
+            'title': _first_text('JbGkU.Cj', card),
+            'text': _first_text('orRIx.Ci._a.C', card),
+            'rating': _first_text('IaVba.F1', card),
+            'date_of_review': _first_text('ScwkD._Z.o.S4.H3.Ci', card),
+            'date_of_stay': _first_text('iSNGb._R.Me.S4.H3.Cj', card),
+            'likes': _first_text('biGQs._P.FwFXZ', card),
+            'pics_flag': _one('Ctnpg._T.lqJaB', card) is not None,
+            'response_from': _first_text('MFqgB', card),
+            'response_text': _first_text('XCFtd', card),
+            'response_date': _first_attribute('vijoR', 'title', card),
+            'user_url': _first_href('MjDLG.VKCbE', card),
+            'user_name_shown': _first_text('MjDLG.VKCbE', card),
+            'user_info': [_text(element) for element in _all('sIZXw.S2.H2.Ch.d', card)]
+        })
+    return card_list
+
+def extract_result_cards(page_source):
+    """ Cards of a search results page, as read by ResultIterator """
+    root = lxml_html.fromstring(page_source)
+    return [{
+        'sponsored': _one('ngpKT.WywIO', card) is not None,
+        'url': _first_href('BMQDV._F.Gv.wSSLS.SwZTJ.FGwzt.ukgoS', card),
+        'reviews_label': _first_attribute('luFhX.o.W.f.u.w.JSdbl', 'aria-label', card),
+        'rank': _first_text('nBrpc.Wd.o.W', card)
+    } for card in _all('listItem', root)]
@@ -0,0 +1,237 @@
+import logging # settings inherited from the caller
+import os
+import socket
+import time
+from db_connection import get_connection
+from _config import DDL_FOLDER_PATH
+
+
+class JobQueue:
+    """
+    Work queue on the JOB table. Jobs are claimed with a lease: a claimed job is owned by one worker until it's completed,
+    failed, or the lease expires (then it's reclaimed by the next claim). Claims use the partial index on pending jobs
+    """
+
+    def __init__(self, db_path, kind, lease_seconds=600, max_attempts=3):
+        self.kind = kind
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.owner = f'{socket.gethostname()}-{os.getpid()}'
+        self.lease_token = None # claim time of the last claimed job, tells apart the attempts of a job by the same owner
+        self.connection = get_connection(db_path, isolation_level=None) # transactions are handled explicitly
+        self.connection.executescript((DDL_FOLDER_PATH / 'F_JOB.sql').read_text())
+        logging.info(f'Got job queue: {self.kind}, owner: {self.owner}')
+        return
+
+
+    # transaction methods
+
+    def _begin(self):
+        """ Begin a write transaction, locking the db for writes. Makes claim atomic between processes """
+        self.connection.execute('begin immediate;')
+        return
+
+    def _commit(self):
+        self.connection.execute('commit;')
+        return
+
+    def _rollback(self):
+        self.connection.execute('rollback;') if self.connection.in_transaction else None
+        return
+
+
+    def _reset_stale_waiting(self, page_kind):
+        """
+        Finish as failed the waiting jobs left without open jobs of page_kind for a lease, like when their last page failed for good
+        in a stopped process: set to pending again, or to failed after max_attempts. Call in a transaction
+        """
+        self.connection.execute("""
+            update JOB set
+                ATTEMPTS=ATTEMPTS+1,
+                STATE=case when ATTEMPTS+1>=? then 'failed' else 'pending' end,
+                INSERT_UPDATE_TIMESTAMP=current_timestamp
+            where KIND=? and STATE='waiting' and not exists (
+                select 1 from JOB PAGE_JOB
+                where PAGE_JOB.KIND=? and PAGE_JOB.HOTEL_ID=JOB.HOTEL_ID
+                and (PAGE_JOB.STATE in ('pending', 'leased') or PAGE_JOB.INSERT_UPDATE_TIMESTAMP>datetime('now', ?))
+            );
+        """, (self.max_attempts, self.kind, page_kind, f'-{self.lease_seconds} seconds'))
+        reset = self.connection.execute('select changes();').fetchone()[0]
+        logging.info(f'Reset {reset} stale waiting jobs: {self.kind}') if reset > 0 else None
+        return
+
+
+    # public methods
+
+    def enqueue_from_result(self, condition='1=0', priority=0, page_kind=None): # default condition to avoid enqueuing all rows
+        """
+        Enqueue hotels from RESULT matching the condition. Hotels already queued are kept as they are,
+        unless their job is done or failed: then they are set to pending again. With page_kind, waiting jobs
+        whose pages are all finished since a lease are reset first
+        """
+        try:
+            self._begin()
+            self._reset_stale_waiting(page_kind) if page_kind is not None else None
+            self.connection.execute(f"""
+                insert into JOB (KIND, HOTEL_ID, URL, PRIORITY)
+                select ?, ID, URL, ? from RESULT where {condition}
+                on conflict (KIND, URL) do update set
+                    STATE='pending', ATTEMPTS=0, PRIORITY=excluded.PRIORITY, INSERT_UPDATE_TIMESTAMP=current_timestamp
+                where STATE in ('done', 'failed');
+            """, (self.kind, priority))
+            enqueued = self.connection.execute('select changes();').fetchone()[0]
+            self._commit()
+            logging.info(f'Enqueued {enqueued} jobs: {self.kind}')
+        except Exception as e:
+            self._rollback()
+            logging.error('Error enqueuing jobs')
+            logging.exception('An error occurred')
+        return
+
+    def enqueue_urls(self, hotel_id, url_list, priority=0, reset_after_seconds=0, page_kind=None):
+        """
+        Enqueue urls of a hotel, like its review pages. Done or failed jobs of the same urls are set to pending again,
+        if they were finished more than reset_after_seconds ago. With page_kind, waiting jobs whose pages are all
+        finished since a lease are reset first
+        """
+        try:
+            self._begin()
+            self._reset_stale_waiting(page_kind) if page_kind is not None else None
+            self.connection.executemany("""
+                insert into JOB (KIND, HOTEL_ID, URL, PRIORITY) values (?, ?, ?, ?)
+                on conflict (KIND, URL) do update set
+                    STATE='pending', ATTEMPTS=0, PRIORITY=excluded.PRIORITY, INSERT_UPDATE_TIMESTAMP=current_timestamp
+                where STATE in ('done', 'failed') and INSERT_UPDATE_TIMESTAMP<=datetime('now', ?);
+            """, [(self.kind, hotel_id, url, priority, f'-{reset_after_seconds} seconds') for url in url_list])
+            self._commit()
+            logging.info(f'Enqueued {len(url_list)} urls of hotel {hotel_id}: {self.kind}')
+        except Exception as e:
+            self._rollback()
+            logging.error('Error enqueuing urls')
+            logging.exception('An error occurred')
+            raise e
+        return
+
+    def enqueue_hotels(self, hotel_priority_list):
+        """
+        Enqueue hotels from RESULT, each with its own priority, as (hotel_id, priority) couples.
+        Pending jobs get the new priority too; leased and waiting jobs are kept as they are
+        """
+        try:
+            self._begin()
+            self.connection.executemany("""
+                insert into JOB (KIND, HOTEL_ID, URL, PRIORITY)
+                select ?, ID, URL, ? from RESULT where ID=?
+                on conflict (KIND, URL) do update set
+                    STATE='pending', ATTEMPTS=0, PRIORITY=excluded.PRIORITY, INSERT_UPDATE_TIMESTAMP=current_timestamp
+                where STATE in ('pending', 'done', 'failed');
+            """, [(self.kind, priority, hotel_id) for hotel_id, priority in hotel_priority_list])
+            self._commit()
+            logging.info(f'Enqueued {len(hotel_priority_list)} hotels with priority: {self.kind}')
+        except Exception as e:
+            self._rollback()
+            logging.error('Error enqueuing hotels')
+            logging.exception('An error occurred')
+            raise e
+        return
+
+    def claim(self):
+        """ Claim the next pending job. Expired leases are reclaimed first. Return (job_id, hotel_id, url), None values if no job is left """
+        try:
+            now = time.time()
+            self._begin()
+            self.connection.execute("""
+                update JOB set STATE='pending', LEASE_OWNER=null, LEASE_EXPIRY=null
+                where KIND=? and STATE='leased' and LEASE_EXPIRY<?;
+            """, (self.kind, now))
+            reclaimed = self.connection.execute('select changes();').fetchone()[0]
+            logging.info(f'Reclaimed {reclaimed} expired leases') if reclaimed > 0 else None
+            row = self.connection.execute("""
+                select ID, HOTEL_ID, URL from JOB
+                where KIND=? and STATE='pending'
+                order by PRIORITY desc, ID limit 1;
+            """, (self.kind,)).fetchone()
+            if row is not None:
+                self.connection.execute("""
+                    update JOB set STATE='leased', LEASE_OWNER=?, LEASE_EXPIRY=?, INSERT_UPDATE_TIMESTAMP=current_timestamp
+                    where ID=?;
+                """, (self.owner, now + self.lease_seconds, row[0]))
+                self.lease_token = now
+            self._commit()
+        except Exception as e:
+            self._rollback()
+            logging.error('Error claiming job')
+            logging.exception('An error occurred')
+            raise e
+        if row is None:
+            logging.info(f'No pending jobs: {self.kind}')
+            return None, None, None
+        logging.info(f'Claimed job: {row}')
+        return row
+
+    def renew(self, job_id):
+        """ Extend the lease of an owned job, for long jobs """
+        self.connection.execute("""
+            update JOB set LEASE_EXPIRY=? where ID=? and STATE='leased' and LEASE_OWNER=?;
+        """, (time.time() + self.lease_seconds, job_id, self.owner))
+        logging.info(f'Renewed lease of job {job_id}')
+        return
+
+    def complete(self, job_id, owner=None):
+        """ Mark an owned job as done. Owner defaults to this queue, another stage can complete on behalf of the claiming worker """
+        self.connection.execute("""
+            update JOB set STATE='done', LEASE_OWNER=null, LEASE_EXPIRY=null, INSERT_UPDATE_TIMESTAMP=current_timestamp
+            where ID=? and LEASE_OWNER=?;
+        """, (job_id, owner if owner is not None else self.owner))
+        logging.info(f'Completed job {job_id}')
+        return
+
+    def fail(self, job_id, owner=None):
+        """ Release an owned job after an error. Set to pending again, or to failed after max_attempts """
+        self.connection.execute("""
+            update JOB set
+                ATTEMPTS=ATTEMPTS+1,
+                STATE=case when ATTEMPTS+1>=? then 'failed' else 'pending' end,
+                LEASE_OWNER=null, LEASE_EXPIRY=null, INSERT_UPDATE_TIMESTAMP=current_timestamp
+            where ID=? and LEASE_OWNER=?;
+        """, (self.max_attempts, job_id, owner if owner is not None else self.owner))
+        logging.info(f'Failed job {job_id}')
+        return
+
+    def park(self, job_id):
+        """ Set an owned job waiting for other jobs (like the pages of a hotel). Waiting jobs are not claimed, nor reclaimed """
+        self.connection.execute("""
+            update JOB set STATE='waiting', LEASE_OWNER=null, LEASE_EXPIRY=null, INSERT_UPDATE_TIMESTAMP=current_timestamp
+            where ID=? and LEASE_OWNER=?;
+        """, (job_id, self.owner))
+        logging.info(f'Parked job {job_id}')
+        return
+
+    def finish_waiting(self, hotel_id, success):
+        """ Finish the waiting job of a hotel, from any worker: done if success, otherwise pending again or failed after max_attempts """
+        if success:
+            self.connection.execute("""
+                update JOB set STATE='done', INSERT_UPDATE_TIMESTAMP=current_timestamp
+                where KIND=? and HOTEL_ID=? and STATE='waiting';
+            """, (self.kind, hotel_id))
+        else:
+            self.connection.execute("""
+                update JOB set
+                    ATTEMPTS=ATTEMPTS+1,
+                    STATE=case when ATTEMPTS+1>=? then 'failed' else 'pending' end,
+                    INSERT_UPDATE_TIMESTAMP=current_timestamp
+                where KIND=? and HOTEL_ID=? and STATE='waiting';
+            """, (self.max_attempts, self.kind, hotel_id))
+        logging.info(f'Finished waiting job of hotel {hotel_id}, success: {success}')
+        return
+
+    def count_open(self, hotel_id):
+        """ Number of pending or leased jobs of a hotel """
+        return self.connection.execute("""
+            select count(*) from JOB where KIND=? and HOTEL_ID=? and STATE in ('pending', 'leased');
+        """, (self.kind, hotel_id)).fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+        logging.info('Closed job queue')
+        return
@@ -0,0 +1,94 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from langdetect import DetectorFactory, detect
+from langdetect.lang_detect_exception import LangDetectException
+from run_utils import set_logging, get_hashed_id
+from db_connection import get_connection
+from _config import DB_FOLDER_PATH, DDL_FOLDER_PATH
+
+
+# Language detection stage: reviews are written without languages (null), and their texts are detected here, in batches,
+# by a process pool. Detection is seeded, so the same text gets the same language in every run, and cached by text hash:
+# a text already seen (same response of a hotel to many reviews, re-scraped reviews) is never detected again.
+# Texts without a detectable language (like '...') and missing responses are set to 'NA', so each review is processed once
+
+
+def _set_seed():
+    """ Initializer of the pool processes. langdetect samples randomly, the fixed seed makes it deterministic """
+    DetectorFactory.seed = 0
+    return
+
+def _detect_language(text):
+    """ Language of a text, 'NA' if not detectable. Run in the pool processes """
+    try:
+        return detect(text)
+    except LangDetectException as e:
+        return 'NA'
+
+def _get_pending_review_list(connection, last_review_id, batch_size):
+    """ Next batch of reviews with a missing language, by id, as (id, text, response text, language, response language) """
+    return connection.execute("""
+        select ID, TEXT, RESPONSE_TEXT, LANGUAGE, RESPONSE_LANGUAGE from REVIEW
+        where (LANGUAGE is null or RESPONSE_LANGUAGE is null) and ID>?
+        order by ID limit ?;
+    """, (last_review_id, batch_size)).fetchall()
+
+def _get_cached_language_dict(connection, text_hash_list):
+    """ Cached languages of the given text hashes, with a single lookup """
+    if text_hash_list == []:
+        return {}
+    placeholders = ', '.join(['?'] * len(text_hash_list))
+    return dict(connection.execute(f'select TEXT_HASH, LANGUAGE from LANGUAGE_CACHE where TEXT_HASH in ({placeholders});', text_hash_list).fetchall())
+
+def _get_language(language, text, language_dict):
+    """ Language of a review text: the one already set, else the detected or cached one. 'NA' for missing texts """
+    if language is not None:
+        return language
+    if text in (None, 'NA'):
+        return 'NA'
+    return language_dict[get_hashed_id(text)]
+
+def run_language_detection(processes=os.cpu_count(), test=True, log_file_name='language_detection.log', db_name='test.db', batch_size=5000):
+    """ Fill the missing languages of REVIEW. Incremental: only reviews with a null language are read """
+    set_logging(test, log_file_name)
+    connection = get_connection(DB_FOLDER_PATH/db_name)
+    try:
+        connection.executescript((DDL_FOLDER_PATH / 'I_LANGUAGE_CACHE.sql').read_text())
+        last_review_id, reviews, detected_texts = -1, 0, 0
+        with ProcessPoolExecutor(max_workers=processes, initializer=_set_seed) as executor:
+            while True:
+                pending_review_list = _get_pending_review_list(connection, last_review_id, batch_size)
+                if pending_review_list == []:
+                    break
+                last_review_id = pending_review_list[-1][0]
+                # texts to detect: missing responses need no detection
+                text_dict = {} # text hash: text
+                for review_id, text, response_text, language, response_language in pending_review_list:
+                    if language is None and text not in (None, 'NA'):
+                        text_dict[get_hashed_id(text)] = text
+                    if response_language is None and response_text not in (None, 'NA'):
+                        text_dict[get_hashed_id(response_text)] = response_text
+                language_dict = _get_cached_language_dict(connection, list(text_dict.keys()))
+                new_text_hash_list = [text_hash for text_hash in text_dict if text_hash not in language_dict]
+                new_language_list = list(executor.map(_detect_language, [text_dict[text_hash] for text_hash in new_text_hash_list], chunksize=256))
+                language_dict.update(zip(new_text_hash_list, new_language_list))
+                # cache and languages of the batch, in one transaction
+                connection.executemany('insert or ignore into LANGUAGE_CACHE (TEXT_HASH, LANGUAGE) values (?, ?);', zip(new_text_hash_list, new_language_list))
+                connection.executemany('update REVIEW set LANGUAGE=?, RESPONSE_LANGUAGE=? where ID=?;', [
+                    (_get_language(language, text, language_dict), _get_language(response_language, response_text, language_dict), review_id)
+                    for review_id, text, response_text, language, response_language in pending_review_list
+                ])
+                connection.commit()
+                reviews += len(pending_review_list)
+                detected_texts += len(new_text_hash_list)
+                logging.info(f'Detected languages of {reviews} reviews, {detected_texts} texts detected, the others from the cache')
+    except Exception as e:
+        connection.rollback()
+        logging.error('Error detecting languages')
+        logging.exception('An error occurred')
+        raise e
+    finally:
+        connection.close()
+    logging.info(f'Language detection finished: {reviews} reviews, {detected_texts} texts detected')
+    return
@@ -0,0 +1,128 @@
+import logging # settings inherited from the caller
+import sqlite3
+from run_utils import set_logging
+from db_connection import get_connection
+from _config import DB_FOLDER_PATH, DDL_FOLDER_PATH
+
+
+# Migration: indexes the tables only declared with primary keys, and adds HOTEL_REVIEW_STATS, the reviews of each hotel
+# kept by triggers on REVIEW. Run by the stages writing reviews before their first write, as the triggers must exist
+# for the counts to be right; the first run also builds the counts of the reviews already in the db.
+# Also adds the FINGERPRINT column to the scraped tables of older dbs: rows are then rewritten only if changed (see DbWriter),
+# and, from the migrate command only, rebuilds the REVIEW table of older dbs with MONTH_OF_REVIEW declared int, so months are
+# stored and compared as numbers. The rebuild locks the db while it copies the reviews, so the stages only check for it
+
+
+fingerprint_table_list = ['RESULT', 'HOTEL', 'REVIEW', 'USER']
+
+
+def rebuild_review_stats(connection):
+    """ Count again the reviews of each hotel. Left to the caller's transaction. Return the number of hotels """
+    connection.execute('delete from HOTEL_REVIEW_STATS;')
+    connection.execute("""
+        insert into HOTEL_REVIEW_STATS (HOTEL_ID, REVIEWS, RATED_REVIEWS, RATING_SUM, LAST_REVIEW_DATE)
+        select
+            HOTEL_ID, count(*),
+            sum(RATING between 1 and 5),
+            sum(case when RATING between 1 and 5 then RATING else 0 end),
+            max(case when YEAR_OF_REVIEW>0 and cast(MONTH_OF_REVIEW as int) between 1 and 12 then printf('%04d-%02d', YEAR_OF_REVIEW, cast(MONTH_OF_REVIEW as int)) end)
+        from REVIEW group by HOTEL_ID;
+    """)
+    hotels = connection.execute('select changes();').fetchone()[0]
+    logging.info(f'Built review stats: {hotels} hotels')
+    return hotels
+
+def add_fingerprint_columns(connection):
+    """ Add the FINGERPRINT column to the existing scraped tables missing it. Fingerprints are filled by the next write of each row """
+    for table in fingerprint_table_list:
+        column_list = [row[1].upper() for row in connection.execute(f'pragma table_info({table});')]
+        if column_list == [] or 'FINGERPRINT' in column_list: # missing table, created with the column by its ddl
+            continue
+        try:
+            connection.execute(f'alter table {table} add column FINGERPRINT int;')
+            logging.info(f'Added fingerprint column: {table}')
+        except sqlite3.OperationalError as e:
+            if 'duplicate column' not in str(e): # added by another process meanwhile
+                raise e
+    return
+
+def review_table_needs_retype(connection):
+    """ Whether MONTH_OF_REVIEW is declared varchar (older dbs): with text affinity, months are stored as text ('03') """
+    column_type_dict = {row[1].upper(): row[2].upper() for row in connection.execute('pragma table_info(REVIEW);')}
+    return 'CHAR' in column_type_dict.get('MONTH_OF_REVIEW', 'INT')
+
+def retype_review_table(connection):
+    """
+    Rebuild REVIEW if MONTH_OF_REVIEW is declared varchar. Reviews are copied to a table created by the current ddl,
+    with the months as numbers. The indexes and triggers on REVIEW, dropped with the old table, are created again
+    from their sql. The review stats are not touched, same reviews
+    """
+    connection.commit()
+    connection.execute('begin immediate;')
+    try:
+        if not review_table_needs_retype(connection):
+            connection.rollback()
+            return
+        column_type_dict = {row[1].upper(): row[2].upper() for row in connection.execute('pragma table_info(REVIEW);')}
+        schema_sql_list = [row[0] for row in connection.execute("select sql from sqlite_master where tbl_name='REVIEW' and type in ('index', 'trigger') and sql is not null;")]
+        connection.execute((DDL_FOLDER_PATH / 'C_REVIEW.sql').read_text().replace('create table if not exists REVIEW (', 'create table REVIEW_RETYPED ('))
+        select_dict = {row[1].upper(): row[1].upper() for row in connection.execute('pragma table_info(REVIEW_RETYPED);') if row[1].upper() in column_type_dict}
+        select_dict['MONTH_OF_REVIEW'] = 'case when cast(MONTH_OF_REVIEW as int) between 1 and 12 then cast(MONTH_OF_REVIEW as int) else -1 end'
+        if 'SCRAPED_TIMESTAMP' not in column_type_dict and 'S' in column_type_dict: # scraped timestamp, misnamed by the ddl of older dbs
+            select_dict['SCRAPED_TIMESTAMP'] = 'S'
+        connection.execute(f'insert into REVIEW_RETYPED ({", ".join(select_dict.keys())}) select {", ".join(select_dict.values())} from REVIEW;')
+        reviews = connection.execute('select changes();').fetchone()[0]
+        connection.execute('drop table REVIEW;')
+        connection.execute('alter table REVIEW_RETYPED rename to REVIEW;')
+        for schema_sql in schema_sql_list: # like REVIEW_LANGUAGE_PENDING_IDX, of the language detection stage
+            connection.execute(schema_sql)
+        connection.commit()
+    except Exception as e:
+        connection.rollback()
+        raise e
+    logging.info(f'Rebuilt REVIEW with numeric months: {reviews} reviews')
+    return
+
+def migrate(connection, retype=False):
+    """
+    Create the missing indexes, the review stats and their triggers, and the fingerprint columns. Review stats are built
+    the first time, then kept by the triggers. With retype, rebuild REVIEW if its months are text; else only report it
+    """
+    for ddl_file in ['A_RESULT.sql', 'C_REVIEW.sql']: # indexed tables
+        connection.executescript((DDL_FOLDER_PATH / ddl_file).read_text())
+    if retype:
+        retype_review_table(connection) # before the indexes and triggers on REVIEW
+    elif review_table_needs_retype(connection):
+        logging.error('REVIEW has MONTH_OF_REVIEW declared varchar, months are stored as text: run python _main.py migrate to rebuild it')
+    new_stats_flag = connection.execute("select count(*) from sqlite_master where type='table' and name='HOTEL_REVIEW_STATS';").fetchone()[0] == 0
+    connection.executescript((DDL_FOLDER_PATH / 'L_INDEXES.sql').read_text())
+    add_fingerprint_columns(connection)
+    if new_stats_flag:
+        try:
+            rebuild_review_stats(connection)
+            connection.commit()
+        except Exception as e:
+            connection.rollback()
+            raise e
+    logging.info('Migrated db')
+    return
+
+
+def run_migration(test=True, log_file_name='migrate.log', db_name='test.db', rebuild=False):
+    """ Migrate the db. With rebuild, count again the reviews of each hotel, like after reviews written before the triggers existed """
+    set_logging(test, log_file_name)
+    connection = get_connection(DB_FOLDER_PATH/db_name)
+    try:
+        migrate(connection, retype=True)
+        if rebuild:
+            rebuild_review_stats(connection)
+            connection.commit()
+        connection.execute('analyze;') # statistics for the query planner, on the new indexes
+    except Exception as e:
+        connection.rollback()
+        logging.error('Error migrating db')
+        logging.exception('An error occurred')
+        raise e
+    finally:
+        connection.close()
+    return
@@ -0,0 +1,79 @@
+import logging # settings inherited from the caller
+import gzip
+import hashlib
+import os
+from db_connection import get_connection
+from _config import ARCHIVE_FOLDER_PATH
+
+
+def load_page_source(content_path):
+    """ Load an archived page source from its file. Module level, to be used by parse processes """
+    return gzip.decompress(content_path.read_bytes()).decode()
+
+
+class PageArchive:
+    """
+    Archive of raw pages, to parse them again offline. Pages are stored gzipped and content addressed
+    (file name is the sha256 of the page, identical pages are stored once). The index maps each page id
+    (hashed url, as the ids of the iterators) and page type to its latest content
+    """
+
+    def __init__(self, folder=ARCHIVE_FOLDER_PATH):
+        self.folder = folder
+        os.makedirs(self.folder / 'pages', exist_ok=True)
+        self.connection = get_connection(self.folder / 'index.db') # shared by the workers of a pool
+        self.connection.execute("""
+            create table if not exists PAGE (
+                ID int,
+                URL varchar,
+                PAGE_TYPE varchar,
+                HOTEL_ID int,
+                PAGE_NUMBER int,
+                CONTENT_HASH varchar,
+                ARCHIVED_TIMESTAMP timestamp default current_timestamp,
+                primary key (ID, PAGE_TYPE) -- first review page and hotel page share the url
+            );
+        """)
+        self.connection.execute('create index if not exists PAGE_TYPE_IDX on PAGE (PAGE_TYPE);')
+        self.connection.commit()
+        logging.info(f'Got page archive: {self.folder}')
+        return
+
+    def get_content_path(self, content_hash):
+        return self.folder / 'pages' / content_hash[:2] / f'{content_hash}.html.gz'
+
+    def save(self, page_id, url, page_type, page_source, hotel_id=-1, page_number=-1):
+        """ Save a page and index it. Content is written only if not already in the archive """
+        try:
+            content = page_source.encode()
+            content_hash = hashlib.sha256(content).hexdigest()
+            content_path = self.get_content_path(content_hash)
+            if not content_path.exists():
+                os.makedirs(content_path.parent, exist_ok=True)
+                temporary_path = content_path.with_suffix(f'.{os.getpid()}.tmp')
+                temporary_path.write_bytes(gzip.compress(content))
+                os.replace(temporary_path, content_path) # atomic, no partial pages if interrupted
+            self.connection.execute("""
+                insert or replace into PAGE (ID, URL, PAGE_TYPE, HOTEL_ID, PAGE_NUMBER, CONTENT_HASH) values (?, ?, ?, ?, ?, ?);
+            """, (page_id, url, page_type, hotel_id, page_number, content_hash))
+            self.connection.commit()
+            logging.info(f'Archived page: {url}')
+        except Exception as e: # archiving is optional, never stop scraping for it
+            logging.error('Error archiving page')
+            logging.exception('An error occurred')
+        return
+
+    def load(self, content_hash):
+        """ Load the page source of a content hash """
+        return load_page_source(self.get_content_path(content_hash))
+
+    def get_index_rows(self, page_type):
+        """ Get (id, url, hotel_id, page_number, content_hash) of the archived pages of a type """
+        return self.connection.execute("""
+            select ID, URL, HOTEL_ID, PAGE_NUMBER, CONTENT_HASH from PAGE where PAGE_TYPE=? order by ID;
+        """, (page_type,)).fetchall()
+
+    def close(self):
+        self.connection.close()
+        logging.info('Closed page archive')
+        return
@@ -0,0 +1,151 @@
+import logging # settings inherited from the caller
+import time
+from field_schema import convert_row
+
+
+# Parsers of the documents returned by page_scripts. Pure python, no driver calls:
+# the same documents can be parsed again offline, or in another process.
+# Missing values are left None: rows are returned converted by the field schema, with its null values
+
+
+MONTHS_SHORT_DICT = {'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6, 'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12}
+MONTHS_LONG_DICT = {'january': 1, 'february': 2, 'march': 3, 'april': 4, 'may': 5, 'june': 6, 'july': 7, 'august': 8, 'september': 9, 'october': 10, 'november': 11, 'december': 12}
+
+
+def _get_required(document, key):
+    """ Get a value that must be in the page. Raise if missing, as the page is not complete """
+    if document[key] is None:
+        raise ValueError(f'Missing {key} in page')
+    return document[key]
+
+def _get_flattened(titles_list, values_list):
+    """ Couple titles with values, ignoring titles without a value """
+    return {title: values_list[i] for i, title in enumerate(titles_list) if i < len(values_list)}
+
+
+def parse_hotel_document(document):
+    """ Map the document of a hotel page (HOTEL_PAGE_SCRIPT) to typed HOTEL fields. Id, url and coordinates are set by the caller """
+    hotel_dict = {}
+    hotel_dict['name'] = _get_required(document, 'name')
+    hotel_dict['address'] = _get_required(document, 'address')
+    hotel_dict['rating'] = _get_required(document, 'rating')
+    hotel_dict['reviews'] = document['header'][1].split(' ')[0].replace(',','')
+    hotel_dict['category_rank'] = document['header'][2].replace('#', '').replace(',','')
+    hotel_dict['star_rating'] = document['star_rating'].split(' ')[0] if document['star_rating'] is not None else None
+    hotel_dict['nearby_restaurants'], hotel_dict['nearby_attractions'] = None, None
+    for nearby_things in document['nearby']:
+        if 'Restaurants' in nearby_things:
+            hotel_dict['nearby_restaurants'] = nearby_things.split(' ')[0].replace(',','')
+        elif 'Attractions' in nearby_things:
+            hotel_dict['nearby_attractions'] = nearby_things.split(' ')[0].replace(',','')
+    hotel_dict['walkers_score'] = document['walkers_score']
+    hotel_dict['pictures'] = document['pictures'].split('(')[-1].replace(')','').replace(',','') if document['pictures'] is not None else 0
+    hotel_dict['average_night_price'] = document['average_night_price'].split('$')[-1].split(' ')[0].replace(',','') if document['average_night_price'] is not None else None
+    hotel_dict['reviews_summary'] = document['reviews_summary'] if document['reviews_summary'] is not None else 'No reviews summary'
+    # hotel description
+    if document['description_read_more'] is not None: # desc with "Read more" button
+        hotel_dict['description'] = document['description_read_more']
+    elif document['description'] is not None: # desc without "Read more" button
+        hotel_dict['description'] = document['description']
+    else:
+        hotel_dict['description'] = 'No description'
+    # amenities
+    hotel_amenities_dict = _get_flattened(document['amenities_titles'], document['amenities_boxes'])
+    hotel_dict['property_amenities'] = ','.join(hotel_amenities_dict['Property amenities']) if 'Property amenities' in hotel_amenities_dict else None
+    hotel_dict['room_features'] = ','.join(hotel_amenities_dict['Room features']) if 'Room features' in hotel_amenities_dict else None
+    hotel_dict['room_types'] = ','.join(hotel_amenities_dict['Room types']) if 'Room types' in hotel_amenities_dict else None
+    # hotel qualities: Location, Cleanliness, Service, Value
+    hotel_qualities_dict = {quality_name: quality_rating for quality_name, quality_rating in document['qualities']}
+    hotel_dict['location_rating'] = hotel_qualities_dict.get('Location')
+    hotel_dict['cleanliness_rating'] = hotel_qualities_dict.get('Cleanliness')
+    hotel_dict['service_rating'] = hotel_qualities_dict.get('Service')
+    hotel_dict['value_rating'] = hotel_qualities_dict.get('Value')
+    # additional info
+    hotel_additional_info_dict = _get_flattened(document['additional_info_titles'], document['additional_info'])
+    price_range_min, price_range_max = None, None
+    if 'PRICE RANGE' in hotel_additional_info_dict: # price range extremes
+        price_range = hotel_additional_info_dict['PRICE RANGE'].replace(' (Based on Average Rates for a Standard Room) ','')
+        price_range_min = price_range.split(' - ')[0].replace('$','').replace(',','')
+        price_range_max = price_range.split(' - ')[1].replace('$','').replace(',','')
+    hotel_dict['also_known_as'] = hotel_additional_info_dict.get('ALSO KNOWN AS')
+    hotel_dict['formerly_known_as'] = hotel_additional_info_dict.get('FORMERLY KNOWN AS')
+    hotel_dict['city_location'] = hotel_additional_info_dict.get('LOCATION')
+    hotel_dict['number_of_rooms'] = hotel_additional_info_dict.get('NUMBER OF ROOMS')
+    hotel_dict['price_range_min'] = price_range_min
+    hotel_dict['price_range_max'] = price_range_max
+    # hotel reviews keypoints
+    hotel_reviews_keypoints_dict = {point_name: point_grade for point_name, point_grade in document['keypoints']}
+    for keypoint in ['Location', 'Atmosphere', 'Rooms', 'Value', 'Cleanliness', 'Service', 'Amenities']:
+        hotel_dict[f'reviews_keypoint_{keypoint.lower()}'] = hotel_reviews_keypoints_dict.get(keypoint)
+    # reviews keywords
+    hotel_reviews_keywords_list = [keyword for keyword in document['keywords'] if keyword != 'All reviews'] # remove 'All reviews' from list
+    hotel_dict['reviews_keywords'] = ','.join(hotel_reviews_keywords_list) if hotel_reviews_keywords_list != [] else None
+    # reviews distribution
+    hotel_reviews_distribution_dict = {5-i: review_amount.replace(',','') for i, review_amount in enumerate(document['distribution'])}
+    hotel_dict['reviews_5_excellent'] = hotel_reviews_distribution_dict[5]
+    hotel_dict['reviews_4_very_good'] = hotel_reviews_distribution_dict[4]
+    hotel_dict['reviews_3_average'] = hotel_reviews_distribution_dict[3]
+    hotel_dict['reviews_2_poor'] = hotel_reviews_distribution_dict[2]
+    hotel_dict['reviews_1_terrible'] = hotel_reviews_distribution_dict[1]
+    logging.info('Parsed hotel document')
+    return convert_row('HOTEL', hotel_dict)
+
+
+def _parse_date_of_review(date_of_review):
+    """ Month and year of a review date, like 'Mar 2024', 'Mar 12' (current month), 'today' or 'yesterday' """
+    if 'today' in date_of_review.lower():
+        return time.strftime('%m'), time.strftime('%Y')
+    elif 'yesterday' in date_of_review.lower():
+        yesterday = time.strftime('%Y-%m-%d', time.localtime(time.time() - 86400))
+        return yesterday.split('-')[1], yesterday.split('-')[0]
+    else: # standard case, month and year
+        month_of_review = MONTHS_SHORT_DICT[date_of_review.split(' ')[-2].lower()]
+        year_of_review = date_of_review.split(' ')[-1]
+        if int(year_of_review) < 2000: # if year is less than 2000, the scraper got the day of the month. It happens when the review is from the current month, so set the year to current year
+            year_of_review = time.strftime('%Y')
+        return month_of_review, year_of_review
+
+def parse_review_card(card):
+    """
+    Map a review card of a review page (REVIEW_PAGE_SCRIPT) to typed REVIEW and USER fields.
+    Ids, language and hotel id are set by the caller
+    """
+    review_dict, user_dict = {}, {}
+    review_dict['url'] = _get_required(card, 'url')
+    review_dict['title'] = _get_required(card, 'title')
+    review_dict['text'] = _get_required(card, 'text')
+    review_dict['rating'] = _get_required(card, 'rating').split(' ')[0]
+    review_dict['month_of_review'], review_dict['year_of_review'] = _parse_date_of_review(_get_required(card, 'date_of_review'))
+    date_of_stay = card['date_of_stay'].split(': ')[-1] if card['date_of_stay'] is not None else None
+    review_dict['month_of_stay'] = MONTHS_LONG_DICT[date_of_stay.split(' ')[-2].lower()] if date_of_stay is not None else None
+    review_dict['year_of_stay'] = date_of_stay.split(' ')[-1] if date_of_stay is not None else None
+    review_dict['likes'] = _get_required(card, 'likes')
+    review_dict['pics_flag'] = card['pics_flag']
+    # review response
+    review_dict['response_from'] = card['response_from']
+    review_dict['response_text'] = card['response_text']
+    review_dict['response_date'] = card['response_date']
+    # review user
+    user_dict['url'] = _get_required(card, 'user_url')
+    user_dict['name'] = user_dict['url'].split('Profile/')[-1]
+    user_dict['name_shown'] = card['user_name_shown']
+    user_dict['contributions'], user_dict['helpful_votes'], user_dict['location'] = None, None, None
+    for review_user_info in card['user_info']:
+        if 'contribution' in review_user_info:
+            user_dict['contributions'] = review_user_info.split(' ')[0].replace(',', '')
+        elif 'helpful vote' in review_user_info:
+            user_dict['helpful_votes'] = review_user_info.split(' ')[0].replace(',', '')
+        else:
+            user_dict['location'] = review_user_info
+    return convert_row('REVIEW', review_dict), convert_row('USER', user_dict)
+
+
+def parse_result_card(card, page_number):
+    """ Map a card of a search results page to typed RESULT fields, and the sponsored flag. Id is set by the caller """
+    result_dict = {}
+    result_dict['url'] = _get_required(card, 'url').split('?')[0]
+    result_dict['reviews'] = _get_required(card, 'reviews_label').split(' ')[-2].replace(',', '')
+    result_dict['rating'] = card['reviews_label'].split(' ')[0] if result_dict['reviews'] != '0' else None
+    result_dict['rank'] = _get_required(card, 'rank').split(' ')[0].replace('.', '') if card['sponsored'] == False else None
+    result_dict['page'] = page_number
+    return convert_row('RESULT', result_dict), card['sponsored']
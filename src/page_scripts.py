@@ -0,0 +1,91 @@
+# Scripts run in the page with driver.execute_script. Each one reads all the needed elements at once,
+# and returns a document (dict of texts and lists of texts) parsed in python by page_parsers.
+# Selectors are the class names used by the iterators, as css selectors. Selenium .text is innerText, trimmed
+
+
+# helpers shared by all scripts
+_HELPERS = """
+const all = (selector, root = document) => Array.from(root.querySelectorAll(selector));
+const one = (selector, root = document) => root.querySelector(selector);
+const text = element => element.innerText.trim();
+const textContent = element => element.textContent;
+const firstText = (selector, root = document) => { const element = one(selector, root); return element === null ? null : text(element); };
+const firstTextContent = (selector, root = document) => { const element = one(selector, root); return element === null ? null : textContent(element); };
+const firstAttribute = (selector, attribute, root = document) => { const element = one(selector, root); return element === null ? null : element.getAttribute(attribute); };
+const firstHref = (selector, root = document) => { const element = one(selector, root); return element === null ? null : element.href; }; // absolute url, as selenium get_attribute('href')
+"""
+
+
+HOTEL_PAGE_SCRIPT = _HELPERS + """
+const descriptionBox = one('._T.FKffI.TPznB.Ci.ajMTa.Ps.Z.BB.bmUTE'); // desc with "Read more" button
+return {
+    name: firstText('.WMndO.f'),
+    address: firstText('.FhOgt.H3.f.u.fRLPH'),
+    rating: firstText('.kJyXc.P'),
+    header: all('.biGQs._P.pZUbB.KxBGd').map(text),
+    star_rating: firstTextContent('.JXZuC.d.H0'),
+    nearby: all('.CllfH').map(text),
+    walkers_score: firstText('.UQxjK.H-'),
+    pictures: firstText('.GuzzA'),
+    average_night_price: firstText('.biGQs._P.pZUbB.fOtGX'),
+    reviews_summary: firstText('.biGQs._P.pZUbB.ncFvv.KxBGd'),
+    description_read_more: descriptionBox === null ? null : firstText('.fIrGe._T', descriptionBox),
+    description: firstText('._T.FKffI.TPznB.Ci.ajMTa.Ps.Z.BB'), // desc without "Read more" button
+    amenities_titles: all('.vqEpQ.S5.b.Pf.ME').map(text),
+    amenities_boxes: all('.Jevoh.K').map(box => all('.gFttI.f.ME.Ci.H3._c', box).map(textContent)),
+    qualities: all('.RZjkd').map(quality => [firstText('.o', quality), firstText('.biGQs._P.fiohW.biKBZ.osNWb', quality)]),
+    additional_info_titles: all('.mpDVe.Ci.b').map(text),
+    additional_info: all('.IhqAp.Ci').map(textContent),
+    keypoints: all('.zQDwR.f.Pe.PX.Pr.PJ.u._S.hJoAg').map(point => [firstText('.biGQs._P.pZUbB.qWPrE.hmDzD', point), firstText('.biGQs._P.kdCdj.ncFvv.fOtGX', point)]),
+    keywords: all('.OKHdJ.z.Pc.PQ.Pp.PD.W._S.Gn.Rd._M.qWPrE.biKBZ.PQFNM.wSSLS').map(text),
+    distribution: all('.QErCz').map(text)
+};
+"""
+
+
+REVIEW_PAGE_SCRIPT = _HELPERS + """
+return all('.azLzJ.MI.Gi.z.Z.BB.kYVoW').map(card => {
+    const reviewLinkBox = one('.joSMp.MI._S.b.S6.H5.Cj._a', card);
+    return {
+        url: reviewLinkBox === null ? null : firstHref('.BMQDV._F.Gv.wSSLS.SwZTJ', reviewLinkBox),
+        title: firstText('.JbGkU.Cj', card),
+        text: firstText('.orRIx.Ci._a.C', card),
+        rating: firstText('.IaVba.F1', card),
+        date_of_review: firstText('.ScwkD._Z.o.S4.H3.Ci', card),
+        date_of_stay: firstText('.iSNGb._R.Me.S4.H3.Cj', card),
+        likes: firstText('.biGQs._P.FwFXZ', card),
+        pics_flag: one('.Ctnpg._T.lqJaB', card) !== null,
+        response_from: firstText('.MFqgB', card),
+        response_text: firstText('.XCFtd', card),
+        response_date: firstAttribute('.vijoR', 'title', card),
+        user_url: firstHref('.MjDLG.VKCbE', card),
+        user_name_shown: firstText('.MjDLG.VKCbE', card),
+        user_info: all('.sIZXw.S2.H2.Ch.d', card).map(text)
+    };
+});
+"""
+
+
+# url of the first review of the page, to know when the review cards have been replaced after a click
+FIRST_REVIEW_URL_SCRIPT = _HELPERS + """
+const reviewLinkBox = one('.azLzJ.MI.Gi.z.Z.BB.kYVoW .joSMp.MI._S.b.S6.H5.Cj._a');
+return reviewLinkBox === null ? null : firstHref('.BMQDV._F.Gv.wSSLS.SwZTJ', reviewLinkBox);
+"""
+
+
+# cards of a search results page, same fields as html_extractors.extract_result_cards
+RESULT_PAGE_SCRIPT = _HELPERS + """
+return all('.listItem').map(card => ({
+    sponsored: one('.ngpKT.WywIO', card) !== null,
+    url: firstHref('.BMQDV._F.Gv.wSSLS.SwZTJ.FGwzt.ukgoS', card),
+    reviews_label: firstAttribute('.luFhX.o.W.f.u.w.JSdbl', 'aria-label', card),
+    rank: firstText('.nBrpc.Wd.o.W', card)
+}));
+"""
+
+
+# total results of a search results page, from the header like '1,834 properties in Rome'
+RESULTS_NUMBER_SCRIPT = """
+const match = document.body.innerText.match(/([0-9][0-9,]*)\\s+(properties|results)/i);
+return match === null ? null : match[1];
+"""
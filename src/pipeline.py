@@ -0,0 +1,208 @@
+import logging
+import multiprocessing
+import os
+import queue
+from run_utils import set_logging
+from db_writer import DbWriter
+from db_connection import get_connection
+from job_queue import JobQueue
+from migration import migrate
+from rate_limiter import RateLimiter
+from reparse import parse_page_source
+from _config import DB_FOLDER_PATH, REQUESTS_PER_MINUTE, REQUESTS_BURST
+
+
+# Pipeline: fetch, parse and write run as separate stages, connected by bounded queues.
+# Fetchers only load pages and put their sources in the page queue; parse processes turn them into rows;
+# a single writer commits the rows in batches, then updates the flags and completes the jobs of fully written hotels.
+# Rows are upserted as in reparse: flags and coordinates already in the db are kept (hotels are geocoded afterwards, by the geocode command).
+# When a queue is full the stage before it blocks, so a slow stage slows down the others instead of filling the memory
+
+
+def _get_queue_size(stage_queue):
+    """ Approximate size of a queue, -1 where not supported (macOS) """
+    try:
+        return stage_queue.qsize()
+    except NotImplementedError:
+        return -1
+
+def _run_fetcher(iterator_class, worker_id, page_queue, rate_limiter, counter_dict, test, log_file_name, db_name, iterator_kwargs):
+    """ Fetcher process. Runs an iterator in fetch only mode, with its own browser """
+    iterator = iterator_class(
+        test=test,
+        log_file_name=log_file_name.replace('.log', f'_fetcher_{worker_id}.log'),
+        db_name=db_name,
+        db_connection=True, # kept for the job queue
+        browser_driver=True,
+        worker_id=worker_id,
+        rate_limiter=rate_limiter,
+        **(iterator_kwargs or {})
+    )
+    iterator.fetch(_CountingQueue(page_queue, counter_dict['fetched']))
+    return
+
+def _run_parser(page_queue, row_queue, counter_dict, test, log_file_name):
+    """ Parse process. Turns page sources into rows. Job done messages are passed through to the writer """
+    set_logging(test, log_file_name)
+    while True:
+        message = page_queue.get()
+        if message is None: # all fetchers are done
+            break
+        if message['page_type'] != 'job_done':
+            try:
+                message['row_list'] = parse_page_source(message['page_type'], message.pop('page_source'), message['url'], message['hotel_id'], message['page_number'])
+            except Exception as e:
+                logging.error(f'Error parsing page: {message["url"]}')
+                logging.exception('An error occurred')
+                message['row_list'] = None
+            with counter_dict['parsed'].get_lock():
+                counter_dict['parsed'].value += 1
+        row_queue.put(message)
+    row_queue.put(None)
+    return
+
+def _run_writer(db_name, row_queue, parsers, counter_dict, batch_size, test, log_file_name):
+    """ Writer process. Commits rows in batches, then finishes the jobs whose pages are all written """
+    set_logging(test, log_file_name)
+    connection = get_connection(DB_FOLDER_PATH/db_name)
+    migrate(connection) # review stats triggers, before the first review is written
+    db_writer = DbWriter(connection)
+    job_queue_dict = {kind: JobQueue(DB_FOLDER_PATH/db_name, kind=kind) for kind in ['hotel', 'review']}
+    job_dict = {} # job attempt (job id, owner, lease token): pages written, failed pages, job done message
+    pending_message_list = [] # written since the last commit
+    pending_rows = 0
+    stopped_parsers = 0
+    logging.info('Started pipeline writer')
+    while stopped_parsers < parsers:
+        try:
+            message = row_queue.get(timeout=1)
+        except queue.Empty: # nothing coming, commit what's pending
+            message = 'flush'
+        if message is None:
+            stopped_parsers += 1
+        elif message != 'flush':
+            if message['page_type'] != 'job_done' and message['row_list'] is not None:
+                for table, column_value_dict in message['row_list']:
+                    db_writer.upsert_row(table, column_value_dict)
+                pending_rows += len(message['row_list'])
+            pending_message_list.append(message)
+        if pending_message_list != [] and (message in [None, 'flush'] or pending_rows >= batch_size):
+            try:
+                db_writer.flush()
+                with counter_dict['written'].get_lock():
+                    counter_dict['written'].value += pending_rows
+                logging.info(f'Committed {pending_rows} rows of {len(pending_message_list)} pages')
+            except Exception as e:
+                logging.error('Error committing rows, failing their jobs')
+                logging.exception('An error occurred')
+                for pending_message in pending_message_list:
+                    pending_message['row_list'] = None
+            finished_job_list = [job for job in (_track_job(pending_message, job_dict, connection) for pending_message in pending_message_list) if job is not None]
+            _finish_jobs(finished_job_list, job_queue_dict, db_writer)
+            pending_message_list, pending_rows = [], 0
+    for job_queue in job_queue_dict.values():
+        job_queue.close()
+    connection.close()
+    logging.info(f'Stopped pipeline writer. Changed rows: {db_writer.get_change_summary()}. Unfinished jobs: {list(job_dict.keys())}')
+    return
+
+def _track_job(message, job_dict, connection):
+    """
+    Count the written pages of a job attempt. When all its pages are written, return (job done message, success), None otherwise.
+    Pages are counted per claim of the job, as the pages of a failed attempt may still be in the queues when the job is claimed again
+    """
+    if message['job_id'] is None: # result pages, no job
+        return None
+    attempt = (message['job_id'], message['owner'], message['lease_token'])
+    job = job_dict.setdefault(attempt, {'pages': 0, 'failed_pages': 0, 'done': None})
+    if message['page_type'] == 'job_done':
+        job['done'] = message
+    elif message['row_list'] is None:
+        job['failed_pages'] += 1
+    else:
+        job['pages'] += 1
+    done = job['done']
+    if done is None or job['pages'] + job['failed_pages'] < done['pages']:
+        return None
+    for stale_attempt in [key for key in job_dict if key[0] == message['job_id']]: # this attempt, and failed ones left unfinished
+        del job_dict[stale_attempt]
+    if job['failed_pages'] > 0:
+        logging.error(f'Failed pages for hotel {done["hotel_id"]}')
+        return done, False
+    if done['kind'] == 'review': # same check as ReviewIterator, on the committed reviews
+        row = connection.execute('select REVIEWS from HOTEL_REVIEW_STATS where HOTEL_ID=?;', (done['hotel_id'],)).fetchone()
+        scraped_reviews_number = row[0] if row is not None else 0
+        if (scraped_reviews_number < done['reviews_number'] or scraped_reviews_number > done['reviews_number'] + 10):
+            logging.error(f'Missing reviews for hotel {done["hotel_id"]}: {scraped_reviews_number} of {done["reviews_number"]}')
+            return done, False
+    return done, True
+
+def _finish_jobs(finished_job_list, job_queue_dict, db_writer):
+    """ Update the flags of the finished jobs in one transaction, then complete them. Failed jobs are released without flag """
+    flag_column_dict = {'hotel': 'hotel_scraped_flag', 'review': 'reviews_scraped_flag'}
+    try:
+        for done, success in finished_job_list:
+            db_writer.update_flag('RESULT', flag_column_dict[done['kind']], 1, f'id={done["hotel_id"]}') if success else None
+        db_writer.flush()
+    except Exception as e:
+        logging.error('Error updating flags, failing the jobs')
+        logging.exception('An error occurred')
+        finished_job_list = [(done, False) for done, success in finished_job_list]
+    for done, success in finished_job_list:
+        if success:
+            job_queue_dict[done['kind']].complete(done['job_id'], owner=done['owner'])
+        else:
+            job_queue_dict[done['kind']].fail(done['job_id'], owner=done['owner'])
+    return
+
+
+class _CountingQueue:
+    """ Page queue of a fetcher, counting the fetched pages """
+
+    def __init__(self, page_queue, counter):
+        self.page_queue = page_queue
+        self.counter = counter
+        return
+
+    def put(self, message):
+        self.page_queue.put(message)
+        if message['page_type'] != 'job_done':
+            with self.counter.get_lock():
+                self.counter.value += 1
+        return
+
+
+def run_pipeline(iterator_class, fetchers=1, parsers=os.cpu_count(), requests_per_minute=REQUESTS_PER_MINUTE, burst=REQUESTS_BURST, test=True, log_file_name='test.log', db_name='test.db', queue_size=64, batch_size=500, report_seconds=30, iterator_kwargs=None):
+    """ Run the iterator as a fetch, parse, write pipeline. Queue depths and stage counters are logged every report_seconds """
+    set_logging(test, log_file_name)
+    logging.info(f'Starting pipeline: {iterator_class.__name__}, {fetchers} fetchers, {parsers} parsers, queue size {queue_size}')
+    rate_limiter = RateLimiter(requests_per_minute, burst)
+    page_queue = multiprocessing.Queue(maxsize=queue_size)
+    row_queue = multiprocessing.Queue(maxsize=queue_size)
+    counter_dict = {stage: multiprocessing.Value('i', 0) for stage in ['fetched', 'parsed', 'written']}
+    writer_process = multiprocessing.Process(target=_run_writer, args=(db_name, row_queue, parsers, counter_dict, batch_size, test, log_file_name), name='pipeline_writer')
+    writer_process.start()
+    parser_process_list = [multiprocessing.Process(target=_run_parser, args=(page_queue, row_queue, counter_dict, test, log_file_name), name=f'parser_{i}') for i in range(parsers)]
+    for parser_process in parser_process_list:
+        parser_process.start()
+    fetcher_process_list = [
+        multiprocessing.Process(
+            target=_run_fetcher,
+            args=(iterator_class, worker_id, page_queue, rate_limiter, counter_dict, test, log_file_name, db_name, iterator_kwargs),
+            name=f'fetcher_{worker_id}'
+        ) for worker_id in range(fetchers)
+    ]
+    for fetcher_process in fetcher_process_list:
+        fetcher_process.start()
+    # report stages until the fetchers are done
+    while any(fetcher_process.is_alive() for fetcher_process in fetcher_process_list):
+        for fetcher_process in fetcher_process_list:
+            fetcher_process.join(timeout=report_seconds / fetchers)
+        logging.info(f'Pipeline: fetched {counter_dict["fetched"].value} pages, page queue {_get_queue_size(page_queue)}, parsed {counter_dict["parsed"].value} pages, row queue {_get_queue_size(row_queue)}, written {counter_dict["written"].value} rows')
+    for parser_process in parser_process_list:
+        page_queue.put(None) # stop parsers, one message each
+    for parser_process in parser_process_list:
+        parser_process.join()
+    writer_process.join()
+    logging.info(f'Pipeline finished: fetched {counter_dict["fetched"].value} pages, parsed {counter_dict["parsed"].value} pages, written {counter_dict["written"].value} rows')
+    return
@@ -0,0 +1,72 @@
+import logging # settings inherited from the caller
+import multiprocessing
+import time
+from urllib.parse import urlparse
+from _config import RATE_LIMITED_DOMAIN_LIST, REQUESTS_PER_MINUTE, REQUESTS_BURST, MAX_BACKOFF
+
+
+class RateLimiter:
+    """
+    Token bucket per domain, shared by all the processes it is passed to. Tokens refill at requests_per_minute,
+    up to burst tokens; each page load takes one, waiting for it if the bucket is empty.
+    Errors and throttling slow the refill down (backoff multiplier), successful loads bring it back gradually
+    """
+
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, burst=REQUESTS_BURST, max_backoff=MAX_BACKOFF, domain_list=RATE_LIMITED_DOMAIN_LIST):
+        self.rate = requests_per_minute / 60 # tokens per second
+        self.burst = burst
+        self.max_backoff = max_backoff
+        self.lock = multiprocessing.Lock()
+        # bucket state of each domain, guarded by self.lock
+        self.tokens_dict = {domain: multiprocessing.Value('d', burst, lock=False) for domain in domain_list}
+        self.last_time_dict = {domain: multiprocessing.Value('d', time.time(), lock=False) for domain in domain_list}
+        self.backoff_dict = {domain: multiprocessing.Value('d', 1.0, lock=False) for domain in domain_list}
+        logging.info(f'Got rate limiter: {requests_per_minute} requests per minute, burst {burst}, on {domain_list}')
+        return
+
+    def _refill(self, domain, now):
+        """ Add the tokens accumulated since the last call, at the rate slowed down by the backoff. Call holding the lock """
+        tokens, last_time = self.tokens_dict[domain], self.last_time_dict[domain]
+        tokens.value = min(self.burst, tokens.value + (now - last_time.value) * self.rate / self.backoff_dict[domain].value)
+        last_time.value = now
+        return
+
+    def wait(self, url):
+        """ Take a token for a page load of the url domain, waiting if none is left. Urls of other domains are not limited """
+        domain = urlparse(url).netloc
+        if domain not in self.tokens_dict:
+            return
+        with self.lock: # take the token (possibly in advance, tokens below 0), then sleep outside the lock
+            now = time.time()
+            self._refill(domain, now)
+            self.tokens_dict[domain].value -= 1
+            time_to_sleep = max(0, -self.tokens_dict[domain].value * self.backoff_dict[domain].value / self.rate)
+        if time_to_sleep > 0:
+            logging.info(f'Rate limit on {domain}, waiting {time_to_sleep} seconds')
+            time.sleep(time_to_sleep)
+        return
+
+    def report_error(self, url, throttled=False):
+        """ Slow down the domain after a failed load. Throttling (429 like pages) also empties the bucket, pausing all workers """
+        domain = urlparse(url).netloc
+        if domain not in self.tokens_dict:
+            return
+        with self.lock:
+            self._refill(domain, time.time())
+            backoff = self.backoff_dict[domain]
+            backoff.value = min(self.max_backoff, backoff.value * (4 if throttled else 2))
+            if throttled:
+                self.tokens_dict[domain].value = min(0, self.tokens_dict[domain].value)
+        logging.warning(f'Rate limit on {domain} slowed down, backoff {backoff.value}x, throttled: {throttled}')
+        return
+
+    def report_success(self, url):
+        """ Bring the domain rate back towards the configured one, after a successful load """
+        domain = urlparse(url).netloc
+        if domain not in self.tokens_dict:
+            return
+        with self.lock:
+            if self.backoff_dict[domain].value > 1:
+                self._refill(domain, time.time()) # tokens accumulated so far count at the slower rate
+                self.backoff_dict[domain].value = max(1.0, self.backoff_dict[domain].value * 0.9)
+        return
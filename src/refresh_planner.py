@@ -0,0 +1,76 @@
+import logging
+from run_utils import set_logging
+from db_connection import get_connection
+from job_queue import JobQueue
+from _config import DB_FOLDER_PATH, DDL_FOLDER_PATH, REFRESH_RATING_WEIGHT, REFRESH_RANK_WEIGHT, REFRESH_MIN_RANK_CHANGE
+
+
+# Refresh planner: after a result iterator run, compare the latest listing snapshot of each hotel (RESULT_HISTORY,
+# filled by triggers on RESULT when the listing columns change) with the one of the previous plan. Only hotels whose
+# rating, reviews or rank changed are marked for re-scrape and enqueued, with a priority growing with the change:
+# the most changed are scraped first. Snapshots of planned hotels are flagged, and are the baseline of the next plan:
+# small moves of the other hotels add up until they reach the minimum
+
+
+def _get_changed_hotel_list(connection, min_rank_change):
+    """
+    Hotels whose latest snapshot differs from the planned one, as (id, rating change, reviews change, rank change, reviews scraped flag).
+    New hotels have no planned snapshot: they're scraped through their flags
+    """
+    return connection.execute("""
+        with LATEST as (select ID, max(HISTORY_ID) as HISTORY_ID from RESULT_HISTORY where PLANNED_FLAG=0 group by ID),
+        BASELINE as (select ID, max(HISTORY_ID) as HISTORY_ID from RESULT_HISTORY where PLANNED_FLAG=1 group by ID)
+        select CURRENT.ID, CURRENT.RATING-PREVIOUS.RATING, CURRENT.REVIEWS-PREVIOUS.REVIEWS, CURRENT.RANK-PREVIOUS.RANK, RESULT.REVIEWS_SCRAPED_FLAG
+        from LATEST
+        join BASELINE on BASELINE.ID=LATEST.ID
+        join RESULT_HISTORY as CURRENT on CURRENT.HISTORY_ID=LATEST.HISTORY_ID
+        join RESULT_HISTORY as PREVIOUS on PREVIOUS.HISTORY_ID=BASELINE.HISTORY_ID
+        join RESULT on RESULT.ID=LATEST.ID
+        where RESULT.HOTEL_PAGE_MISSING_FLAG=0 and (
+            CURRENT.RATING<>PREVIOUS.RATING or CURRENT.REVIEWS<>PREVIOUS.REVIEWS or abs(CURRENT.RANK-PREVIOUS.RANK)>=?
+        );
+    """, (min_rank_change,)).fetchall()
+
+def _get_priority(rating_change, reviews_change, rank_change, rating_weight, rank_weight):
+    """ Priority of a changed hotel: new reviews, plus rating and rank moves weighted as reviews. At least 1, above unplanned jobs """
+    return max(1, round(abs(reviews_change) + rating_weight * abs(rating_change) + rank_weight * abs(rank_change)))
+
+def run_refresh_plan(test=True, log_file_name='plan.log', db_name='test.db', rating_weight=REFRESH_RATING_WEIGHT, rank_weight=REFRESH_RANK_WEIGHT, min_rank_change=REFRESH_MIN_RANK_CHANGE):
+    """
+    Mark the changed hotels for re-scrape and enqueue them by priority: all of them as hotel jobs,
+    the ones with new reviews and reviews already scraped as review_refresh jobs too. Return the number of changed hotels
+    """
+    set_logging(test, log_file_name)
+    connection = get_connection(DB_FOLDER_PATH/db_name)
+    hotel_job_queue = JobQueue(DB_FOLDER_PATH/db_name, kind='hotel')
+    review_job_queue = JobQueue(DB_FOLDER_PATH/db_name, kind='review_refresh')
+    try:
+        connection.executescript((DDL_FOLDER_PATH / 'H_RESULT_HISTORY.sql').read_text())
+        snapshots = connection.execute('select count(distinct ID) from RESULT_HISTORY where PLANNED_FLAG=0;').fetchone()[0]
+        changed_hotel_list = _get_changed_hotel_list(connection, min_rank_change)
+        hotel_priority_list = sorted(
+            [(hotel_id, _get_priority(rating_change, reviews_change, rank_change, rating_weight, rank_weight)) for hotel_id, rating_change, reviews_change, rank_change, reviews_scraped_flag in changed_hotel_list],
+            key=lambda hotel_priority: hotel_priority[1],
+            reverse=True
+        )
+        logging.info(f'Changed hotels: {len(changed_hotel_list)} of {snapshots} hotels with new snapshots')
+        logging.info(f'Most changed hotels (id, priority): {hotel_priority_list[:10]}')
+        # mark, then enqueue: a hotel job claimed before the mark would set the flag back
+        connection.executemany('update RESULT set HOTEL_SCRAPED_FLAG=0 where ID=?;', [(hotel_id,) for hotel_id, priority in hotel_priority_list])
+        connection.executemany('update RESULT_HISTORY set PLANNED_FLAG=1 where ID=? and PLANNED_FLAG=0;', [(hotel_id,) for hotel_id, priority in hotel_priority_list])
+        connection.execute('update RESULT_HISTORY set PLANNED_FLAG=1 where PLANNED_FLAG=0 and ID not in (select ID from RESULT_HISTORY where PLANNED_FLAG=1);') # baseline of new hotels
+        connection.commit()
+        hotel_job_queue.enqueue_hotels(hotel_priority_list)
+        review_priority_dict = dict(hotel_priority_list)
+        review_job_queue.enqueue_hotels([(hotel_id, review_priority_dict[hotel_id]) for hotel_id, rating_change, reviews_change, rank_change, reviews_scraped_flag in changed_hotel_list if reviews_change > 0 and reviews_scraped_flag == 1])
+    except Exception as e:
+        connection.rollback()
+        logging.error('Error planning refresh')
+        logging.exception('An error occurred')
+        raise e
+    finally:
+        hotel_job_queue.close()
+        review_job_queue.close()
+        connection.close()
+    logging.info('Planned refresh')
+    return len(changed_hotel_list)
@@ -0,0 +1,87 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from run_utils import set_logging, get_hashed_id
+from db_connection import get_connection
+from db_writer import DbWriter
+from migration import migrate
+from page_archive import PageArchive, load_page_source
+from html_extractors import extract_hotel_document, extract_review_cards, extract_result_cards
+from page_parsers import parse_hotel_document, parse_review_card, parse_result_card
+from _config import DB_FOLDER_PATH
+
+
+# Offline re-parse: rebuild HOTEL, REVIEW, USER and RESULT rows from the page archive, without loading any page.
+# Pages are parsed by a process pool, rows are written by the main process. Rows are upserted: columns not
+# coming from the page (flags, coordinates, languages, timestamps) are kept
+
+
+def parse_page_source(page_type, page_source, url, hotel_id=-1, page_number=-1):
+    """ Parse a page source into (table, row dict) couples. Used by reparse and by the pipeline parse stage. Review languages are left to the language detection stage """
+    row_list = []
+    if page_type == 'hotel':
+        hotel_dict = parse_hotel_document(extract_hotel_document(page_source))
+        hotel_dict['id'] = hotel_id
+        hotel_dict['url'] = url
+        row_list.append(('HOTEL', hotel_dict))
+    elif page_type == 'review':
+        for card in extract_review_cards(page_source):
+            review_dict, user_dict = parse_review_card(card)
+            user_dict['id'] = get_hashed_id(user_dict['url'])
+            review_dict['id'] = get_hashed_id(review_dict['url'])
+            review_dict['user_id'] = user_dict['id']
+            review_dict['hotel_id'] = hotel_id
+            row_list.append(('REVIEW', review_dict))
+            row_list.append(('USER', user_dict))
+    elif page_type == 'result':
+        for card in extract_result_cards(page_source):
+            result_dict, result_sponsored_flag = parse_result_card(card, page_number)
+            if result_sponsored_flag == True:
+                continue
+            result_dict['id'] = get_hashed_id(result_dict['url'])
+            row_list.append(('RESULT', result_dict))
+    return row_list
+
+def _parse_archived_page(page_type, url, hotel_id, page_number, content_path):
+    """ Parse an archived page. Run in the pool processes """
+    return parse_page_source(page_type, load_page_source(content_path), url, hotel_id, page_number)
+
+def _parse_archived_page_safely(args):
+    """ Parse an archived page, logging errors instead of stopping the pool. Return (url, row list or None) """
+    try:
+        return args[1], _parse_archived_page(*args)
+    except Exception as e:
+        logging.error(f'Error parsing archived page: {args[1]}')
+        logging.exception('An error occurred')
+        return args[1], None
+
+def run_reparse(page_type_list=('result', 'hotel', 'review'), processes=os.cpu_count(), test=True, log_file_name='reparse.log', db_name='test.db', commit_every=500):
+    """ Rebuild the tables from the archived pages of the given types """
+    set_logging(test, log_file_name)
+    page_archive = PageArchive()
+    connection = get_connection(DB_FOLDER_PATH/db_name)
+    migrate(connection) # review stats triggers, before the first review is written
+    db_writer = DbWriter(connection)
+    try:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            for page_type in page_type_list:
+                args_list = [(page_type, url, hotel_id, page_number, page_archive.get_content_path(content_hash)) for page_id, url, hotel_id, page_number, content_hash in page_archive.get_index_rows(page_type)]
+                logging.info(f'Reparsing {len(args_list)} archived pages: {page_type}')
+                parsed_pages, failed_pages = 0, 0
+                for url, row_list in executor.map(_parse_archived_page_safely, args_list, chunksize=32):
+                    if row_list is None:
+                        failed_pages += 1
+                        continue
+                    for table, column_value_dict in row_list:
+                        db_writer.upsert_row(table, column_value_dict)
+                    parsed_pages += 1
+                    if parsed_pages % commit_every == 0:
+                        db_writer.flush()
+                        logging.info(f'Reparsed {parsed_pages} pages: {page_type}')
+                db_writer.flush()
+                logging.info(f'Reparsed {parsed_pages} pages, {failed_pages} failed: {page_type}')
+        logging.info(f'Changed rows: {db_writer.get_change_summary()}')
+    finally:
+        page_archive.close()
+        connection.close()
+    return
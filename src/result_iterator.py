@@ -1,5 +1,14 @@
 import logging # settings inherited from base_iterator
+import functools
+import math
+import re
+import time
 from base_iterator import BaseIterator
+from job_queue import JobQueue
+from migration import migrate
+from page_scripts import RESULT_PAGE_SCRIPT, RESULTS_NUMBER_SCRIPT
+from page_parsers import parse_result_card
+from _config import DB_FOLDER_PATH, DDL_FOLDER_PATH
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By 
@@ -9,23 +18,17 @@ from selenium.webdriver.common.by import By
 class ResultIterator(BaseIterator):
     """ Iterator to scrape search results """
     url_template = 'https://www.tripadvisor.com/Hotels-g187791-oa{}-Rome_Lazio-Hotels.html'
+    results_per_page = 30
+    listing_reset_seconds = 3600 # a listing finished less than this ago is not enqueued again, by workers starting late
 
-    def __init__(self, **kwargs):
+    def __init__(self, refresh=False, **kwargs):
         super().__init__(**kwargs) # pass all arguments to parent class
+        self.refresh = refresh # read all the pages, also without new results, to snapshot the whole listing
         self.continue_flag = False
         self.continue_flag_retries = 0
         self.page_number = -1
-        self.result_element = None
-        self.result_sponsored_flag = False
-        # attributes that go in the db
-        self.result_dict = {
-            'id': None,
-            'rating': None,
-            'reviews': None,
-            'url': None,
-            'page': None,
-            'rank': None
-        }
+        self.page_job_id = None
+        self.page_job_queue = None
         logging.info('Completed subclass initialization')
         return
     
@@ -71,53 +74,135 @@ class ResultIterator(BaseIterator):
             logging.info('-'*50)
             return True
 
-    def _scrape_result(self):
-        """ Scrape result element """
-        self.result_sponsored_flag = self.result_element.find_elements('class name', 'ngpKT.WywIO') != []
-        self.result_dict['url'] = self.result_element.find_element('class name', 'BMQDV._F.Gv.wSSLS.SwZTJ.FGwzt.ukgoS').get_attribute('href').split('?')[0]
-        self.result_dict['id'] = self._get_hashed_id(self.result_dict['url'])
-        self.result_dict['reviews'] = self.result_element.find_element('class name', 'luFhX.o.W.f.u.w.JSdbl').get_attribute('aria-label').split(' ')[-2].replace(',', '')
-        self.result_dict['rating'] = self.result_element.find_element('class name', 'luFhX.o.W.f.u.w.JSdbl').get_attribute('aria-label').split(' ')[0] if self.result_dict['reviews'] != '0' else -1
-        self.result_dict['rank'] = self.result_element.find_element('class name', 'nBrpc.Wd.o.W').text.split(' ')[0].replace('.', '') if self.result_sponsored_flag == False else -1
-        self.result_dict['page'] = self.page_number
-        logging.info('Scraped result')
-        for key, value in self.result_dict.items():
-            logging.info(f'{key}: {value}')
-        return
-
-    def _check_if_new_result(self):
-        """ Check if result is already in db, change new_result_flag if so """
-        if self.cursor.execute(f'select count(*)>0 from RESULT where id={self.result_dict["id"]}').fetchone()[0]: # id already in db
-            self.new_result_flag = False
-            logging.info('Set new_result_flag to False')
-        else:
-            self.new_result_flag = True
-            logging.info('Set new_result_flag to True')
+    def _scrape_result_page(self):
+        """ Read all the cards of the page at once, returning the RESULT rows of the non sponsored ones """
+        result_dict_list = []
+        for card in self.driver.execute_script(RESULT_PAGE_SCRIPT):
+            result_dict, result_sponsored_flag = parse_result_card(card, self.page_number)
+            if result_sponsored_flag == True:
+                logging.info('Sponsored result, skipping')
+                continue
+            result_dict['id'] = self._get_hashed_id(result_dict['url'])
+            result_dict_list.append(result_dict)
+        logging.info(f'Scraped {len(result_dict_list)} results')
+        return result_dict_list
+
+    def _get_new_result_id_set(self, result_dict_list):
+        """ Ids of the results not in the db yet, with a single lookup of the page ids. Results written but not committed yet are known too """
+        result_id_list = [result_dict['id'] for result_dict in result_dict_list]
+        if result_id_list == []:
+            return set()
+        placeholders = ', '.join(['?'] * len(result_id_list))
+        known_result_id_set = {row[0] for row in self.cursor.execute(f'select ID from RESULT where ID in ({placeholders});', result_id_list)}
+        known_result_id_set |= self.db_writer.get_pending_key_set('RESULT') # in the write-behind buffer
+        new_result_id_set = set(result_id_list) - known_result_id_set
+        logging.info(f'New results in page: {len(new_result_id_set)} of {len(result_id_list)}')
+        return new_result_id_set
+
+    def _write_result_page(self):
+        """
+        Scrape the results of the page and write them. Return the number of results and of new results.
+        Without a worker pool the page is committed before going on, as there's no job to scrape it again if its commit fails
+        """
+        self._archive_page('result', page_number=self.page_number)
+        result_dict_list = self._scrape_result_page()
+        new_result_id_set = self._get_new_result_id_set(result_dict_list)
+        for result_dict in result_dict_list:
+            self.db_writer.upsert_row('RESULT', result_dict) # flags of known results are kept
+        self.db_writer.flush(force=self.worker_id is None)
+        logging.info('Wrote results of page')
+        return len(result_dict_list), len(new_result_id_set)
+
+    def _sub_iterate_result(self):
+        """
+        Scrape and write the results of the page. Set continue_flag to True if there are new results (any result, in refresh mode):
+        at least one, continue page iteration; none, stop page iteration. A failed commit of the page retries it
+        """
+        try:
+            results, new_results = self._write_result_page()
+            self.continue_flag = new_results > 0 or (self.refresh == True and results > 0)
+            logging.info(f'continue_flag: {self.continue_flag}')
+        except Exception as e:
+            logging.error('Error scraping or writing results of page')
+            logging.exception('An error occurred')
         return
     
-    def _update_continue_flag(self):
-        """ 
-        Set continue_flag to True if there are new results. 
-        At least one new result in the page: continue page iteration. No new results in page: stop page iteration 
+
+    # offset pages (worker pool)
+
+    @staticmethod
+    def _get_listing_page_number(url):
+        """ Page number of a listing page url, from its offset """
+        return int(re.search(r'-oa(\d+)-', url).group(1)) // ResultIterator.results_per_page
+
+    def _get_results_number(self):
+        """ Total results of the listing, from the header of the page """
+        results_number = self.driver.execute_script(RESULTS_NUMBER_SCRIPT)
+        if results_number is None:
+            raise ValueError('Missing results number in page')
+        logging.info(f'Results of the listing: {results_number}')
+        return int(results_number.replace(',', ''))
+
+    def _scrape_listing_job(self):
+        """
+        Scrape the first page of the listing and read its total results, then enqueue all the other pages by offset,
+        to be scraped by the whole pool. The listing job waits for its pages
         """
-        if (self.new_result_flag == True and self.continue_flag == False):
-            self.continue_flag = True
-            logging.info('Set continue_flag to True')
+        self.page_number = 0
+        self.url = ResultIterator.url_template.format(0)
+        self._setup_page()
+        pages = math.ceil(self._get_results_number() / ResultIterator.results_per_page)
+        results, new_results = self._write_result_page()
+        if results == 0:
+            raise RuntimeError('No results in the first page of the listing')
+        self.db_writer.flush(force=True) # first page committed before the listing waits on the other pages
+        self.page_job_queue.enqueue_urls(-1, [ResultIterator.url_template.format(page_number * ResultIterator.results_per_page) for page_number in range(1, pages)], priority=1)
+        self.job_queue.park(self.job_id)
+        logging.info(f'Enqueued {pages - 1} listing pages')
+        self._finish_listing_if_done()
         return
-    
-    def _sub_iterate_result(self):
-        """ Iterate over search results in the page """
-        for self.result_element in self.driver.find_elements('class name', 'listItem'):
-            self._scrape_result()
-            self._check_if_new_result()
-            if self.result_sponsored_flag == True:
-                logging.info('Sponsored result, skipping')
-                continue
-            self._insert_replace_row(table='RESULT', column_value_dict=self.result_dict)
-            self._update_continue_flag()
-        logging.info('Iterated all results')
+
+    def _scrape_page_job(self, listing_page_url):
+        """ Scrape a listing page claimed from the page jobs. A page without results is failed, and retried """
+        self.page_number = self._get_listing_page_number(listing_page_url)
+        self.url = listing_page_url
+        self._setup_page()
+        results, new_results = self._write_result_page()
+        if results == 0:
+            raise RuntimeError(f'No results in listing page {self.page_number}')
+        self.db_writer.after_commit(functools.partial(self._finish_page_job, self.page_job_id))
+        self.db_writer.flush()
+        return
+
+    def _finish_page_job(self, page_job_id):
+        """ Complete a page job once its results are committed, and finish the listing if it was the last page """
+        self.page_job_queue.complete(page_job_id)
+        self._finish_listing_if_done()
         return
-    
+
+    def _fail_page_job(self, page_job_id):
+        """ Fail a page job, and finish the listing if it failed for good and was the last page """
+        self.page_job_queue.fail(page_job_id)
+        self._finish_listing_if_done()
+        return
+
+    def _finish_listing_if_done(self):
+        """
+        If no page of the listing is left, finish the waiting listing job. Failed pages are logged: the pages of this listing
+        only, failed since the listing job was parked. Failed pages of earlier listings keep their older timestamp
+        """
+        if self.page_job_queue.count_open(-1) > 0:
+            return
+        failed_pages = self.page_job_queue.connection.execute("""
+            select count(*) from JOB
+            where KIND=? and HOTEL_ID=-1 and STATE='failed'
+            and INSERT_UPDATE_TIMESTAMP>=(select max(INSERT_UPDATE_TIMESTAMP) from JOB where KIND=? and HOTEL_ID=-1 and STATE='waiting');
+        """, (self.page_job_queue.kind, self.job_queue.kind)).fetchone()[0]
+        logging.error(f'Failed listing pages: {failed_pages}') if failed_pages > 0 else None
+        self.job_queue.finish_waiting(-1, success=True)
+        logging.info('Finished listing')
+        return
+
 
     # page setup (get page, click button)
 
@@ -127,29 +212,93 @@ class ResultIterator(BaseIterator):
         while retries < 5:
             try:
                 self._get_page()
-                self._wait_humanly()
-                self._click_seeall_button()
-                self._wait_humanly()
-                # self._check_page()
+                self._click_seeall_button() # waits for the button to be clickable
+                self._check_page(class_to_check='listItem')
                 logging.info('Setup page')
                 break
             except Exception as e:
                 retries += 1
                 logging.error(f'Page not setup: error getting page or clicking button, retry {retries}')
                 logging.exception('An error occurred')
-                self._wait_humanly()
                 continue        
         return
     
 
     # run method (pages iteration)
 
+    def _setup_tables(self, connection):
+        """ Migrate the db, and create the result history with its triggers, before the first result is written """
+        migrate(connection) # fingerprint columns, unchanged results are not rewritten
+        connection.executescript((DDL_FOLDER_PATH / 'H_RESULT_HISTORY.sql').read_text())
+        return
+
     def _subclass_run(self):
-        """ Iterate over search results pages """
+        """
+        Iterate over search results pages. Every result written is a snapshot in RESULT_HISTORY, for the refresh planner.
+        In a worker pool, pages are scraped concurrently by offset, the whole listing
+        """
+        if self.worker_id is not None:
+            self._subclass_run_pages()
+            return
         while True:
             self._increase_page()
             self._setup_page()
             self._sub_iterate_result()
             if self._continue_not_stop() is False: 
                 break
-        return
\ No newline at end of file
+        return
+
+    def _subclass_run_pages(self):
+        """
+        Iterate over the listing pages by offset, in a worker pool. A worker claims the listing job, reads the total results
+        from the first page and enqueues the other pages; all workers then claim pages until none is left.
+        Workers wait while the listing job is being read, as its pages are not enqueued yet
+        """
+        self.job_queue = JobQueue(DB_FOLDER_PATH/self.db_name, kind='result')
+        self.page_job_queue = JobQueue(DB_FOLDER_PATH/self.db_name, kind='result_page')
+        self.job_queue.enqueue_urls(-1, [ResultIterator.url_template.format(0)], reset_after_seconds=ResultIterator.listing_reset_seconds, page_kind='result_page')
+        while True:
+            try:
+                self.job_id, self.page_job_id = None, None # not failing the previous jobs if a claim fails
+                self.page_job_id, hotel_id, listing_page_url = self.page_job_queue.claim()
+                if self.page_job_id is not None:
+                    self._scrape_page_job(listing_page_url)
+                    continue
+                self.job_id, hotel_id, listing_url = self.job_queue.claim()
+                if self.job_id is not None:
+                    self._scrape_listing_job()
+                    continue
+                if self.job_queue.count_open(-1) == 0: # listing read by nobody, and its pages all claimed
+                    logging.info('No more listing pages to scrape')
+                    break
+                logging.info('Waiting for the listing pages to be enqueued')
+                time.sleep(5)
+            except Exception as e:
+                logging.error('Error iterating listing or listing page, going to next job')
+                logging.exception('An error occurred')
+                self._fail_page_job(self.page_job_id) if self.page_job_id is not None else None
+                self.job_queue.fail(self.job_id) if self.job_id is not None else None
+                continue
+        logging.info('Iterated all listing pages. Done')
+        return
+
+    def _subclass_fetch(self, page_queue):
+        """
+        Iterate over search results pages, putting them in the pipeline instead of scraping them.
+        New results are known only after writing, so pages are fetched until a page has no results (as in refresh mode)
+        """
+        while True:
+            self._increase_page()
+            self._setup_page()
+            self.continue_flag = self.driver.find_elements('class name', 'listItem') != []
+            if self.continue_flag == True:
+                self._put_snapshot(page_queue, 'result', page_number=self.page_number)
+            if self._continue_not_stop() is False:
+                break
+        return
+
+    def _quit(self):
+        """ Close the page job queue too """
+        self.page_job_queue.close() if self.page_job_queue is not None else None
+        super()._quit()
+        return
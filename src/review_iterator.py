@@ -1,12 +1,16 @@
 import logging # settings inherited from base_iterator
-import time
+import functools
+import math
+import re
 from base_iterator import BaseIterator
+from job_queue import JobQueue
+from migration import migrate
+from page_scripts import REVIEW_PAGE_SCRIPT, FIRST_REVIEW_URL_SCRIPT
+from page_parsers import parse_review_card
+from _config import DB_FOLDER_PATH, DDL_FOLDER_PATH
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.by import By
 from selenium.common.exceptions import TimeoutException
-from langdetect import detect
-from langdetect.lang_detect_exception import LangDetectException
 
 
 
@@ -14,17 +18,21 @@ from langdetect.lang_detect_exception import LangDetectException
 
 class ReviewIterator(BaseIterator):
     """ Iterator to scrape reviews """
-    months_short_dict = {'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6, 'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12}
-    months_long_dict = {'january': 1, 'february': 2, 'march': 3, 'april': 4, 'may': 5, 'june': 6, 'july': 7, 'august': 8, 'september': 9, 'october': 10, 'november': 11, 'december': 12}
+    reviews_per_page = 10
 
-    def __init__(self, **kwargs):
+    def __init__(self, incremental=False, **kwargs):
         super().__init__(**kwargs)
-        self.continue_hotel_flag = True
+        self.incremental = incremental # refresh scraped hotels, newest reviews first, until the already known ones
+        self.new_reviews_number = None
+        self.job_id = None
+        self.page_job_id = None
+        self.page_number = None
+        self.page_job_queue = None
+        self.all_languages_flag = False # set once per browser session, kept by the site for the next pages
         self.hotel_id = None
         self.hotel_url = None
         self.hotel_page_reviews_number = None
         self.hotel_scraped_reviews_number = None
-        self.comment_box = None
         # attributes that go in the db
         self.review_dict = {
             'id': None,
@@ -38,11 +46,9 @@ class ReviewIterator(BaseIterator):
             'year_of_stay': None,
             'likes': None,
             'pics_flag': None,
-            'language': None,
             'response_from': None,
             'response_text': None,
             'response_date': None,
-            'response_language': None,
             'user_id': None,
             'hotel_id': None
         }
@@ -70,9 +76,10 @@ class ReviewIterator(BaseIterator):
         logging.info(f'Hotel page reviews number: {self.hotel_page_reviews_number}')
         return
     
-    def _get_hotel_scraped_reviews_number(self):
-        """ Get hotel scraped reviews number from db """
-        self.hotel_scraped_reviews_number = self.cursor.execute(f'select count(*) from REVIEW where hotel_id={self.hotel_id}').fetchone()[0]
+    def _get_hotel_scraped_reviews_number(self, hotel_id):
+        """ Get hotel scraped reviews number from db, kept in HOTEL_REVIEW_STATS by triggers """
+        row = self.cursor.execute('select REVIEWS from HOTEL_REVIEW_STATS where HOTEL_ID=?;', (hotel_id,)).fetchone()
+        self.hotel_scraped_reviews_number = row[0] if row is not None else 0
         logging.info(f'Hotel scraped reviews number: {self.hotel_scraped_reviews_number}')
         return
 
@@ -82,84 +89,50 @@ class ReviewIterator(BaseIterator):
 
     # actual scraping
 
-    def _increase_review_page(self):
-        """ Increase page. If button not found, set continue_hotel_flag to False, to go to next hotel """
-        retries = 0
-        while retries < 3:
-            try:
-                wait = WebDriverWait(self.driver, 0.5)
-                wait.until(EC.element_to_be_clickable((By.XPATH, "//a[@aria-label='Next page']"))).click()
-                logging.info('Clicked Next Page button')
-                self._wait_humanly()
-                self._check_page(class_to_check='azLzJ.MI.Gi.z.Z.BB.kYVoW') # wait for comment boxes to load
-                self.continue_hotel_flag = True # reset flag to True when button is pressed
-                break
-            except TimeoutException:
-                retries += 1
-                logging.info(f'Next page button not found, retry: {retries}')
-                self.continue_hotel_flag = False # set flag to False when button is not found
-                continue
-            except Exception as e:
-                retries += 1
-                logging.error('Error')
-                logging.exception('An error occurred')
-                self._wait_humanly()
-                self.continue_hotel_flag = False # set flag to False when an error occurs
-                continue
+    def _wait_review_cards_changed(self, previous_review_url, timeout=30):
+        """ Wait for the review cards to be replaced after a click, waiting on the first review url instead of a fixed time """
+        WebDriverWait(self.driver, timeout).until(lambda driver: driver.execute_script(FIRST_REVIEW_URL_SCRIPT) not in (previous_review_url, None))
+        logging.info('Review cards changed')
         return
 
-    def _scrape_single_review(self):
-        """ Scrape single review """
+    @staticmethod
+    def _get_review_page_url(hotel_url, page_number):
+        """ Url of a review page, by offset: page 0 is the hotel url, page n has '-Reviews-or{10*n}-' """
+        if page_number == 0:
+            return hotel_url
+        return hotel_url.replace('-Reviews-', f'-Reviews-or{page_number * ReviewIterator.reviews_per_page}-', 1)
+
+    @staticmethod
+    def _get_review_page_number(review_page_url):
+        """ Page number of a review page url, from its offset """
+        offset = re.search(r'-Reviews-or(\d+)-', review_page_url)
+        return int(offset.group(1)) // ReviewIterator.reviews_per_page if offset is not None else 0
+
+    @staticmethod
+    def _get_hotel_url(review_page_url):
+        """ Hotel url of a review page url, removing the offset """
+        return re.sub(r'-Reviews-or\d+-', '-Reviews-', review_page_url, count=1)
+
+    def _get_review_pages_number(self):
+        """ Number of review pages of the hotel, from the reviews number of the page """
+        return max(1, math.ceil(self.hotel_page_reviews_number / self.reviews_per_page))
+
+    def _extract_review_cards(self):
+        """ Extract all the review cards of the page, with a single script call to the driver """
+        card_list = self.driver.execute_script(REVIEW_PAGE_SCRIPT)
+        logging.info(f'Extracted {len(card_list)} review cards')
+        return card_list
+
+    def _scrape_single_review(self, card):
+        """ Scrape single review, from its card extracted from the page. Languages are left null, for the language detection stage """
         # review
         try:
-            self.review_dict['url'] = self.comment_box.find_element('class name', 'joSMp.MI._S.b.S6.H5.Cj._a').find_element('class name', 'BMQDV._F.Gv.wSSLS.SwZTJ').get_attribute('href')
+            review_dict, user_dict = parse_review_card(card)
+            self.review_dict.update(review_dict)
+            self.user_dict.update(user_dict)
             self.review_dict['id'] = self._get_hashed_id(self.review_dict['url'])
-            self.review_dict['title'] = self.comment_box.find_element('class name', 'JbGkU.Cj').text
-            self.review_dict['text'] = self.comment_box.find_element('class name', 'orRIx.Ci._a.C').text
-            self.review_dict['rating'] = self.comment_box.find_element('class name', 'IaVba.F1').text.split(' ')[0]
-            if 'today' in self.comment_box.find_element('class name', 'ScwkD._Z.o.S4.H3.Ci').text.lower():
-                review_date = self.comment_box.find_element('class name', 'ScwkD._Z.o.S4.H3.Ci').text.lower()
-                self.review_dict['month_of_review'] = time.strftime('%m')
-                self.review_dict['year_of_review'] = time.strftime('%Y')
-            elif 'yesterday' in self.comment_box.find_element('class name', 'ScwkD._Z.o.S4.H3.Ci').text.lower():
-                review_date = self.comment_box.find_element('class name', 'ScwkD._Z.o.S4.H3.Ci').text.lower()
-                yesterday = time.strftime('%Y-%m-%d', time.localtime(time.time() - 86400))
-                self.review_dict['month_of_review'] = yesterday.split('-')[1]
-                self.review_dict['year_of_review'] = yesterday.split('-')[0]
-            else: # standard case, month and year
-                review_date = self.comment_box.find_element('class name', 'ScwkD._Z.o.S4.H3.Ci').text
-                self.review_dict['month_of_review'] = ReviewIterator.months_short_dict[self.comment_box.find_element('class name', 'ScwkD._Z.o.S4.H3.Ci').text.split(' ')[-2].lower()]
-                self.review_dict['year_of_review'] = self.comment_box.find_element('class name', 'ScwkD._Z.o.S4.H3.Ci').text.split(' ')[-1]
-                if int(self.review_dict['year_of_review']) < 2000: # if year is less than 2000, the scraper got the day of the month. It happens when the review is from the current month, so set the year to current year
-                    self.review_dict['year_of_review'] = time.strftime('%Y')
-            review_date_of_stay = self.comment_box.find_element('class name', 'iSNGb._R.Me.S4.H3.Cj').text if self.comment_box.find_elements('class name', 'iSNGb._R.Me.S4.H3.Cj') != [] else 'NA'
-            self.review_dict['month_of_stay'] = ReviewIterator.months_long_dict[self.comment_box.find_element('class name', 'iSNGb._R.Me.S4.H3.Cj').text.split(': ')[-1].split(' ')[-2].lower()] if self.comment_box.find_elements('class name', 'iSNGb._R.Me.S4.H3.Cj') != [] else -1
-            self.review_dict['year_of_stay'] = self.comment_box.find_element('class name', 'iSNGb._R.Me.S4.H3.Cj').text.split(': ')[-1].split(' ')[-1] if self.comment_box.find_elements('class name', 'iSNGb._R.Me.S4.H3.Cj') != [] else -1
-            self.review_dict['likes'] = self.comment_box.find_element('class name', 'biGQs._P.FwFXZ').text
-            self.review_dict['pics_flag'] = True if self.comment_box.find_elements('class name', 'Ctnpg._T.lqJaB') != [] else False
-            self.review_dict['language'] = detect(self.review_dict['text'])
-            # review response
-            self.review_dict['response_from'] = self.comment_box.find_element('class name', 'MFqgB').text if self.comment_box.find_elements('class name', 'MFqgB') else None
-            self.review_dict['response_text'] = self.comment_box.find_element('class name', 'XCFtd').text if self.comment_box.find_elements('class name', 'XCFtd') else None
-            self.review_dict['response_date'] = self.comment_box.find_element('class name', 'vijoR').get_attribute('title') if self.comment_box.find_elements('class name', 'vijoR') else None
-            try: # for cases like '...' (happens surprisingly often)
-                self.review_dict['response_language'] = detect(self.review_dict['response_text']) if self.review_dict['response_text'] else None
-            except LangDetectException as e:
-                logging.error('Error detecting response language')
-                logging.exception('An error occurred')
-                self.review_dict['response_language'] = None
             # review user
-            self.user_dict['url'] = self.comment_box.find_element('class name', 'MjDLG.VKCbE').get_attribute('href')
             self.user_dict['id'] = self._get_hashed_id(self.user_dict['url'])
-            self.user_dict['name'] = self.comment_box.find_element('class name', 'MjDLG.VKCbE').get_attribute('href').split('Profile/')[-1]
-            self.user_dict['name_shown'] = self.comment_box.find_element('class name', 'MjDLG.VKCbE').text
-            for review_user_info in self.comment_box.find_elements('class name', 'sIZXw.S2.H2.Ch.d'):
-                if 'contribution' in review_user_info.text:
-                    self.user_dict['contributions'] = review_user_info.text.split(' ')[0].replace(',', '')
-                elif 'helpful vote' in review_user_info.text:
-                    self.user_dict['helpful_votes'] = review_user_info.text.split(' ')[0].replace(',', '')
-                else:
-                    self.user_dict['location'] = review_user_info.text
             self.review_dict['user_id'] = self.user_dict['id']
             self.review_dict['hotel_id'] = self.hotel_id
             # log
@@ -185,31 +158,136 @@ class ReviewIterator(BaseIterator):
         while retries < 10: # retries for the whole page
             try: # catch errors for not loading comment boxes (not caught in the inner functions), and propagated inner errors
                 self._check_page(class_to_check='azLzJ.MI.Gi.z.Z.BB.kYVoW') # wait for comment boxes to load
-                comment_boxes = self.driver.find_elements('class name', 'azLzJ.MI.Gi.z.Z.BB.kYVoW')
-                for self.comment_box in comment_boxes:
+                self._archive_page('review', hotel_id=self.hotel_id, page_number=self.page_number)
+                card_list = self._extract_review_cards()
+                if self.incremental: # before writing, the reviews of the page are all new
+                    self.new_reviews_number = self._get_new_reviews_number(card_list)
+                for card in card_list:
                     self._reset_dict(self.review_dict)
                     self._reset_dict(self.user_dict)
-                    self._scrape_single_review()
-                    self._insert_replace_row(table='REVIEW', column_value_dict=self.review_dict, commit=False)
+                    self._scrape_single_review(card)
+                    self.db_writer.upsert_row('REVIEW', self.review_dict) # upserted, for the review stats triggers. Languages are kept
                     self._insert_replace_row(table='USER', column_value_dict=self.user_dict, commit=False)
                     logging.info('-'*50)
-                self.connection.commit() # commit the whole page at the end
-                logging.info('Scraped review page. Committed reviews and users insert or replace to db')
+                if not self.incremental: # refresh pages are not part of a full scrape
+                    self._insert_replace_row(table='REVIEW_CHECKPOINT', column_value_dict=self._get_checkpoint_dict(len(card_list)), commit=False)
+                self.db_writer.flush() # end of the page, committed with its checkpoint by the write-behind buffer
+                logging.info('Scraped review page. Wrote reviews and users to db')
                 break
             except Exception as e:
                 retries += 1
                 logging.error(f'Error checking or loading review page, retry: {retries}')
                 logging.exception('An error occurred')
-                self._wait_humanly()
                 continue
+        else: # retries exhausted
+            raise RuntimeError(f'Review page not scraped: {self.url}')
         return
 
-    def _sub_iterate_reviews_pages(self):
-        """ Iterate over reviews pages """
-        while self.continue_hotel_flag == True:
+    def _get_new_reviews_number(self, card_list):
+        """ Number of reviews of the page not in the db yet, with a single lookup of their ids. Reviews written but not committed yet are known too """
+        review_id_list = [self._get_hashed_id(card['url']) for card in card_list if card['url'] is not None]
+        if review_id_list == []:
+            return 0
+        placeholders = ', '.join(['?'] * len(review_id_list))
+        known_review_id_set = {row[0] for row in self.cursor.execute(f'select ID from REVIEW where ID in ({placeholders});', review_id_list)}
+        known_review_id_set |= self.db_writer.get_pending_key_set('REVIEW') # in the write-behind buffer
+        new_reviews_number = len(set(review_id_list) - known_review_id_set)
+        logging.info(f'New reviews in page: {new_reviews_number} of {len(review_id_list)}')
+        return new_reviews_number
+
+    def _get_checkpoint_dict(self, reviews):
+        """ Checkpoint of the current page, written in the same transaction as its reviews """
+        return {'hotel_id': self.hotel_id, 'page_number': self.page_number, 'review_offset': self.page_number * self.reviews_per_page, 'reviews': reviews}
+
+    def _get_checkpoint_page_number_set(self):
+        """ Pages of the hotel already committed, by a previous run stopped halfway """
+        return {row[0] for row in self.cursor.execute('select PAGE_NUMBER from REVIEW_CHECKPOINT where HOTEL_ID=?;', (self.hotel_id,))}
+
+    def _scrape_first_page(self):
+        """
+        Scrape the first review page of the claimed hotel, and enqueue the other pages by url: they are claimed
+        independently by the workers of the pool. The hotel job waits for its pages, the last one finishes it
+        """
+        self._setup_page()
+        self._push_all_languages_button()
+        self._get_hotel_page_reviews_number()
+        checkpoint_page_number_set = self._get_checkpoint_page_number_set()
+        if checkpoint_page_number_set != set():
+            logging.info(f'Resuming hotel: {len(checkpoint_page_number_set)} of {self._get_review_pages_number()} pages already committed, last offset {max(checkpoint_page_number_set) * self.reviews_per_page}')
+        self.page_number = 0
+        if 0 not in checkpoint_page_number_set:
             self._scrape_review_page()
-            self._increase_review_page()
-        logging.info('Iterated all reviews pages for the hotel. Going to next hotel')
+            self.db_writer.flush(force=True) # first page committed before its hotel waits on the other pages
+        review_page_url_list = [self._get_review_page_url(self.hotel_url, page_number) for page_number in range(1, self._get_review_pages_number()) if page_number not in checkpoint_page_number_set]
+        self.page_job_queue.enqueue_urls(self.hotel_id, review_page_url_list, priority=1)
+        self.job_queue.park(self.job_id)
+        self._finish_hotel_if_done(self.hotel_id, self.hotel_page_reviews_number)
+        return
+
+    def _scrape_page_job(self, review_page_url):
+        """ Scrape a review page claimed from the page jobs, loading it directly by url """
+        self.hotel_url = self._get_hotel_url(review_page_url)
+        if self.all_languages_flag == False: # first page of this browser session, set the language filter on the hotel page
+            self._setup_page()
+            self._push_all_languages_button()
+        self.url = review_page_url
+        self.page_number = self._get_review_page_number(review_page_url)
+        self._get_page()
+        self._scrape_review_page()
+        self._get_hotel_page_reviews_number() # before completing: if it fails, the page is retried
+        self.db_writer.after_commit(functools.partial(self._finish_page_job, self.page_job_id, self.hotel_id, self.hotel_page_reviews_number))
+        self.db_writer.flush()
+        return
+
+    def _finish_page_job(self, page_job_id, hotel_id, hotel_page_reviews_number):
+        """ Complete a page job once its reviews are committed, and finish its hotel if it was the last page """
+        self.page_job_queue.complete(page_job_id)
+        self._finish_hotel_if_done(hotel_id, hotel_page_reviews_number)
+        return
+
+    def _fail_page_job(self, page_job_id, hotel_id):
+        """ Fail a page job. If it failed for good and no page of the hotel is left, the waiting hotel job is failed too, to be retried """
+        self.page_job_queue.fail(page_job_id)
+        if self.page_job_queue.count_open(hotel_id) == 0:
+            self.job_queue.finish_waiting(hotel_id, success=False) # checkpoints are kept, the retry scrapes the missing pages only
+        return
+
+    def _refresh_hotel(self):
+        """
+        Scrape the review pages of the claimed hotel, sorted newest first, stopping at the first page with only known reviews.
+        If the sort can't be selected, new reviews can be on any page: all the pages are scraped
+        """
+        self._setup_page()
+        self._push_all_languages_button()
+        newest_first_flag = self._push_newest_first_sort()
+        self._get_hotel_page_reviews_number()
+        for self.page_number in range(self._get_review_pages_number()):
+            if self.page_number > 0:
+                self.url = self._get_review_page_url(self.hotel_url, self.page_number)
+                self._get_page()
+            self._scrape_review_page()
+            if self.new_reviews_number == 0 and newest_first_flag:
+                logging.info(f'Only known reviews in page {self.page_number}, hotel refreshed')
+                break
+            self.job_queue.renew(self.job_id) # keep the lease on hotels with many new reviews
+        return
+
+    def _finish_hotel_if_done(self, hotel_id, hotel_page_reviews_number):
+        """
+        If no page of the hotel is left, check the reviews number and finish the waiting hotel job.
+        Called once the pages are committed, the hotel job is finished once the flag is committed too
+        """
+        if self.page_job_queue.count_open(hotel_id) > 0:
+            return
+        self._get_hotel_scraped_reviews_number(hotel_id)
+        if (self.hotel_scraped_reviews_number < hotel_page_reviews_number or self.hotel_scraped_reviews_number > hotel_page_reviews_number + 10):
+            logging.error('Missing reviews for the hotel, not updating the reviews flag')
+            self.job_queue.finish_waiting(hotel_id, success=False) # checkpoints are kept, the retry scrapes the missing pages only
+            return
+        self.db_writer.delete_rows('REVIEW_CHECKPOINT', condition=f'hotel_id={hotel_id}') # hotel done: a refresh starts from the first page
+        self.db_writer.after_commit(functools.partial(self.job_queue.finish_waiting, hotel_id, success=True))
+        self._update_flag(table='RESULT', column='reviews_scraped_flag', value=True, condition=f'id={hotel_id}') # committed with the checkpoints delete
+        logging.info('Finished hotel')
         return
 
 
@@ -226,33 +304,66 @@ class ReviewIterator(BaseIterator):
             try:
                 self._get_page()
                 self._check_page(class_to_check='WMndO.f') # check presence of element
-                self._wait_humanly()
                 logging.info('Setup page')
                 break
             except Exception as e:
                 retries += 1
                 logging.error(f'Page not setup: error getting page, retry {retries}')
                 logging.exception('An error occurred')
-                self._wait_humanly()
                 continue        
         return
     
+    def _push_newest_first_sort(self):
+        """
+        Sort the reviews by 'Most recent' in the 'Sort by' menu, for the incremental refresh: the default order of the site
+        may be by relevance. Kept by the site for the next pages, like the language filter. Retries implemented. Return True if sorted
+        """
+        retries = 0
+        while retries < 5:
+            try:
+                previous_review_url = self.driver.execute_script(FIRST_REVIEW_URL_SCRIPT)
+                wait = WebDriverWait(self.driver, 5)
+                sort_button = self.driver.find_element('xpath', "//button[.//*[contains(text(),'Sort by')] or contains(@aria-label,'Sort by')]")
+                if 'Most recent' in sort_button.text:
+                    logging.info('Reviews already sorted by most recent')
+                    return True
+                wait.until(EC.element_to_be_clickable(sort_button)).click()
+                most_recent_option = wait.until(EC.element_to_be_clickable(('xpath', "//*[@role='menuitem' or @role='option' or @role='radio'][contains(.,'Most recent')]")))
+                most_recent_option.click()
+                logging.info('Sorted reviews by most recent')
+                try:
+                    self._wait_review_cards_changed(previous_review_url, timeout=10)
+                except TimeoutException: # same first review in both orders
+                    logging.info('Review cards not changed by the sort')
+                return True
+            except Exception as e:
+                retries += 1
+                logging.error(f'Error sorting reviews by most recent, retry {retries}')
+                logging.exception('An error occurred')
+                continue
+        logging.error('Reviews not sorted by most recent, refreshing all the pages of the hotel')
+        return False
+
     def _push_all_languages_button(self):
         """ Click on 'All languages' button. Retries implemented """
         retries = 0
         while retries < 5:
             try:
                 all_languages_button = self.driver.find_element('xpath', "//span[contains(text(),'All languages')]")
+                previous_review_url = self.driver.execute_script(FIRST_REVIEW_URL_SCRIPT)
                 wait = WebDriverWait(self.driver, 5)
                 wait.until(EC.element_to_be_clickable(all_languages_button)).click()
                 logging.info('Clicked All languages button')
-                self._wait_humanly()
+                try:
+                    self._wait_review_cards_changed(previous_review_url, timeout=10)
+                except TimeoutException: # same first review in all languages
+                    logging.info('Review cards not changed by All languages button')
+                self.all_languages_flag = True
                 break
             except Exception as e:
                 retries += 1
                 logging.error(f'Error clicking All languages button, retry {retries}')
                 logging.exception('An error occurred')
-                self._wait_humanly()
                 continue
         return 
 
@@ -262,27 +373,107 @@ class ReviewIterator(BaseIterator):
 
     # run method (pages iteration)
 
+    def _setup_tables(self, connection):
+        """ Migrate the db, and create the review checkpoints, before the first review is written """
+        migrate(connection) # review stats triggers, before the first review is written. Fingerprint columns
+        connection.executescript((DDL_FOLDER_PATH / 'G_REVIEW_CHECKPOINT.sql').read_text())
+        return
+
     def _subclass_run(self):
-        """ Iterate over hotel pages """
+        """
+        Iterate over hotels and their review pages. Pages of hotels in progress are claimed first, from the page jobs,
+        otherwise the next hotel is claimed: its first page is scraped and its other pages are enqueued
+        """
+        if self.incremental:
+            self._subclass_refresh()
+            return
+        self.job_queue = JobQueue(DB_FOLDER_PATH/self.db_name, kind='review')
+        self.page_job_queue = JobQueue(DB_FOLDER_PATH/self.db_name, kind='review_page')
+        self.job_queue.enqueue_from_result(condition='hotel_scraped_flag=1 and reviews_scraped_flag=0 and hotel_page_missing_flag=0', page_kind='review_page')
         while True:
             try:
-                self.continue_hotel_flag = True # reset flag
-                self.hotel_id, self.hotel_url = self._get_row_from_db(table='RESULT', column_list=['id', 'url'], condition='hotel_scraped_flag=1 and reviews_scraped_flag=0 and hotel_page_missing_flag=0')
-                if (self.hotel_id == None and self.hotel_url == None): # no more hotels to scrape reviews of
+                self.job_id, self.page_job_id = None, None # not failing the previous jobs if a claim fails
+                self.page_job_id, self.hotel_id, review_page_url = self.page_job_queue.claim()
+                if self.page_job_id is not None:
+                    self._scrape_page_job(review_page_url)
+                    continue
+                self.job_id, self.hotel_id, self.hotel_url = self.job_queue.claim()
+                if self.job_id is None: # no more hotels to scrape reviews of
                     logging.info('No more hotels to scrape reviews of')
                     break
+                self._scrape_first_page()
+            except Exception as e:
+                logging.error('Error iterating hotel or review page, going to next job')
+                logging.exception('An error occurred')
+                self._fail_page_job(self.page_job_id, self.hotel_id) if self.page_job_id is not None else None
+                self.job_queue.fail(self.job_id) if self.job_id is not None else None
+                continue
+        logging.info('Iterated all hotels. Done')
+        return
+
+    def _subclass_refresh(self):
+        """
+        Iterate over scraped hotels with new reviews, refreshing them. Hotels whose reviews number in RESULT
+        equals the reviews in the db are not enqueued, so they're skipped without loading any page
+        """
+        self.job_queue = JobQueue(DB_FOLDER_PATH/self.db_name, kind='review_refresh')
+        self.job_queue.enqueue_from_result(condition="""
+            hotel_scraped_flag=1 and reviews_scraped_flag=1 and hotel_page_missing_flag=0 and id in (
+                select RESULT.ID from RESULT
+                left join HOTEL_REVIEW_STATS on HOTEL_REVIEW_STATS.HOTEL_ID=RESULT.ID
+                where RESULT.REVIEWS > coalesce(HOTEL_REVIEW_STATS.REVIEWS, 0)
+            )
+        """)
+        while True:
+            try:
+                self.job_id = None # not failing the previous job if the claim fails
+                self.job_id, self.hotel_id, self.hotel_url = self.job_queue.claim()
+                if self.job_id is None: # no more hotels to refresh
+                    logging.info('No more hotels to refresh')
+                    break
+                self._refresh_hotel()
+                self.db_writer.after_commit(functools.partial(self.job_queue.complete, self.job_id))
+                self.db_writer.flush()
+            except Exception as e:
+                logging.error('Error refreshing hotel, going to next hotel')
+                logging.exception('An error occurred')
+                self.job_queue.fail(self.job_id) if self.job_id is not None else None
+                continue
+        logging.info('Refreshed all hotels. Done')
+        return
+
+    def _subclass_fetch(self, page_queue):
+        """ Iterate over hotels and their review pages by url, putting the pages in the pipeline instead of scraping them """
+        self.job_queue = JobQueue(DB_FOLDER_PATH/self.db_name, kind='review')
+        self.job_queue.enqueue_from_result(condition='hotel_scraped_flag=1 and reviews_scraped_flag=0 and hotel_page_missing_flag=0')
+        while True:
+            try:
+                self.job_id, self.hotel_id, self.hotel_url = self.job_queue.claim()
+                if self.job_id is None: # no more hotels to fetch reviews of
+                    logging.info('No more hotels to fetch reviews of')
+                    break
                 self._setup_page()
                 self._push_all_languages_button()
-                self._sub_iterate_reviews_pages()
                 self._get_hotel_page_reviews_number()
-                self._get_hotel_scraped_reviews_number()
-                if (self.hotel_scraped_reviews_number < self.hotel_page_reviews_number or self.hotel_scraped_reviews_number > self.hotel_page_reviews_number + 10):
-                    logging.error('Missing reviews for the hotel, skipping to next hotel without updating the reviews flag')
-                    continue
-                self._update_flag(table='RESULT', column='reviews_scraped_flag', value=True, condition=f'id={self.hotel_id}')
+                for page_number in range(self._get_review_pages_number()):
+                    if page_number > 0:
+                        self.url = self._get_review_page_url(self.hotel_url, page_number)
+                        self._get_page()
+                    self._check_page(class_to_check='azLzJ.MI.Gi.z.Z.BB.kYVoW') # wait for comment boxes to load
+                    self._put_snapshot(page_queue, 'review', hotel_id=self.hotel_id, page_number=page_number)
+                    self.job_queue.renew(self.job_id) # keep the lease on big hotels
+                self._put_job_done(page_queue, self.hotel_id, pages=self._get_review_pages_number(), reviews_number=self.hotel_page_reviews_number) # reviews count is checked by the writer
+                logging.info('Fetched all reviews pages for the hotel. Going to next hotel')
             except Exception as e:
-                logging.error('Error iterating hotel, going to next hotel')
+                logging.error('Error fetching hotel, going to next hotel')
                 logging.exception('An error occurred')
+                self.job_queue.fail(self.job_id) if self.job_id is not None else None
                 continue
-        logging.info('Iterated all hotels. Done')
-        return
\ No newline at end of file
+        logging.info('Fetched all hotels. Done')
+        return
+
+    def _quit(self):
+        """ Close the page job queue too """
+        self.page_job_queue.close() if self.page_job_queue is not None else None
+        super()._quit()
+        return
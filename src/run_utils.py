@@ -0,0 +1,22 @@
+import logging
+import hashlib
+from _config import LOG_FOLDER_PATH
+
+
+# Helpers shared by the iterators and the stages run without a browser (migration, pipeline, reparse, geocoding, ...).
+# Kept apart from base_iterator, so that those don't import selenium
+
+
+def set_logging(test=True, log_file_name='test.log'):
+    """ Log to console if test, to file otherwise """
+    if test:
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s') # log to console
+    else:
+        logging.basicConfig(filename=LOG_FOLDER_PATH/log_file_name, filemode='a', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')  # log to file
+    return
+
+def get_hashed_id(string):
+    hash_value = hashlib.sha256(string.encode()).hexdigest() # Calculate the SHA-256 hash of the string
+    hash_int = int(hash_value, 16) # Convert the hexadecimal hash value to an integer
+    truncated_hash = hash_int % (10 ** 18) # Truncate the integer to 20 digits. It has sufficient collision resistance for this use case
+    return truncated_hash
@@ -0,0 +1,100 @@
+import logging # settings inherited from the caller
+import math
+from run_utils import set_logging
+from db_connection import get_connection
+from _config import DB_FOLDER_PATH, DDL_FOLDER_PATH
+
+
+# Spatial index: an R-tree on the location of each hotel (HOTEL_LOCATION_RTREE), kept in sync by triggers on
+# HOTEL_MAPQUEST_LOCATION and HOTEL. Queries read the candidates in a bounding box from the R-tree, then refine
+# them with the haversine distance. Boxes don't wrap around the antimeridian, fine for a city
+
+
+EARTH_RADIUS_METERS = 6371008.8
+
+
+def haversine_distance(latitude_1, longitude_1, latitude_2, longitude_2):
+    """ Great circle distance in meters between two points, in degrees """
+    latitude_1, longitude_1, latitude_2, longitude_2 = map(math.radians, (latitude_1, longitude_1, latitude_2, longitude_2))
+    a = math.sin((latitude_2 - latitude_1) / 2) ** 2 + math.cos(latitude_1) * math.cos(latitude_2) * math.sin((longitude_2 - longitude_1) / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * math.asin(min(1, math.sqrt(a)))
+
+def _get_bounding_box(latitude, longitude, meters):
+    """ Box around a point containing the circle of radius meters, as (min latitude, max latitude, min longitude, max longitude) """
+    latitude_delta = math.degrees(meters / EARTH_RADIUS_METERS)
+    min_latitude, max_latitude = max(-90, latitude - latitude_delta), min(90, latitude + latitude_delta)
+    if min_latitude == -90 or max_latitude == 90: # the circle contains a pole, all longitudes
+        return min_latitude, max_latitude, -180, 180
+    longitude_delta = math.degrees(math.asin(min(1, math.sin(meters / EARTH_RADIUS_METERS) / math.cos(math.radians(latitude)))))
+    return min_latitude, max_latitude, max(-180, longitude - longitude_delta), min(180, longitude + longitude_delta)
+
+
+class SpatialIndex:
+    """
+    Queries on the hotel locations through the R-tree: hotels in a box, within a distance of a point, nearest to a point.
+    Creating it installs the R-tree and its triggers, and builds the index if empty. Also registers HAVERSINE(lat, lon, lat, lon)
+    on the connection, for ad hoc queries
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        for ddl_file in ['B_HOTEL.sql', 'E_GEOCODE.sql', 'K_HOTEL_LOCATION_RTREE.sql']: # triggers need their tables
+            self.connection.executescript((DDL_FOLDER_PATH / ddl_file).read_text())
+        self.connection.create_function('HAVERSINE', 4, haversine_distance, deterministic=True)
+        if self.connection.execute('select count(*) from HOTEL_LOCATION_RTREE;').fetchone()[0] == 0:
+            self.rebuild()
+        return
+
+    def rebuild(self):
+        """ Build the index again from the locations in the db. Left to the caller's transaction. Return the number of hotels """
+        self.connection.execute('delete from HOTEL_LOCATION_RTREE;')
+        self.connection.execute('insert into HOTEL_LOCATION_RTREE select ID, LATITUDE, LATITUDE, LONGITUDE, LONGITUDE, LATITUDE, LONGITUDE from HOTEL_LOCATION;')
+        hotels = self.connection.execute('select changes();').fetchone()[0]
+        logging.info(f'Built spatial index: {hotels} hotels')
+        return hotels
+
+    def get_hotels_in_box(self, min_latitude, max_latitude, min_longitude, max_longitude):
+        """ Hotels in a box, as (hotel id, latitude, longitude) """
+        return self.connection.execute("""
+            select ID, LATITUDE, LONGITUDE from HOTEL_LOCATION_RTREE
+            where MAX_LATITUDE>=? and MIN_LATITUDE<=? and MAX_LONGITUDE>=? and MIN_LONGITUDE<=?
+            and LATITUDE between ? and ? and LONGITUDE between ? and ?;
+        """, (min_latitude, max_latitude, min_longitude, max_longitude, min_latitude, max_latitude, min_longitude, max_longitude)).fetchall() # bounds are rounded, exact check on the coordinates
+
+    def get_hotels_within(self, latitude, longitude, meters):
+        """ Hotels within meters of a point, as (hotel id, distance in meters), nearest first """
+        hotel_distance_list = [
+            (hotel_id, haversine_distance(latitude, longitude, hotel_latitude, hotel_longitude))
+            for hotel_id, hotel_latitude, hotel_longitude in self.get_hotels_in_box(*_get_bounding_box(latitude, longitude, meters))
+        ]
+        return sorted([(hotel_id, distance) for hotel_id, distance in hotel_distance_list if distance <= meters], key=lambda hotel_distance: hotel_distance[1])
+
+    def get_nearest_hotels(self, latitude, longitude, k=10, initial_meters=500):
+        """
+        The k hotels nearest to a point, as (hotel id, distance in meters), nearest first.
+        The radius is doubled until it contains k hotels: they are then the k nearest
+        """
+        meters = initial_meters
+        while True:
+            hotel_distance_list = self.get_hotels_within(latitude, longitude, meters)
+            if len(hotel_distance_list) >= k or meters >= math.pi * EARTH_RADIUS_METERS: # the whole earth, fewer than k hotels
+                return hotel_distance_list[:k]
+            meters *= 2
+
+
+def run_spatial_index(test=True, log_file_name='spatial.log', db_name='test.db'):
+    """ Rebuild the spatial index of the hotel locations, like after locations written before the triggers existed """
+    set_logging(test, log_file_name)
+    connection = get_connection(DB_FOLDER_PATH/db_name)
+    try:
+        spatial_index = SpatialIndex(connection)
+        hotels = spatial_index.rebuild()
+        connection.commit()
+    except Exception as e:
+        connection.rollback()
+        logging.error('Error building spatial index')
+        logging.exception('An error occurred')
+        raise e
+    finally:
+        connection.close()
+    return hotels
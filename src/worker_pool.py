@@ -0,0 +1,67 @@
+import logging
+import multiprocessing
+from run_utils import set_logging
+from db_writer import GroupCommitWriter, QueueDbWriter
+from db_connection import get_connection
+from rate_limiter import RateLimiter
+from _config import DB_FOLDER_PATH, REQUESTS_PER_MINUTE, REQUESTS_BURST, DB_MAX_GROUP
+
+
+# Worker pool: N iterator processes, each driving its own browser with its own user data dir.
+# Workers claim hotels from the shared JOB queue, and send their rows to a single db writer process.
+# Page loads of all workers go through the same rate limiter, to keep the total load on the site bounded
+
+
+def _run_db_writer(db_name, row_queue, ack_queue_list, test, log_file_name):
+    """ Db writer process. Flushes of the workers are committed in groups, then acknowledged """
+    set_logging(test, log_file_name)
+    connection = get_connection(DB_FOLDER_PATH/db_name)
+    logging.info('Started db writer')
+    try:
+        GroupCommitWriter(connection, row_queue, ack_queue_list, max_group=DB_MAX_GROUP).run()
+    finally:
+        connection.close()
+    logging.info('Stopped db writer')
+    return
+
+def _run_worker(iterator_class, worker_id, row_queue, ack_queue, rate_limiter, test, log_file_name, db_name, iterator_kwargs):
+    """ Worker process. Runs an iterator with its own browser, writing through the db writer """
+    iterator = iterator_class(
+        test=test,
+        log_file_name=log_file_name.replace('.log', f'_{worker_id}.log'),
+        db_name=db_name,
+        db_connection=True, # kept for reads and for the job queue
+        browser_driver=True,
+        worker_id=worker_id,
+        db_writer=QueueDbWriter(worker_id, row_queue, ack_queue),
+        rate_limiter=rate_limiter,
+        **(iterator_kwargs or {})
+    )
+    iterator.run()
+    return
+
+def run_worker_pool(iterator_class, workers=2, requests_per_minute=REQUESTS_PER_MINUTE, burst=REQUESTS_BURST, test=True, log_file_name='test.log', db_name='test.db', iterator_kwargs=None):
+    """ Run workers iterators in parallel, until the job queue is empty. iterator_kwargs are passed to each iterator """
+    set_logging(test, log_file_name)
+    logging.info(f'Starting worker pool: {iterator_class.__name__}, {workers} workers, {requests_per_minute} requests per minute')
+    rate_limiter = RateLimiter(requests_per_minute, burst)
+    row_queue = multiprocessing.Queue()
+    ack_queue_list = [multiprocessing.Queue() for i in range(workers)]
+    db_writer_process = multiprocessing.Process(target=_run_db_writer, args=(db_name, row_queue, ack_queue_list, test, log_file_name), name='db_writer')
+    db_writer_process.start()
+    worker_process_list = []
+    for worker_id in range(workers):
+        worker_process = multiprocessing.Process(
+            target=_run_worker,
+            args=(iterator_class, worker_id, row_queue, ack_queue_list[worker_id], rate_limiter, test, log_file_name, db_name, iterator_kwargs),
+            name=f'worker_{worker_id}'
+        )
+        worker_process.start()
+        worker_process_list.append(worker_process)
+    for worker_process in worker_process_list:
+        worker_process.join()
+        logging.info(f'Worker finished: {worker_process.name}, exit code {worker_process.exitcode}')
+    row_queue.put(None) # stop db writer
+    db_writer_process.join()
+    logging.info('Worker pool finished')
+    return
@@ -0,0 +1,20 @@
+# tests run on the modules of src, as _main.py does
+import sys
+from pathlib import Path
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+
+@pytest.fixture(scope='session')
+def driver():
+    """ Headless browser, to run the scripts of page_scripts. Skipped where no browser can be started """
+    webdriver = pytest.importorskip('selenium.webdriver')
+    chrome_options = webdriver.ChromeOptions()
+    chrome_options.add_argument('--headless=new')
+    try:
+        driver = webdriver.Chrome(options=chrome_options)
+    except Exception as e:
+        pytest.skip(f'No browser: {e}')
+    yield driver
+    driver.quit()
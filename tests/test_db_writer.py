@@ -0,0 +1,86 @@
+import queue
+import sqlite3
+import time
+import pytest
+from db_writer import DbWriter, GroupCommitWriter
+
+
+@pytest.fixture
+def connection(tmp_path):
+    connection = sqlite3.connect(tmp_path / 'test.db')
+    connection.execute('create table T (ID int primary key, A int, B varchar);')
+    connection.commit()
+    yield connection
+    connection.close()
+
+
+def _run_group_commit_writer(connection, message_list, workers):
+    """ Write the messages with a GroupCommitWriter, as a single group. Return the acks of each worker """
+    row_queue = queue.Queue()
+    ack_queue_list = [queue.Queue() for i in range(workers)]
+    for message in message_list:
+        row_queue.put(message)
+    row_queue.put(None)
+    GroupCommitWriter(connection, row_queue, ack_queue_list).run()
+    return [[ack_queue.get() for i in range(ack_queue.qsize())] for ack_queue in ack_queue_list]
+
+
+def test_null_values_and_booleans(connection):
+    db_writer = DbWriter(connection)
+    db_writer.insert_replace_row('T', {'id': 1, 'a': None, 'b': None})
+    db_writer.insert_replace_row('T', {'id': 2, 'a': True, 'b': 'x'})
+    db_writer.flush()
+    assert connection.execute('select * from T order by ID;').fetchall() == [(1, -1, 'NA'), (2, 1, 'x')]
+
+
+def test_failed_flush_is_rolled_back(connection):
+    db_writer = DbWriter(connection)
+    db_writer.insert_replace_row('T', {'id': 1, 'a': 1, 'b': 'x'})
+    db_writer.update_flag('MISSING', 'A', 1, '1=1')
+    with pytest.raises(sqlite3.OperationalError):
+        db_writer.flush()
+    db_writer.insert_replace_row('T', {'id': 2, 'a': 2, 'b': 'y'})
+    db_writer.flush()
+    assert connection.execute('select ID from T;').fetchall() == [(2,)]
+
+
+def test_group_commit_writer_recovers_from_full_buffer_error(connection):
+    """ A bad statement executed by a full buffer, outside flush, refuses only its own message, not the next ones """
+    bad_op_list = [('insert_replace_row', 'T', {'id': i, 'a': i, 'b': 'x'}) for i in range(999)] + [('update_flag', 'MISSING', 'A', 1, '1=1')]
+    good_op_list = [('insert_replace_row', 'T', {'id': 1000, 'a': 1000, 'b': 'y'})]
+    later_op_list = [('insert_replace_row', 'T', {'id': 1001, 'a': 1001, 'b': 'z'})]
+    ack_list = _run_group_commit_writer(connection, [(0, bad_op_list), (1, good_op_list), (1, later_op_list)], workers=2)
+    assert len(ack_list[0]) == 1 and 'MISSING' in ack_list[0][0]
+    assert ack_list[1] == [True, True]
+    assert connection.execute('select ID from T order by ID;').fetchall() == [(1000,), (1001,)]
+
+
+def test_fingerprint_upsert_writes_only_changed_rows(connection):
+    connection.execute('create table F (ID int primary key, A int, B varchar, C varchar, FINGERPRINT int);')
+    connection.execute("insert into F (ID, C) values (1, 'kept');")
+    connection.commit()
+    db_writer = DbWriter(connection)
+    for b in ['x', 'x', 'y']:
+        db_writer.upsert_row('F', {'id': 1, 'a': 1, 'b': b})
+        db_writer.flush()
+    assert db_writer.change_dict['F'] == [3, 2] # the first write sets the fingerprint, the same row again costs no write
+    assert connection.execute('select A, B, C from F;').fetchall() == [(1, 'y', 'kept')]
+
+
+def test_user_fingerprint_cache_expires(connection):
+    """ Cached fingerprints skip the rows written again, until they expire: then a change by another writer is overwritten """
+    connection.execute('create table USER (ID int primary key, NAME varchar, FINGERPRINT int);')
+    connection.commit()
+    db_writer = DbWriter(connection, fingerprint_cache_seconds=0.2)
+    other_db_writer = DbWriter(connection)
+    db_writer.upsert_row('USER', {'id': 1, 'name': 'a'})
+    db_writer.flush()
+    other_db_writer.upsert_row('USER', {'id': 1, 'name': 'b'})
+    other_db_writer.flush()
+    db_writer.upsert_row('USER', {'id': 1, 'name': 'a'})
+    db_writer.flush()
+    assert connection.execute('select NAME from USER;').fetchall() == [('b',)] # skipped, as cached
+    time.sleep(0.3)
+    db_writer.upsert_row('USER', {'id': 1, 'name': 'a'})
+    db_writer.flush()
+    assert connection.execute('select NAME from USER;').fetchall() == [('a',)]
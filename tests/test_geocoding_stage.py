@@ -0,0 +1,39 @@
+import sqlite3
+from types import SimpleNamespace
+import pytest
+
+pytest.importorskip('geopy')
+from geocoding_stage import GeocodingStage
+from _config import DDL_FOLDER_PATH
+
+
+class StubGeocoder:
+    """ Geocoder resolving every address to the same point, recording its calls """
+
+    def __init__(self):
+        self.address_list = []
+        return
+
+    def geocode(self, address):
+        self.address_list.append(address)
+        return SimpleNamespace(latitude=41.9, longitude=12.5, altitude=0.0)
+
+
+def test_geocoding_stage_fills_hotels_and_reuses_the_cache(tmp_path):
+    db_path = tmp_path / 'test.db'
+    connection = sqlite3.connect(db_path)
+    connection.executescript((DDL_FOLDER_PATH / 'B_HOTEL.sql').read_text())
+    hotel_list = [(1, 'Via Roma 1, 00100 Rome Italy'), (2, 'via roma 1 00100  Rome, Italy')] # same address, normalized
+    connection.executemany('insert into HOTEL (ID, ADDRESS) values (?, ?);', hotel_list)
+    connection.commit()
+    geocoder = StubGeocoder()
+    geocoding_stage = GeocodingStage(db_path, geocoder=geocoder, min_interval=0)
+    geocoding_stage.start()
+    for hotel_id, address in hotel_list:
+        geocoding_stage.submit(hotel_id, address)
+    geocoding_stage.stop()
+    assert connection.execute('select ID, LATITUDE, LONGITUDE from HOTEL order by ID;').fetchall() == [(1, 41.9, 12.5), (2, 41.9, 12.5)]
+    assert geocoder.address_list == ['Via Roma 1, 00100 Rome Italy']
+    assert geocoding_stage.counter_dict['cached'] == 1
+    assert connection.execute('select count(*) from GEOCODE_CACHE where LATITUDE is not null;').fetchone()[0] == 1
+    connection.close()
@@ -0,0 +1,128 @@
+import json
+import sqlite3
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+
+from hotel_geocoder import HotelGeocoder
+from _config import DDL_FOLDER_PATH
+
+
+HOTEL_LIST = [(1, 'Via Roma 1, Rome'), (2, 'Via Milano 2, Rome'), (3, 'Via Napoli 3, Rome')]
+
+
+def _get_location(latitude, longitude):
+    """ Location of a batch response, with the fields written to HOTEL_MAPQUEST_LOCATION """
+    return {
+        'street': 'Via Roma 1', 'adminArea6': '', 'adminArea6Type': 'Neighborhood', 'adminArea5': 'Rome', 'adminArea5Type': 'City',
+        'adminArea4': 'Roma', 'adminArea4Type': 'County', 'adminArea3': 'Lazio', 'adminArea3Type': 'State', 'adminArea1': 'IT', 'adminArea1Type': 'Country',
+        'postalCode': '00100', 'geocodeQualityCode': 'P1AAA', 'geocodeQuality': 'POINT', 'dragPoint': False, 'sideOfStreet': 'N', 'linkId': '0',
+        'unknownInput': '', 'type': 's', 'latLng': {'lat': latitude, 'lng': longitude}, 'displayLatLng': {'lat': latitude, 'lng': longitude},
+        'mapUrl': ''
+    }
+
+
+class FakeMapQuest:
+    """
+    Local MapQuest batch endpoint, recording the request bodies. Answers the first throttled_requests requests with a 429,
+    and drops the last result if short_results
+    """
+
+    def __init__(self, throttled_requests=0, short_results=False):
+        self.throttled_requests = throttled_requests
+        self.short_results = short_results
+        self.request_list = []
+        self.lock = threading.Lock()
+        fake_mapquest = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with fake_mapquest.lock:
+                    fake_mapquest.request_list.append((self.path, body))
+                    throttled = len(fake_mapquest.request_list) <= fake_mapquest.throttled_requests
+                if throttled:
+                    self.send_response(429)
+                    self.end_headers()
+                    return
+                result_list = [
+                    {'providedLocation': {'location': address}, 'locations': [_get_location(41.9 + i / 100, 12.5)]}
+                    for i, address in enumerate(body['locations'])
+                ]
+                response = json.dumps({'results': result_list[:-1] if fake_mapquest.short_results else result_list}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+                return
+
+            def log_message(self, format, *args):
+                return
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.base_url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        return
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+        return
+
+
+def _get_db_path(tmp_path):
+    """ Db with scraped hotels to geocode """
+    db_path = tmp_path / 'test.db'
+    connection = sqlite3.connect(db_path)
+    for ddl_file in ['A_RESULT.sql', 'B_HOTEL.sql']:
+        connection.executescript((DDL_FOLDER_PATH / ddl_file).read_text())
+    connection.executemany('insert into RESULT (ID, HOTEL_SCRAPED_FLAG) values (?, 1);', [(hotel_id,) for hotel_id, address in HOTEL_LIST])
+    connection.executemany('insert into HOTEL (ID, ADDRESS) values (?, ?);', HOTEL_LIST)
+    connection.commit()
+    connection.close()
+    return db_path
+
+def _run_hotel_geocoder(db_path, fake_mapquest, **kwargs):
+    hotel_geocoder = HotelGeocoder(test=True, db_name=str(db_path), base_url=fake_mapquest.base_url, api_key='key', requests_per_minute=60000, **kwargs) # absolute db_name, out of the db folder
+    hotel_geocoder.run()
+    return hotel_geocoder
+
+
+def test_batches_are_geocoded_and_written(tmp_path):
+    db_path = _get_db_path(tmp_path)
+    with FakeMapQuest() as fake_mapquest:
+        hotel_geocoder = _run_hotel_geocoder(db_path, fake_mapquest, batch_size=2, concurrency=2)
+    assert sorted(body['locations'] for path, body in fake_mapquest.request_list) == [['Via Napoli 3, Rome'], ['Via Roma 1, Rome', 'Via Milano 2, Rome']]
+    assert {path.split('?')[0] for path, body in fake_mapquest.request_list} == {'/geocoding/v1/batch'}
+    assert hotel_geocoder.counter_dict == {'hotels': 3, 'locations': 3, 'failed_batches': 0}
+    connection = sqlite3.connect(db_path)
+    assert connection.execute('select count(*) from RESULT where HOTEL_GEOCODED_FLAG=1;').fetchone()[0] == 3
+    assert connection.execute('select HOTEL_ID, RANK, LATITUDE, LONGITUDE from HOTEL_MAPQUEST_LOCATION order by HOTEL_ID;').fetchall() == [(1, 0, 41.9, 12.5), (2, 0, 41.91, 12.5), (3, 0, 41.9, 12.5)]
+    assert json.loads(connection.execute('select RESPONSE_RAW from HOTEL_MAPQUEST_RESPONSE where HOTEL_ID=2;').fetchone()[0])['providedLocation'] == {'location': 'Via Milano 2, Rome'}
+    assert connection.execute("select LATITUDE, SOURCE from GEOCODE_CACHE where ADDRESS_KEY='via milano 2 rome';").fetchone() == (41.91, 'mapquest')
+    connection.close()
+
+def test_throttled_batch_backs_off_and_is_retried(tmp_path):
+    db_path = _get_db_path(tmp_path)
+    with FakeMapQuest(throttled_requests=1) as fake_mapquest:
+        hotel_geocoder = _run_hotel_geocoder(db_path, fake_mapquest, batch_size=3, concurrency=1)
+    assert len(fake_mapquest.request_list) == 2
+    assert hotel_geocoder.counter_dict['hotels'] == 3
+    domain = fake_mapquest.base_url.split('://')[1]
+    assert hotel_geocoder.rate_limiter.backoff_dict[domain].value == pytest.approx(4 * 0.9) # 429: backoff 4x, then brought back by the success
+
+def test_batch_with_missing_results_fails_after_retries(tmp_path):
+    db_path = _get_db_path(tmp_path)
+    with FakeMapQuest(short_results=True) as fake_mapquest:
+        hotel_geocoder = _run_hotel_geocoder(db_path, fake_mapquest, batch_size=3, concurrency=1)
+    assert len(fake_mapquest.request_list) == 3
+    assert hotel_geocoder.counter_dict == {'hotels': 0, 'locations': 0, 'failed_batches': 1}
+    connection = sqlite3.connect(db_path)
+    assert connection.execute('select count(*) from RESULT where HOTEL_GEOCODED_FLAG=0;').fetchone()[0] == 3 # left for the next run
+    assert connection.execute('select count(*) from HOTEL_MAPQUEST_LOCATION;').fetchone()[0] == 0
+    connection.close()
@@ -0,0 +1,18 @@
+from pathlib import Path
+from html_extractors import extract_review_cards
+
+REVIEW_PAGE_PATH = Path(__file__).resolve().parent / 'fixtures' / 'review_page.html'
+
+
+def test_review_texts_keep_their_line_breaks():
+    card_list = extract_review_cards(REVIEW_PAGE_PATH.read_text())
+    assert card_list[0]['text'] == 'Great location, friendly staff.\nThe room was small but clean.\n\nWould come back!'
+    assert card_list[0]['response_text'] == 'Dear Anna,\n\nthank you for staying with us.\nSee you soon!'
+    assert card_list[0]['user_name_shown'] == 'Anna R'
+    assert card_list[1]['text'] == 'Street noise all night.' # scripts and hidden elements are not text
+
+
+def test_extractors_match_page_scripts(driver):
+    from page_scripts import REVIEW_PAGE_SCRIPT
+    driver.get(REVIEW_PAGE_PATH.as_uri())
+    assert extract_review_cards(REVIEW_PAGE_PATH.read_text()) == driver.execute_script(REVIEW_PAGE_SCRIPT)
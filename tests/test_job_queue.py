@@ -0,0 +1,80 @@
+import sqlite3
+import pytest
+from job_queue import JobQueue
+from _config import DDL_FOLDER_PATH
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    db_path = tmp_path / 'test.db'
+    connection = sqlite3.connect(db_path)
+    connection.executescript((DDL_FOLDER_PATH / 'A_RESULT.sql').read_text())
+    connection.executemany('insert into RESULT (ID, URL) values (?, ?);', [(i, f'https://x/h{i}') for i in range(3)])
+    connection.commit()
+    connection.close()
+    return db_path
+
+
+def _get_job_queue(db_path, owner, kind='hotel', **kwargs):
+    """ Job queue of a worker, with its own owner as if in another process """
+    job_queue = JobQueue(db_path, kind=kind, **kwargs)
+    job_queue.owner = owner
+    return job_queue
+
+
+def test_claims_follow_priority_and_are_exclusive(db_path):
+    job_queue = _get_job_queue(db_path, 'a')
+    other_job_queue = _get_job_queue(db_path, 'b')
+    job_queue.enqueue_from_result('1=1')
+    job_queue.enqueue_hotels([(2, 5)])
+    claimed_list = [job_queue.claim()[1], other_job_queue.claim()[1], job_queue.claim()[1]]
+    assert claimed_list == [2, 0, 1]
+    assert other_job_queue.claim() == (None, None, None)
+
+
+def test_expired_lease_is_reclaimed(db_path):
+    job_queue = _get_job_queue(db_path, 'a', lease_seconds=-1) # expired as soon as claimed
+    other_job_queue = _get_job_queue(db_path, 'b')
+    job_queue.enqueue_from_result('ID=0')
+    job_id, hotel_id, url = job_queue.claim()
+    assert other_job_queue.claim()[0] == job_id
+    job_queue.complete(job_id) # lease lost, the new owner keeps the job
+    assert job_queue.connection.execute('select STATE, LEASE_OWNER from JOB;').fetchone() == ('leased', 'b')
+    other_job_queue.complete(job_id)
+    assert job_queue.connection.execute('select STATE from JOB;').fetchone() == ('done',)
+
+
+def test_failed_job_is_retried_up_to_max_attempts(db_path):
+    job_queue = _get_job_queue(db_path, 'a', max_attempts=2)
+    job_queue.enqueue_from_result('ID=0')
+    for state in ['pending', 'failed']:
+        job_id = job_queue.claim()[0]
+        job_queue.fail(job_id)
+        assert job_queue.connection.execute('select STATE from JOB;').fetchone() == (state,)
+    assert job_queue.claim() == (None, None, None)
+
+
+def test_waiting_job_is_finished_from_any_worker(db_path):
+    job_queue = _get_job_queue(db_path, 'a')
+    other_job_queue = _get_job_queue(db_path, 'b', lease_seconds=-1)
+    job_queue.enqueue_from_result('ID=0')
+    job_id = job_queue.claim()[0]
+    job_queue.park(job_id)
+    assert other_job_queue.claim() == (None, None, None) # waiting jobs are not reclaimed
+    other_job_queue.finish_waiting(0, success=True)
+    assert job_queue.connection.execute('select STATE from JOB;').fetchone() == ('done',)
+
+
+def test_stale_waiting_job_is_reset_by_enqueue(db_path):
+    job_queue = _get_job_queue(db_path, 'a')
+    page_job_queue = _get_job_queue(db_path, 'a', kind='hotel_page', max_attempts=1)
+    job_queue.enqueue_from_result('ID=0')
+    job_id = job_queue.claim()[0]
+    page_job_queue.enqueue_urls(0, ['https://x/h0-or10'])
+    job_queue.park(job_id)
+    page_job_queue.fail(page_job_queue.claim()[0]) # last page failed for good, in a stopped process
+    job_queue.enqueue_from_result('ID=0', page_kind='hotel_page')
+    assert job_queue.connection.execute('select STATE from JOB where ID=?;', (job_id,)).fetchone() == ('waiting',) # page finished less than a lease ago
+    stale_job_queue = _get_job_queue(db_path, 'a', lease_seconds=0)
+    stale_job_queue.enqueue_from_result('ID=0', page_kind='hotel_page')
+    assert stale_job_queue.claim()[0] == job_id
@@ -0,0 +1,45 @@
+import logging
+import sqlite3
+import pytest
+
+pytest.importorskip('langdetect')
+from language_detection import run_language_detection
+from run_utils import get_hashed_id
+from _config import DDL_FOLDER_PATH
+
+
+ENGLISH_TEXT = 'The room was clean and the staff were very friendly, we will come back next year.'
+ITALIAN_TEXT = 'La camera era pulita e il personale molto gentile, torneremo sicuramente il prossimo anno.'
+CACHED_TEXT = 'A text already detected in a previous run.'
+
+
+def _run_language_detection(db_path):
+    run_language_detection(processes=1, test=True, db_name=str(db_path), batch_size=2) # absolute db_name, out of the db folder
+    return
+
+def test_languages_are_detected_incrementally_from_the_cache(tmp_path, caplog):
+    db_path = tmp_path / 'test.db'
+    connection = sqlite3.connect(db_path)
+    connection.executescript((DDL_FOLDER_PATH / 'C_REVIEW.sql').read_text())
+    connection.executescript((DDL_FOLDER_PATH / 'I_LANGUAGE_CACHE.sql').read_text())
+    connection.execute('insert into LANGUAGE_CACHE (TEXT_HASH, LANGUAGE) values (?, ?);', (get_hashed_id(CACHED_TEXT), 'zz')) # not detectable as zz: read from the cache
+    connection.executemany('insert into REVIEW (ID, TEXT, RESPONSE_TEXT, LANGUAGE, RESPONSE_LANGUAGE) values (?, ?, ?, ?, ?);', [
+        (1, ENGLISH_TEXT, ITALIAN_TEXT, None, None),
+        (2, '...', None, None, None),
+        (3, CACHED_TEXT, 'NA', None, None),
+        (4, ITALIAN_TEXT, None, 'xx', 'xx'), # already detected, left as is
+    ])
+    connection.commit()
+    _run_language_detection(db_path)
+    assert connection.execute('select ID, LANGUAGE, RESPONSE_LANGUAGE from REVIEW order by ID;').fetchall() == [
+        (1, 'en', 'it'), (2, 'NA', 'NA'), (3, 'zz', 'NA'), (4, 'xx', 'xx')
+    ]
+    assert connection.execute('select count(*) from LANGUAGE_CACHE;').fetchone()[0] == 4 # cached text, the two texts and '...'
+    # a new review with a known text: only it is read, and its text is not detected again
+    connection.execute('insert into REVIEW (ID, TEXT, RESPONSE_TEXT) values (?, ?, ?);', (5, ITALIAN_TEXT, ENGLISH_TEXT))
+    connection.commit()
+    with caplog.at_level(logging.INFO):
+        _run_language_detection(db_path)
+    assert 'Language detection finished: 1 reviews, 0 texts detected' in caplog.messages
+    assert connection.execute('select LANGUAGE, RESPONSE_LANGUAGE from REVIEW where ID=5;').fetchone() == ('it', 'en')
+    connection.close()
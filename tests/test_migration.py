@@ -0,0 +1,36 @@
+import sqlite3
+import pytest
+from db_writer import DbWriter
+from migration import migrate, rebuild_review_stats
+
+
+@pytest.fixture
+def connection(tmp_path):
+    connection = sqlite3.connect(tmp_path / 'test.db')
+    migrate(connection)
+    yield connection
+    connection.close()
+
+
+def _get_stats(connection):
+    return connection.execute('select HOTEL_ID, REVIEWS, RATED_REVIEWS, RATING_SUM, LAST_REVIEW_DATE from HOTEL_REVIEW_STATS where REVIEWS>0 order by HOTEL_ID;').fetchall()
+
+
+def _upsert_reviews(connection, review_list):
+    db_writer = DbWriter(connection)
+    for review_id, hotel_id, rating, month, year in review_list:
+        db_writer.upsert_row('REVIEW', {'id': review_id, 'hotel_id': hotel_id, 'rating': rating, 'month_of_review': month, 'year_of_review': year})
+    db_writer.flush()
+    return
+
+
+def test_review_stats_triggers_match_a_rebuild(connection):
+    _upsert_reviews(connection, [(1, 10, 4, 3, 2024), (2, 10, 5, 1, 2025), (3, 10, None, None, None), (4, 20, 2, 6, 2023)])
+    assert _get_stats(connection) == [(10, 3, 2, 9, '2025-01'), (20, 1, 1, 2, '2023-06')]
+    _upsert_reviews(connection, [(1, 10, 4, 3, 2024), (2, 10, 3, 1, 2025), (4, 10, 2, 6, 2023)]) # same, changed rating, moved to another hotel
+    connection.execute('delete from REVIEW where ID=3;')
+    connection.commit()
+    trigger_stats = _get_stats(connection)
+    assert trigger_stats == [(10, 3, 3, 9, '2025-01')]
+    rebuild_review_stats(connection)
+    assert _get_stats(connection) == trigger_stats
@@ -0,0 +1,40 @@
+import pytest
+import rate_limiter
+from rate_limiter import RateLimiter
+
+URL = 'https://www.tripadvisor.com/Hotels'
+
+
+@pytest.fixture
+def sleep_list(monkeypatch):
+    """ Frozen clock: sleeps are recorded instead of waited """
+    sleep_list = []
+    monkeypatch.setattr(rate_limiter.time, 'time', lambda: 1000.0)
+    monkeypatch.setattr(rate_limiter.time, 'sleep', sleep_list.append)
+    return sleep_list
+
+
+def test_burst_then_wait_at_rate(sleep_list):
+    limiter = RateLimiter(requests_per_minute=60, burst=2, domain_list=['www.tripadvisor.com'])
+    for i in range(4):
+        limiter.wait(URL)
+    assert sleep_list == [1.0, 2.0] # after the burst, one token per second, taken in advance
+
+
+def test_other_domains_are_not_limited(sleep_list):
+    limiter = RateLimiter(requests_per_minute=60, burst=1, domain_list=['www.tripadvisor.com'])
+    for i in range(3):
+        limiter.wait('https://nominatim.openstreetmap.org/search')
+    assert sleep_list == []
+
+
+def test_throttling_empties_the_bucket_and_success_recovers(sleep_list):
+    limiter = RateLimiter(requests_per_minute=60, burst=5, max_backoff=16, domain_list=['www.tripadvisor.com'])
+    limiter.report_error(URL, throttled=True)
+    limiter.wait(URL)
+    assert sleep_list == [4.0] # empty bucket, refilled 4 times slower
+    limiter.report_error(URL)
+    limiter.report_error(URL, throttled=True)
+    assert limiter.backoff_dict['www.tripadvisor.com'].value == 16 # capped at max_backoff
+    limiter.report_success(URL)
+    assert limiter.backoff_dict['www.tripadvisor.com'].value == pytest.approx(14.4)
@@ -0,0 +1,40 @@
+from pathlib import Path
+from reparse import parse_page_source
+from page_parsers import parse_review_card
+from run_utils import get_hashed_id
+
+REVIEW_PAGE_PATH = Path(__file__).resolve().parent / 'fixtures' / 'review_page.html'
+REVIEW_PAGE_URL = 'https://www.tripadvisor.com/Hotel_Review-g187791-d1-Reviews-Hotel_Roma-Rome_Lazio.html'
+
+
+def _get_live_row_list(card_list, hotel_id):
+    """ Rows of the review cards extracted by the browser, as ReviewIterator builds them """
+    row_list = []
+    for card in card_list:
+        review_dict, user_dict = parse_review_card(card)
+        review_dict['id'] = get_hashed_id(review_dict['url'])
+        user_dict['id'] = get_hashed_id(user_dict['url'])
+        review_dict['user_id'] = user_dict['id']
+        review_dict['hotel_id'] = hotel_id
+        row_list.append(('REVIEW', review_dict))
+        row_list.append(('USER', user_dict))
+    return row_list
+
+
+def test_saved_review_page_is_reparsed():
+    row_list = parse_page_source('review', REVIEW_PAGE_PATH.read_text(), REVIEW_PAGE_URL, hotel_id=7)
+    assert [table for table, row_dict in row_list] == ['REVIEW', 'USER', 'REVIEW', 'USER']
+    review_dict, user_dict = row_list[0][1], row_list[1][1]
+    assert review_dict['url'] == 'https://www.tripadvisor.com/ShowUserReviews-g187791-d1-r100-Hotel_Roma-Rome_Lazio.html'
+    assert (review_dict['id'], review_dict['user_id'], review_dict['hotel_id']) == (get_hashed_id(review_dict['url']), user_dict['id'], 7)
+    assert (review_dict['rating'], review_dict['likes'], review_dict['month_of_stay'], review_dict['year_of_stay']) == (5, 3, 3, 2024)
+    assert review_dict['response_from'] == 'Response from Marco, Manager'
+    assert 'language' not in review_dict # left to the language detection stage
+    assert (user_dict['name'], user_dict['contributions'], user_dict['helpful_votes'], user_dict['location']) == ('anna_r', 1234, 56, 'Milan, Italy')
+    assert (row_list[2][1]['response_text'], row_list[3][1]['helpful_votes']) == ('NA', -1) # missing fields
+
+def test_reparse_matches_the_live_rows(driver):
+    from page_scripts import REVIEW_PAGE_SCRIPT
+    driver.get(REVIEW_PAGE_PATH.as_uri())
+    live_row_list = _get_live_row_list(driver.execute_script(REVIEW_PAGE_SCRIPT), hotel_id=7)
+    assert parse_page_source('review', REVIEW_PAGE_PATH.read_text(), REVIEW_PAGE_URL, hotel_id=7) == live_row_list
@@ -0,0 +1,48 @@
+import sqlite3
+import pytest
+
+from spatial_index import SpatialIndex, haversine_distance
+from _config import DDL_FOLDER_PATH
+
+
+# hotels around Rome, ~111 m per 0.001 degrees of latitude
+HOTEL_LIST = [(1, 41.900, 12.500), (2, 41.901, 12.500), (3, 41.910, 12.500), (4, 42.000, 12.500), (5, -1, -1)] # 5 not found
+
+
+def _get_spatial_index():
+    connection = sqlite3.connect(':memory:')
+    connection.executescript((DDL_FOLDER_PATH / 'B_HOTEL.sql').read_text())
+    connection.executemany('insert into HOTEL (ID, LATITUDE, LONGITUDE) values (?, ?, ?);', HOTEL_LIST[:2]) # indexed at creation
+    spatial_index = SpatialIndex(connection)
+    connection.executemany('insert into HOTEL (ID, LATITUDE, LONGITUDE) values (?, ?, ?);', HOTEL_LIST[2:]) # indexed by the trigger
+    return spatial_index
+
+def _insert_mapquest_location(connection, hotel_id, rank, latitude, longitude):
+    connection.execute('insert into HOTEL_MAPQUEST_LOCATION (ID, HOTEL_ID, RANK, LATITUDE, LONGITUDE) values (?, ?, ?, ?, ?);', (hotel_id * 10 + rank, hotel_id, rank, latitude, longitude))
+    return
+
+
+def test_box_radius_and_nearest_queries():
+    spatial_index = _get_spatial_index()
+    assert sorted(spatial_index.get_hotels_in_box(41.89, 41.95, 12.4, 12.6)) == [(1, 41.9, 12.5), (2, 41.901, 12.5), (3, 41.91, 12.5)]
+    hotel_distance_list = spatial_index.get_hotels_within(41.9, 12.5, 1200)
+    assert [hotel_id for hotel_id, distance in hotel_distance_list] == [1, 2, 3]
+    assert hotel_distance_list[2][1] == pytest.approx(haversine_distance(41.9, 12.5, 41.91, 12.5))
+    assert [hotel_id for hotel_id, distance in spatial_index.get_hotels_within(41.9, 12.5, 500)] == [1, 2]
+    assert [hotel_id for hotel_id, distance in spatial_index.get_nearest_hotels(41.9, 12.5, k=4, initial_meters=100)] == [1, 2, 3, 4]
+    assert len(spatial_index.get_nearest_hotels(41.9, 12.5, k=10)) == 4 # fewer hotels than k, not found hotel left out
+
+def test_mapquest_locations_take_precedence_over_hotel_coordinates():
+    spatial_index = _get_spatial_index()
+    connection = spatial_index.connection
+    _insert_mapquest_location(connection, 1, 0, 45.46, 9.19) # moved to Milan
+    _insert_mapquest_location(connection, 2, 1, 45.46, 9.19) # not the best location, ignored
+    _insert_mapquest_location(connection, 5, 0, 41.902, 12.5) # located by MapQuest only
+    assert [hotel_id for hotel_id, distance in spatial_index.get_hotels_within(41.9, 12.5, 500)] == [2, 5]
+    connection.execute('update HOTEL set LATITUDE=41.9005 where ID=1;') # HOTEL coordinates don't override the MapQuest location
+    assert [hotel_id for hotel_id, distance in spatial_index.get_hotels_within(45.46, 9.19, 100)] == [1]
+    connection.execute('delete from HOTEL_MAPQUEST_LOCATION where HOTEL_ID=1;') # back to the HOTEL coordinates
+    assert [hotel_id for hotel_id, distance in spatial_index.get_hotels_within(41.9, 12.5, 500)] == [1, 2, 5]
+    assert spatial_index.rebuild() == 5
+    assert [hotel_id for hotel_id, distance in spatial_index.get_hotels_within(41.9, 12.5, 500)] == [1, 2, 5]
+    connection.close()